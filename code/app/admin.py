@@ -1,6 +1,9 @@
 from django.contrib import admin
-from .models import EmailAccount, EmailMessage, Attachment
+from .models import EmailAccount, EmailMessage, Attachment, MailFolder, MessageContent, RawMessage
 
 admin.site.register(Attachment)
 admin.site.register(EmailMessage)
 admin.site.register(EmailAccount)
+admin.site.register(MailFolder)
+admin.site.register(MessageContent)
+admin.site.register(RawMessage)
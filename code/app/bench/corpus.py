@@ -0,0 +1,165 @@
+import base64
+import random
+from datetime import datetime, timedelta, timezone
+from email import policy
+from email.message import EmailMessage as MIMEMessage
+from email.utils import format_datetime
+
+# Доли типов писем в ящике по умолчанию
+DEFAULT_MIX = {'plain': 50, 'html': 25, 'multipart': 15, 'broken': 10}
+
+WORDS = (
+    'счёт', 'договор', 'встреча', 'отчёт', 'проект', 'оплата', 'поставка', 'письмо', 'вопрос', 'срок',
+    'сервер', 'релиз', 'задача', 'клиент', 'бюджет', 'квартал', 'подпись', 'акт', 'заявка', 'склад',
+    'invoice', 'meeting', 'report', 'release', 'deadline', 'customer', 'budget', 'shipment', 'review', 'update',
+)
+
+SENDERS = ('billing', 'noreply', 'support', 'ivan.petrov', 'team', 'news', 'hr', 'sales')
+
+ATTACHMENT_TYPES = (
+    ('application', 'pdf', 'pdf'),
+    ('image', 'png', 'png'),
+    ('application', 'vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+)
+
+START_DATE = datetime(2024, 1, 1, 12, 0, tzinfo=timezone(timedelta(hours=3)))
+
+
+def parse_mix(value):
+    """
+    Доли типов писем из строки 'plain=50,html=25,...'. Неуказанные типы не генерируются.
+    """
+    mix = {}
+    for item in value.split(','):
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind not in DEFAULT_MIX:
+            raise ValueError(f'Неизвестный тип писем: {kind}')
+        mix[kind] = int(weight)
+    if not any(mix.values()):
+        raise ValueError('Сумма долей типов писем должна быть больше нуля')
+    return mix
+
+
+def sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def paragraphs(rng, count):
+    return '\n\n'.join(' '.join(sentence(rng, rng.randint(6, 16)) for _ in range(rng.randint(2, 6)))
+                       for _ in range(count))
+
+
+def html_document(rng, rows):
+    """
+    HTML в духе рассылок: вложенные таблицы, инлайн-стили, скрытые блоки.
+    """
+    cells = ''.join(
+        f'<tr><td style="padding:8px;border-bottom:1px solid #e0e0e0;font-family:Arial,sans-serif;color:#333">'
+        f'<table width="100%"><tr><td><b>{rng.choice(WORDS)}</b></td>'
+        f'<td align="right" style="color:#888">{rng.randint(1, 99999)} ₽</td></tr></table>'
+        f'<p style="margin:4px 0;font-size:13px;line-height:18px">{sentence(rng, 20)}</p></td></tr>'
+        for _ in range(rows)
+    )
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><style>'
+        'body{margin:0;padding:0}.hidden{display:none}@media(max-width:600px){td{display:block}}'
+        '</style></head><body>'
+        f'<div class="hidden">{sentence(rng, 30)}</div>'
+        '<table width="600" cellpadding="0" cellspacing="0" align="center" style="background:#fff">'
+        f'{cells}</table>'
+        '<script>var tracking = 1;</script></body></html>'
+    )
+
+
+def base_message(number, rng, seed):
+    message = MIMEMessage(policy=policy.SMTP)
+    message['Subject'] = f'{sentence(rng, rng.randint(3, 8))[:-1]} №{number}'
+    message['From'] = f'{rng.choice(SENDERS)}@example.com'
+    message['To'] = 'bench@bench.local'
+    message['Date'] = format_datetime(START_DATE + timedelta(minutes=number))
+    message['Message-ID'] = f'<bench-{seed}-{number}@bench.local>'
+    return message
+
+
+def plain_message(number, rng, seed):
+    message = base_message(number, rng, seed)
+    message.set_content(paragraphs(rng, rng.randint(1, 8)))
+    return message.as_bytes()
+
+
+def html_message(number, rng, seed):
+    message = base_message(number, rng, seed)
+    message.set_content(html_document(rng, rng.randint(20, 120)), subtype='html')
+    return message.as_bytes()
+
+
+def multipart_message(number, rng, seed):
+    """
+    multipart/mixed: текст и HTML-альтернатива плюс одно-два вложения.
+    """
+    message = base_message(number, rng, seed)
+    message.set_content(paragraphs(rng, rng.randint(1, 4)))
+    message.add_alternative(html_document(rng, rng.randint(5, 30)), subtype='html')
+    for index in range(rng.randint(1, 2)):
+        maintype, subtype, extension = rng.choice(ATTACHMENT_TYPES)
+        data = rng.randbytes(rng.randint(10, 200) * 1024)
+        message.add_attachment(data, maintype=maintype, subtype=subtype,
+                               filename=f'{rng.choice(WORDS)}-{number}-{index}.{extension}')
+    return message.as_bytes()
+
+
+def broken_message(number, rng, seed):
+    """
+    Письма с ошибками кодировок, как их присылают старые почтовые программы:
+    текст в cp1251 с charset=utf-8, неизвестный charset, тема 8-битными байтами
+    без RFC 2047 и тема с encoded-word в неверной кодировке.
+    """
+    text = paragraphs(rng, rng.randint(1, 4))
+    subject = f'{sentence(rng, rng.randint(3, 8))[:-1]} №{number}'
+    variant = rng.randrange(4)
+    if variant == 0:
+        subject_header = f'=?utf-8?B?{base64.b64encode(subject.encode()).decode()}?='
+        charset, body = 'utf-8', text.encode('cp1251', errors='replace')
+    elif variant == 1:
+        subject_header = f'=?x-unknown?B?{base64.b64encode(subject.encode("koi8-r", errors="replace")).decode()}?='
+        charset, body = 'x-unknown', text.encode('koi8-r', errors='replace')
+    elif variant == 2:
+        subject_header = subject.encode('cp1251', errors='replace').decode('latin-1')
+        charset, body = 'windows-1251', text.encode('cp1251', errors='replace')
+    else:
+        subject_header = f'=?koi8-r?B?{base64.b64encode(subject.encode("cp1251", errors="replace")).decode()}?='
+        charset, body = 'koi8-r', text.encode('cp1251', errors='replace')
+
+    headers = (
+        f'Subject: {subject_header}\r\n'
+        f'From: {rng.choice(SENDERS)}@example.com\r\n'
+        f'To: bench@bench.local\r\n'
+        f'Date: {format_datetime(START_DATE + timedelta(minutes=number))}\r\n'
+        f'Message-ID: <bench-{seed}-{number}@bench.local>\r\n'
+        f'MIME-Version: 1.0\r\n'
+        f'Content-Type: text/plain; charset={charset}\r\n'
+        f'Content-Transfer-Encoding: 8bit\r\n'
+        f'\r\n'
+    )
+    return headers.encode('latin-1') + body.replace(b'\n', b'\r\n') + b'\r\n'
+
+
+BUILDERS = {
+    'plain': plain_message,
+    'html': html_message,
+    'multipart': multipart_message,
+    'broken': broken_message,
+}
+
+
+def generate_messages(count, mix=None, seed=0):
+    """
+    Синтетический ящик из count писем в формате RFC 822. Тип каждого письма
+    выбирается по долям mix; при одинаковом seed набор писем повторяется.
+    """
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=count)
+    for number, kind in enumerate(kinds, 1):
+        yield BUILDERS[kind](number, rng, seed)
@@ -0,0 +1,346 @@
+import email
+import multiprocessing
+import re
+import socketserver
+import threading
+
+INBOX = 'INBOX'
+CAPABILITIES = 'IMAP4rev1 UIDPLUS'
+
+_COMMAND_RE = re.compile(rb'^(?P<tag>\S+) (?P<command>[A-Za-z]+) ?(?P<args>.*?)\r?\n?$', re.DOTALL)
+_FETCH_ITEM_RE = re.compile(r'BODY(?:\.PEEK)?\[(?P<section>[^\]]*)\](?:<(?P<start>\d+)\.(?P<length>\d+)>)?|[A-Z0-9.]+')
+_HEADER_FIELDS_RE = re.compile(r'^HEADER\.FIELDS \((?P<names>[^)]*)\)$')
+
+
+class Mailbox:
+    """
+    Папка тестового сервера: письма по UID в порядке добавления.
+    """
+
+    def __init__(self, messages=(), uidvalidity=1, flags=''):
+        self.uidvalidity = uidvalidity
+        self.flags = flags  # атрибуты LIST, например '\\Sent'
+        self.messages = {}
+        self.message_flags = {}
+        for raw in messages:
+            self.append(raw)
+
+    def append(self, raw, flags=''):
+        uid = max(self.messages, default=0) + 1
+        self.messages[uid] = raw
+        self.message_flags[uid] = flags
+        return uid
+
+
+def parse_uid_set(text, max_uid):
+    """
+    Множество UID 'a:b,c,d:*' в виде списка отрезков (RFC 3501, 9).
+    """
+    ranges = []
+    for part in text.split(','):
+        low, _, high = part.partition(':')
+        low = max_uid if low == '*' else int(low)
+        high = low if not high else max_uid if high == '*' else int(high)
+        ranges.append((min(low, high), max(low, high)))
+    return ranges
+
+
+def in_uid_set(uid, ranges):
+    return any(low <= uid <= high for low, high in ranges)
+
+
+def split_header(raw):
+    """
+    Заголовок и тело письма. Заголовок — список полей с учётом переносов строк.
+    """
+    head, separator, body = raw.partition(b'\r\n\r\n')
+    if not separator:
+        head, _, body = raw.partition(b'\n\n')
+    fields = []
+    for line in head.splitlines(keepends=True):
+        if line[:1] in (b' ', b'\t') and fields:
+            fields[-1] += line
+        else:
+            fields.append(line)
+    return fields, body
+
+
+def header_fields(raw, names):
+    """
+    Ответ на BODY[HEADER.FIELDS (...)]: только запрошенные поля и пустая строка.
+    """
+    names = {name.lower() for name in names}
+    fields, _ = split_header(raw)
+    selected = [field for field in fields if field.split(b':', 1)[0].strip().decode('latin-1').lower() in names]
+    return b''.join(field if field.endswith(b'\r\n') else field.rstrip(b'\n') + b'\r\n' for field in selected) + b'\r\n'
+
+
+def message_part(message, section):
+    """
+    Часть письма по номеру секции '1.2'. Для письма из одной части секция 1 — само письмо.
+    """
+    part = message
+    for number in section.split('.'):
+        if part.is_multipart():
+            part = part.get_payload(int(number) - 1)
+        elif number != '1':
+            raise IndexError(section)
+    return part
+
+
+def part_body(part):
+    """
+    Тело части в том виде, в каком оно передано в письме (без декодирования).
+    get_payload() для 8-битных тел перекодирует их по charset, поэтому тело
+    берётся из сериализованной части.
+    """
+    _, body = split_header(part.as_bytes())
+    return body
+
+
+def quote(value):
+    if value is None:
+        return 'NIL'
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def bodystructure(part):
+    """
+    BODYSTRUCTURE части письма (RFC 3501, 7.4.2) с расширением disposition.
+    """
+    if part.is_multipart():
+        children = ''.join(bodystructure(child) for child in part.get_payload())
+        return f'({children} {quote(part.get_content_subtype())})'
+
+    params = [f'{quote(key)} {quote(value)}' for key, value in (part.get_params() or [])[1:]]
+    params = f'({" ".join(params)})' if params else 'NIL'
+    encoding = quote(part.get('Content-Transfer-Encoding', '7bit').lower())
+    body = part_body(part)
+    disposition = 'NIL'
+    if part.get_content_disposition():
+        filename = part.get_param('filename', header='Content-Disposition')
+        disposition_params = f'("filename" {quote(filename)})' if filename else 'NIL'
+        disposition = f'({quote(part.get_content_disposition())} {disposition_params})'
+    # Для текстовых частей после размера идёт число строк
+    lines = ' ' + str(body.count(b'\n')) if part.get_content_maintype() == 'text' else ''
+    return (f'({quote(part.get_content_maintype())} {quote(part.get_content_subtype())} {params} NIL NIL '
+            f'{encoding} {len(body)}{lines} NIL {disposition} NIL)')
+
+
+class IMAPHandler(socketserver.StreamRequestHandler):
+    """
+    Сессия тестового сервера. Поддерживает ровно те команды, которые отправляют
+    движки синхронизации: CAPABILITY, LOGIN, LIST, SELECT, UID SEARCH, UID FETCH,
+    NOOP и LOGOUT. Расширения CONDSTORE/QRESYNC не объявляются.
+    """
+
+    def setup(self):
+        super().setup()
+        self.mailbox = None
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.wfile.write(data)
+        with self.server.bytes_sent.get_lock():
+            self.server.bytes_sent.value += len(data)
+
+    def handle(self):
+        self.send(f'* OK [CAPABILITY {CAPABILITIES}] bench IMAP ready\r\n')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            match = _COMMAND_RE.match(line)
+            if not match:
+                self.send(b'* BAD parse error\r\n')
+                continue
+            tag = match.group('tag').decode()
+            command = match.group('command').decode().lower()
+            args = match.group('args').decode('utf-8', errors='replace')
+            if command == 'uid':
+                command, _, args = args.partition(' ')
+                command = 'uid_' + command.lower()
+            handler = getattr(self, f'do_{command}', None)
+            if handler is None:
+                self.send(f'{tag} BAD unsupported command\r\n')
+            elif handler(tag, args) is False:
+                self.wfile.flush()
+                return
+            self.wfile.flush()
+
+    def do_capability(self, tag, args):
+        self.send(f'* CAPABILITY {CAPABILITIES}\r\n{tag} OK CAPABILITY completed\r\n')
+
+    def do_login(self, tag, args):
+        self.send(f'{tag} OK [CAPABILITY {CAPABILITIES}] LOGIN completed\r\n')
+
+    def do_noop(self, tag, args):
+        self.send(f'{tag} OK NOOP completed\r\n')
+
+    def do_logout(self, tag, args):
+        self.send(f'* BYE logging out\r\n{tag} OK LOGOUT completed\r\n')
+        return False
+
+    def do_list(self, tag, args):
+        lines = []
+        for name, mailbox in self.server.folders.items():
+            flags = ' '.join(filter(None, ['\\HasNoChildren', mailbox.flags]))
+            lines.append(f'* LIST ({flags}) "/" {quote(name)}\r\n')
+        self.send(''.join(lines) + f'{tag} OK LIST completed\r\n')
+
+    def do_select(self, tag, args):
+        name = args.strip()
+        if name.startswith('"'):
+            name = re.sub(r'\\(.)', r'\1', name[1:-1])
+        if name.upper() == INBOX:
+            name = INBOX
+        self.mailbox = self.server.folders.get(name)
+        if self.mailbox is None:
+            self.send(f'{tag} NO no such mailbox\r\n')
+            return
+        uid_next = max(self.mailbox.messages, default=0) + 1
+        self.send(f'* FLAGS (\\Seen \\Answered \\Flagged \\Deleted \\Draft)\r\n'
+                  f'* {len(self.mailbox.messages)} EXISTS\r\n'
+                  f'* 0 RECENT\r\n'
+                  f'* OK [UIDVALIDITY {self.mailbox.uidvalidity}] UIDs valid\r\n'
+                  f'* OK [UIDNEXT {uid_next}] predicted next UID\r\n'
+                  f'{tag} OK [READ-WRITE] SELECT completed\r\n')
+
+    do_examine = do_select
+
+    def do_close(self, tag, args):
+        self.mailbox = None
+        self.send(f'{tag} OK CLOSE completed\r\n')
+
+    do_unselect = do_close
+
+    def do_uid_search(self, tag, args):
+        if self.mailbox is None:
+            self.send(f'{tag} BAD no mailbox selected\r\n')
+            return
+        # Критерии движков: ALL, (UID N:*) и UID 1:N
+        uids = sorted(self.mailbox.messages)
+        tokens = args.replace('(', ' ').replace(')', ' ').upper().split()
+        if 'UID' in tokens:
+            ranges = parse_uid_set(tokens[tokens.index('UID') + 1], max(uids, default=0))
+            uids = [uid for uid in uids if in_uid_set(uid, ranges)]
+        self.send(f'* SEARCH {" ".join(map(str, uids))}\r\n{tag} OK SEARCH completed\r\n')
+
+    def do_uid_fetch(self, tag, args):
+        if self.mailbox is None:
+            self.send(f'{tag} BAD no mailbox selected\r\n')
+            return
+        uid_set, _, items = args.partition(' ')
+        items = list(_FETCH_ITEM_RE.finditer(items.upper()))
+        messages = self.mailbox.messages
+        ranges = parse_uid_set(uid_set, max(messages, default=0))
+        for seq, uid in enumerate(sorted(messages), 1):
+            if in_uid_set(uid, ranges):
+                self.send(self.fetch_response(seq, uid, items))
+        self.send(f'{tag} OK FETCH completed\r\n')
+
+    def fetch_response(self, seq, uid, items):
+        raw = self.mailbox.messages[uid]
+        message = None
+        chunks = [f'* {seq} FETCH (UID {uid}'.encode()]
+        for item in items:
+            name = item.group(0)
+            if name == 'UID':
+                continue
+            if name == 'FLAGS':
+                chunks.append(f' FLAGS ({self.mailbox.message_flags[uid]})'.encode())
+            elif name == 'RFC822':
+                chunks.append(f' RFC822 {{{len(raw)}}}\r\n'.encode() + raw)
+            elif name == 'BODYSTRUCTURE':
+                message = message or email.message_from_bytes(raw)
+                chunks.append(f' BODYSTRUCTURE {bodystructure(message)}'.encode())
+            elif name.startswith('BODY'):
+                section = item.group('section')
+                fields = _HEADER_FIELDS_RE.match(section)
+                if not section:
+                    data = raw
+                elif fields:
+                    data = header_fields(raw, fields.group('names').split())
+                else:
+                    message = message or email.message_from_bytes(raw)
+                    data = part_body(message_part(message, section))
+                label = f'BODY[{section}]'
+                if item.group('start') is not None:
+                    start = int(item.group('start'))
+                    data = data[start:start + int(item.group('length'))]
+                    label += f'<{start}>'
+                chunks.append(f' {label} {{{len(data)}}}\r\n'.encode() + data)
+        chunks.append(b')\r\n')
+        return b''.join(chunks)
+
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    """
+    Локальный IMAP-сервер без TLS для нагрузочных замеров. load_folders возвращает
+    {имя папки: Mailbox} (INBOX обязателен) и вызывается в процессе сервера:
+    синтетический ящик не занимает память измеряемого процесса. Счётчик
+    bytes_sent — все байты, отправленные клиентам.
+
+    По умолчанию сервер запускается в дочернем процессе (start), чтобы разбор
+    команд и сборка ответов не делили GIL с измеряемой синхронизацией.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, load_folders, host='127.0.0.1', port=0):
+        super().__init__((host, port), IMAPHandler)
+        self.load_folders = load_folders
+        self.folders = {}
+        context = multiprocessing.get_context('fork')
+        self.bytes_sent = context.Value('Q', 0)
+        self.ready = context.Event()
+        self.process = None
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def serve(self):
+        self.folders = self.load_folders()
+        self.ready.set()
+        self.serve_forever()
+
+    def start(self):
+        """
+        Запуск в дочернем процессе (fork). Возвращает управление, когда ящик готов.
+        """
+        self.process = multiprocessing.get_context('fork').Process(target=self.serve, daemon=True)
+        self.process.start()
+        while not self.ready.wait(0.1):
+            if not self.process.is_alive():
+                raise RuntimeError('Тестовый IMAP-сервер завершился, не подготовив ящик')
+        return self
+
+    def start_thread(self):
+        """
+        Запуск в потоке текущего процесса, например для отладки.
+        """
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        return self
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+        if self.thread is not None:
+            self.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,77 @@
+import resource
+import sys
+import time
+
+from django.db import connection
+
+from .corpus import generate_messages
+from .imap_server import INBOX, Mailbox
+from ..models import EmailAccount, EmailMessage
+
+BENCH_EMAIL = 'bench@bench.local'
+BENCH_PROVIDER = 'bench.local'
+
+
+class QueryCounter:
+    """
+    Счётчик запросов к базе для connection.execute_wrapper.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def bench_folders(count, mix, seed):
+    """
+    Ящик тестового сервера: синтетические письма во входящих.
+    """
+    return {INBOX: Mailbox(generate_messages(count, mix, seed))}
+
+
+def peak_rss():
+    """
+    Пиковый RSS процесса в байтах: ru_maxrss в Linux — в килобайтах, в macOS — в байтах.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def reset_account():
+    """
+    Чистый аккаунт для прогона: письма и тексты прошлого прогона удаляются вместе с ним.
+    """
+    EmailAccount.objects.filter(email=BENCH_EMAIL).delete()
+    return EmailAccount.objects.create(email=BENCH_EMAIL, password='bench', provider=BENCH_PROVIDER)
+
+
+def run_sync_benchmark(server, fetcher_class):
+    """
+    Один прогон синхронизации ящика тестового сервера в пустую базу.
+    Запросы считаются по подключению текущего потока: fetch_and_process_emails
+    синхронизирует одну папку без пула потоков, асинхронный движок выполняет
+    запросы ORM в этом же потоке.
+    """
+    account = reset_account()
+    bytes_before = server.bytes_sent.value
+    counter = QueryCounter()
+
+    started = time.perf_counter()
+    with connection.execute_wrapper(counter):
+        fetcher_class(account).fetch_and_process_emails()
+    seconds = time.perf_counter() - started
+
+    messages = EmailMessage.objects.filter(account=account).count()
+    bytes_fetched = server.bytes_sent.value - bytes_before
+    return {
+        'messages': messages,
+        'seconds': round(seconds, 3),
+        'messages_per_second': round(messages / seconds, 1) if seconds else 0,
+        'bytes_fetched': bytes_fetched,
+        'queries': counter.count,
+        'queries_per_message': round(counter.count / messages, 2) if messages else 0,
+        'peak_rss': peak_rss(),
+    }
@@ -1,21 +1,72 @@
+import asyncio
 import json
 
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.core.cache import cache
+
+from .tasks.progress import progress_group, snapshot_key
 
 
 class ProgressConsumer(AsyncWebsocketConsumer):
+    """
+    Прогресс синхронизации и новые письма аккаунта, выбранного на странице входа.
+
+    Сокет входит только в группу своего аккаунта. Обновления прогресса
+    объединяются: в сокет уходит не больше PROGRESS_MAX_UPDATES_PER_SECOND
+    сообщений в секунду, и каждое — с последним известным состоянием.
+    """
+
+    group_name = None
+
     async def connect(self):
-        self.group_name = 'progress'
+        account_id = self.scope.get('session', {}).get('account_id')
+        if account_id is None:
+            await self.close()
+            return
+
+        self.group_name = progress_group(account_id)
+        self.min_interval = 1 / settings.PROGRESS_MAX_UPDATES_PER_SECOND
+        self.pending_progress = None
+        self.flush_task = None
+        self.last_sent_at = 0
         await self.channel_layer.group_add(self.group_name, self.channel_name)
         await self.accept()
 
+        # Подключившийся посреди синхронизации сразу видит её текущее состояние
+        snapshot = await cache.aget(snapshot_key(self.group_name))
+        if snapshot:
+            await self.send_progress(snapshot)
+
     async def disconnect(self, close_code):
+        if self.group_name is None:
+            return
+        if self.flush_task:
+            self.flush_task.cancel()
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
     async def progress_update(self, event):
-        message = event['message']
+        # Статус и процент из более свежего события заменяют ожидающие отправки
+        self.pending_progress = {**(self.pending_progress or {}), **event['message']}
+        if self.flush_task is None:
+            delay = self.last_sent_at + self.min_interval - asyncio.get_running_loop().time()
+            self.flush_task = asyncio.create_task(self.flush_progress(max(delay, 0)))
+
+    async def flush_progress(self, delay):
+        """
+        Отправка накопленного состояния после паузы, выдерживающей интервал.
+        """
+        await asyncio.sleep(delay)
+        message, self.pending_progress = self.pending_progress, None
+        self.flush_task = None
+        await self.send_progress(message)
+
+    async def send_progress(self, message):
+        self.last_sent_at = asyncio.get_running_loop().time()
         await self.send(text_data=json.dumps(message))
 
     async def new_message(self, event):
-        message = event['message']
-        await self.send(text_data=json.dumps({'new_message': message}))
+        messages = event['message']
+        if not isinstance(messages, list):
+            messages = [messages]
+        await self.send(text_data=json.dumps({'new_messages': messages}))
@@ -0,0 +1,50 @@
+import json
+import statistics
+
+from django.core.management.base import BaseCommand
+
+from app.bench.corpus import DEFAULT_MIX, parse_mix
+from app.bench.decoding import decode_samples, run_decode_benchmark
+
+
+class Command(BaseCommand):
+    help = ('Замер декодирования тем и текстов писем: resolver кодировок и кэш заголовков '
+            'против make_header(decode_header()) и decode(charset) на каждое письмо')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=5000, help='Писем в наборе.')
+        parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                            help="Доли типов писем, например 'plain=50,html=25,multipart=15,broken=10'.")
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора: одинаковое зерно — тот же набор.')
+        parser.add_argument('--list-share', type=int, default=30,
+                            help='Доля писем из рассылок с повторяющимися темами, %%.')
+        parser.add_argument('--repeat', type=int, default=3, help='Число прогонов.')
+        parser.add_argument('--json', action='store_true', help='Результаты одной строкой JSON.')
+
+    def handle(self, *args, **options):
+        subjects, texts = decode_samples(options['messages'], options['mix'], options['seed'],
+                                         options['list_share'] / 100)
+        runs = [run_decode_benchmark(subjects, texts) for _ in range(options['repeat'])]
+
+        if options['json']:
+            self.stdout.write(json.dumps({
+                'mix': options['mix'],
+                'seed': options['seed'],
+                'list_share': options['list_share'],
+                'runs': runs,
+            }))
+            return
+
+        for number, result in enumerate(runs, 1):
+            self.stdout.write(self.format_result(f'Прогон {number}', result))
+        if len(runs) > 1:
+            median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+            self.stdout.write(self.style.SUCCESS(self.format_result('Медиана', median)))
+
+    @staticmethod
+    def format_result(title, result):
+        return (f"{title}: темы {result['subjects']:.0f} за {result['subject_seconds']:.4f} с "
+                f"(было {result['legacy_subject_seconds']:.4f} с, x{result['subject_speedup']:.1f}, "
+                f"из кэша {result['subject_cache_hits']:.0f}, раньше не декодировались "
+                f"{result['subjects_recovered']:.0f}); тексты {result['texts']:.0f} за {result['text_seconds']:.4f} с "
+                f"(было {result['legacy_text_seconds']:.4f} с, x{result['text_speedup']:.1f})")
@@ -0,0 +1,80 @@
+import json
+import statistics
+from functools import partial
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from app.bench.corpus import DEFAULT_MIX, parse_mix
+from app.bench.imap_server import FakeIMAPServer
+from app.bench.runner import bench_folders, run_sync_benchmark
+from app.tasks.async_processing import AsyncEmailFetcher
+from app.tasks.email_processing import EmailFetcher
+
+FETCHER_CLASSES = {'sync': EmailFetcher, 'async': AsyncEmailFetcher}
+
+MEGABYTE = 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = ('Замер скорости синхронизации: локальный IMAP-сервер с синтетическим ящиком, '
+            'EmailFetcher.fetch_and_process_emails в текущую базу. Запускать с eml_getter.settings_bench')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000, help='Писем в ящике.')
+        parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                            help="Доли типов писем, например 'plain=50,html=25,multipart=15,broken=10'.")
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора: одинаковое зерно — тот же ящик.')
+        parser.add_argument('--engine', choices=FETCHER_CLASSES, default='sync', help='Движок синхронизации.')
+        parser.add_argument('--mode', choices=['full', 'headers'], default='full', help='EMAIL_SYNC_MODE прогона.')
+        parser.add_argument('--repeat', type=int, default=1, help='Число прогонов, каждый в пустую базу.')
+        parser.add_argument('--in-process', action='store_true',
+                            help='Сервер в потоке этого процесса, а не в дочернем процессе.')
+        parser.add_argument('--json', action='store_true', help='Результаты одной строкой JSON.')
+
+    def handle(self, *args, **options):
+        if not settings.CHANNEL_LAYERS['default']['BACKEND'].endswith('InMemoryChannelLayer'):
+            raise CommandError('Замеры выполняются с channel layer в памяти: '
+                               'DJANGO_SETTINGS_MODULE=eml_getter.settings_bench')
+
+        server = FakeIMAPServer(partial(bench_folders, options['messages'], options['mix'], options['seed']))
+        if options['in_process']:
+            server.start_thread()
+        else:
+            server.start()
+
+        fetcher_class = FETCHER_CLASSES[options['engine']]
+        try:
+            with override_settings(EMAIL_IMAP_HOST=server.server_address[0], EMAIL_IMAP_PORT=server.port,
+                                   EMAIL_IMAP_SSL=False, EMAIL_SYNC_MODE=options['mode']):
+                runs = []
+                for number in range(1, options['repeat'] + 1):
+                    result = run_sync_benchmark(server, fetcher_class)
+                    runs.append(result)
+                    if not options['json']:
+                        self.stdout.write(self.format_result(f'Прогон {number}', result))
+        finally:
+            server.stop()
+
+        if options['json']:
+            self.stdout.write(json.dumps({
+                'database': connection.vendor,
+                'engine': options['engine'],
+                'mode': options['mode'],
+                'mix': options['mix'],
+                'seed': options['seed'],
+                'runs': runs,
+            }))
+        elif len(runs) > 1:
+            median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+            self.stdout.write(self.style.SUCCESS(self.format_result('Медиана', median)))
+
+    @staticmethod
+    def format_result(title, result):
+        return (f"{title}: {result['messages']:.0f} писем за {result['seconds']:.2f} с — "
+                f"{result['messages_per_second']:.1f} писем/с, "
+                f"получено {result['bytes_fetched'] / MEGABYTE:.1f} МБ, "
+                f"{result['queries_per_message']:.2f} запросов на письмо ({result['queries']:.0f}), "
+                f"пиковый RSS {result['peak_rss'] / MEGABYTE:.0f} МБ")
@@ -0,0 +1,41 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from loguru import logger
+
+from app.models import EmailAccount
+from app.tasks.idle import IdleWatcher
+
+
+class Command(BaseCommand):
+    help = 'Держит IMAP-сессии аккаунтов в режиме IDLE и обрабатывает новые письма сразу после поступления'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', type=int, action='append', dest='account_ids',
+                            help='ID аккаунта (можно указать несколько раз). По умолчанию — все аккаунты.')
+
+    def handle(self, *args, **options):
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+
+        account_ids = options['account_ids']
+        watchers = {}
+        try:
+            while not stop_event.is_set():
+                # Подхватываем добавленные аккаунты и перезапускаем завершившиеся наблюдатели
+                ids = account_ids or EmailAccount.objects.values_list('id', flat=True)
+                for account_id in ids:
+                    watcher = watchers.get(account_id)
+                    if watcher is None or not watcher.is_alive():
+                        watcher = IdleWatcher(account_id, stop_event)
+                        watcher.start()
+                        watchers[account_id] = watcher
+                logger.info(f'IDLE активен для аккаунтов: {len(watchers)}')
+                stop_event.wait(settings.EMAIL_IDLE_RESCAN_INTERVAL)
+        except KeyboardInterrupt:
+            stop_event.set()
+
+        for watcher in watchers.values():
+            watcher.join(timeout=settings.EMAIL_IDLE_RECONNECT_DELAY)
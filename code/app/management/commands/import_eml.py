@@ -0,0 +1,52 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from app.models import EmailAccount
+from app.tasks.importing import EmailImporter, import_sources
+
+MEGABYTE = 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = ('Импорт писем из файлов .eml, mbox и каталогов Maildir в папку аккаунта: разбор в пуле процессов, '
+            'пакетная запись без дубликатов по message_id')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Файл .eml, файл mbox, каталог Maildir или каталог с файлами .eml.')
+        parser.add_argument('--account', type=int, required=True, help='ID аккаунта.')
+        parser.add_argument('--folder', default=None,
+                            help='Имя папки (по умолчанию — имя файла или каталога источника).')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Процессов разбора (по умолчанию — по числу ядер, 0 — в текущем процессе).')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Писем в одном bulk_create (по умолчанию EMAIL_PERSIST_BATCH_SIZE).')
+        parser.add_argument('--json', action='store_true', help='Итог одной строкой JSON.')
+
+    def handle(self, *args, **options):
+        try:
+            account = EmailAccount.objects.get(id=options['account'])
+        except EmailAccount.DoesNotExist:
+            raise CommandError(f"Аккаунт {options['account']} не найден")
+        missing = [path for path in options['paths'] if not os.path.exists(path)]
+        if missing:
+            raise CommandError(f"Не найдены: {', '.join(missing)}")
+
+        sources = []
+        for path in options['paths']:
+            sources.extend(import_sources(path, options['folder']))
+
+        # Пул разбора создаётся при первом письме с числом процессов из настроек
+        with override_settings(EMAIL_PARSE_WORKERS=options['workers']):
+            result = EmailImporter(account, options['batch_size']).run(sources)
+
+        if options['json']:
+            self.stdout.write(json.dumps(result))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Прочитано {result['messages']} писем ({result['bytes'] / MEGABYTE:.1f} МБ) "
+            f"за {result['seconds']:.2f} с — {result['messages_per_second']:.1f} писем/с, "
+            f"{result['megabytes_per_second']:.2f} МБ/с, процессов разбора {result['workers']}; "
+            f"в папках после импорта {result['saved']}"))
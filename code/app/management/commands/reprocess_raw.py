@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from loguru import logger
+
+from app.models import EmailAccount
+from app.tasks.archive import reprocess_account
+
+
+class Command(BaseCommand):
+    help = ('Повторный разбор писем из архива исходных писем (EMAIL_RAW_ARCHIVE) без загрузки с IMAP-сервера: '
+            'тексты, превью, поисковые векторы и недостающие вложения')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', type=int, action='append', dest='account_ids',
+                            help='ID аккаунта (можно указать несколько раз). По умолчанию — все аккаунты.')
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='Писем в одном чанке чтения и записи (по умолчанию EMAIL_FETCH_CHUNK_SIZE).')
+
+    def handle(self, *args, **options):
+        accounts = EmailAccount.objects.filter(rawmessage__isnull=False).distinct().order_by('id')
+        if options['account_ids']:
+            accounts = accounts.filter(id__in=options['account_ids'])
+
+        total = 0
+        for account in accounts:
+            updated = reprocess_account(account, options['chunk_size'])
+            logger.info(f'Аккаунт {account}: повторно разобрано писем {updated}')
+            total += updated
+        self.stdout.write(self.style.SUCCESS(f'Повторно разобрано писем: {total}'))
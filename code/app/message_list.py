@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import EmailAccount, EmailMessage
+from .search import search_messages
+
+# Поля, которые нужны строке списка: полный текст письма не читается
+LIST_FIELDS = ('id', 'subject', 'send_date', 'receive_date', 'preview')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def message_row(email_message_obj):
+    """
+    Строка списка писем для JSON и WebSocket.
+    """
+    return {
+        'id': email_message_obj.id,
+        'subject': email_message_obj.subject,
+        'send_date': timezone.localtime(email_message_obj.send_date).strftime('%d.%m.%Y %H:%M'),
+        'receive_date': timezone.localtime(email_message_obj.receive_date).strftime('%d.%m.%Y %H:%M'),
+        'preview': email_message_obj.preview[:50],
+    }
+
+
+def encode_cursor(email_message_obj):
+    """
+    Курсор страницы — ключ сортировки последнего письма: '<send_date в мкс>-<id>'.
+    """
+    microseconds = (email_message_obj.send_date - EPOCH) // MICROSECOND
+    return f'{microseconds}-{email_message_obj.id}'
+
+
+def decode_cursor(cursor):
+    """
+    Разбор курсора в (send_date, id). ValueError, если курсор некорректен.
+    """
+    microseconds, _, pk = cursor.rpartition('-')
+    return EPOCH + int(microseconds) * MICROSECOND, int(pk)
+
+
+def get_message_queryset(account, show_new=False, query=''):
+    """
+    Письма аккаунта в порядке списка: новые сверху, при равной дате — по id.
+    Результаты поиска тоже идут по дате и листаются тем же курсором.
+    Новые письма — загруженные после отметки аккаунта last_seen_message_id.
+    """
+    queryset = EmailMessage.objects.filter(account=account)
+    if show_new:
+        queryset = queryset.filter(id__gt=account.last_seen_message_id)
+    if query:
+        queryset = search_messages(queryset, query)
+    return queryset.only(*LIST_FIELDS).order_by('-send_date', '-id')
+
+
+def mark_messages_seen(account):
+    """
+    Все загруженные письма аккаунта перестают быть новыми. Вместо UPDATE каждого
+    письма сдвигается отметка аккаунта до последнего id в таблице: id растут,
+    поэтому письма, загруженные позже, окажутся выше неё. Отметка не уменьшается
+    при одновременных обновлениях.
+    """
+    last_id = EmailMessage.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    EmailAccount.objects.filter(id=account.id, last_seen_message_id__lt=last_id).update(last_seen_message_id=last_id)
+    account.last_seen_message_id = max(account.last_seen_message_id, last_id)
+
+
+def get_page(queryset, cursor=None, page_size=50):
+    """
+    Страница списка по ключу (send_date, id) вместо OFFSET: каждая следующая
+    страница — диапазонный запрос по индексу, её стоимость не зависит от того,
+    насколько далеко пролистан список. Возвращает (письма, курсор следующей
+    страницы или None).
+    """
+    if cursor:
+        send_date, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(send_date__lt=send_date) | Q(send_date=send_date, id__lt=pk))
+
+    # Лишнее письмо показывает, есть ли следующая страница
+    messages = list(queryset[:page_size + 1])
+    if len(messages) <= page_size:
+        return messages, None
+    messages = messages[:page_size]
+    return messages, encode_cursor(messages[-1])
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:15
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Substr
+
+
+def fill_preview(apps, schema_editor):
+    """
+    Заполнение превью уже сохранённых писем одним UPDATE на стороне базы.
+    """
+    EmailMessage = apps.get_model('app', 'EmailMessage')
+    EmailMessage.objects.update(preview=Substr('body', 1, settings.EMAIL_PREVIEW_LENGTH))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailmessage',
+            name='preview',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.RunPython(fill_preview, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_emailmessage_preview'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailmessage',
+            name='body_loaded',
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:20
+
+from django.db import migrations, models
+from django.db.models import Max
+import django.db.models.deletion
+
+
+def create_inbox_folders(apps, schema_editor):
+    """
+    Состояние папки INBOX для существующих аккаунтов: синхронизация продолжится
+    с последнего сохранённого UID. UIDVALIDITY запишется при первой синхронизации.
+    """
+    EmailAccount = apps.get_model('app', 'EmailAccount')
+    MailFolder = apps.get_model('app', 'MailFolder')
+    MailFolder.objects.bulk_create([
+        MailFolder(account_id=account['id'], name='INBOX', last_uid=account['last_uid'] or 0)
+        for account in EmailAccount.objects.annotate(last_uid=Max('emailmessage__uid')).values('id', 'last_uid')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_attachment_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailFolder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('uidvalidity', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('last_uid', models.PositiveBigIntegerField(default=0)),
+                ('highest_modseq', models.PositiveBigIntegerField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='emailmessage',
+            name='uid',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='emailmessage',
+            constraint=models.UniqueConstraint(fields=('account', 'uid'), name='unique_uid_per_account'),
+        ),
+        migrations.AddField(
+            model_name='mailfolder',
+            name='account',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='folders', to='app.emailaccount'),
+        ),
+        migrations.AddConstraint(
+            model_name='mailfolder',
+            constraint=models.UniqueConstraint(fields=('account', 'name'), name='unique_folder_per_account'),
+        ),
+        migrations.RunPython(create_inbox_folders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_mailfolder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailmessage',
+            name='flags',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
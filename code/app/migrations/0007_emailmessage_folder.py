@@ -0,0 +1,37 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def assign_inbox_folder(apps, schema_editor):
+    """
+    Все сохранённые до этого письма загружены из INBOX: привязываем их к папке
+    INBOX своего аккаунта (она создана миграцией 0005).
+    """
+    EmailAccount = apps.get_model('app', 'EmailAccount')
+    EmailMessage = apps.get_model('app', 'EmailMessage')
+    MailFolder = apps.get_model('app', 'MailFolder')
+    MailFolder.objects.bulk_create([
+        MailFolder(account_id=account_id, name='INBOX')
+        for account_id in EmailAccount.objects.exclude(folders__name='INBOX').values_list('id', flat=True)
+    ])
+    inbox = MailFolder.objects.filter(account=OuterRef('account'), name='INBOX').values('id')[:1]
+    EmailMessage.objects.filter(folder__isnull=True).update(folder=Subquery(inbox))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_emailmessage_flags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailmessage',
+            name='folder',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='app.mailfolder'),
+        ),
+        migrations.RunPython(assign_inbox_folder, migrations.RunPython.noop),
+    ]
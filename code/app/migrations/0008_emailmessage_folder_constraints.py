@@ -0,0 +1,38 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    # Отдельная миграция: PostgreSQL не даёт менять таблицу в одной транзакции
+    # с обновлением её строк (pending trigger events отложенных внешних ключей)
+
+    dependencies = [
+        ('app', '0007_emailmessage_folder'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='emailmessage',
+            name='folder',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='app.mailfolder'),
+        ),
+        migrations.RemoveConstraint(
+            model_name='emailmessage',
+            name='unique_uid_per_account',
+        ),
+        migrations.AlterField(
+            model_name='emailmessage',
+            name='message_id',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddConstraint(
+            model_name='emailmessage',
+            constraint=models.UniqueConstraint(fields=('folder', 'uid'), name='unique_uid_per_folder'),
+        ),
+        migrations.AddConstraint(
+            model_name='emailmessage',
+            constraint=models.UniqueConstraint(fields=('folder', 'message_id'), name='unique_message_per_folder'),
+        ),
+    ]
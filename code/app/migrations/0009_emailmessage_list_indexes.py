@@ -0,0 +1,21 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_emailmessage_folder_constraints'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emailmessage',
+            index=models.Index(fields=['account', 'send_date', 'id'], name='message_account_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emailmessage',
+            index=models.Index(fields=['account', 'is_new', 'send_date', 'id'], name='message_account_new_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:40
+
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import Max
+
+BATCH_SIZE = 10_000
+
+
+def fill_search_vectors(apps, schema_editor):
+    """
+    search_vector для уже сохранённых писем, диапазонами id, чтобы не держать
+    блокировку на всю таблицу одним UPDATE. Только для PostgreSQL.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    EmailMessage = apps.get_model('app', 'EmailMessage')
+    vector = (SearchVector('subject', config='russian', weight='A')
+              + SearchVector('subject', config='english', weight='A')
+              + SearchVector('body', config='russian', weight='B')
+              + SearchVector('body', config='english', weight='B'))
+    max_id = EmailMessage.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    for start in range(0, max_id + 1, BATCH_SIZE):
+        EmailMessage.objects.filter(id__gte=start, id__lt=start + BATCH_SIZE).update(search_vector=vector)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_emailmessage_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailmessage',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+    ]
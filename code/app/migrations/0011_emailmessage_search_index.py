@@ -0,0 +1,36 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:40
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+SEARCH_INDEX = django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='message_search_idx')
+
+
+def create_search_index(apps, schema_editor):
+    # GIN-индекс есть только в PostgreSQL, в SQLite поиск идёт без него
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.add_index(apps.get_model('app', 'EmailMessage'), SEARCH_INDEX)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.remove_index(apps.get_model('app', 'EmailMessage'), SEARCH_INDEX)
+
+
+class Migration(migrations.Migration):
+    # Индекс строится после заполнения search_vector (0010) одним проходом
+
+    dependencies = [
+        ('app', '0010_emailmessage_search_vector'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name='emailmessage', index=SEARCH_INDEX),
+            ],
+            database_operations=[
+                migrations.RunPython(create_search_index, drop_search_index),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.16 on 2026-10-18 14:20
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def set_last_seen(apps, schema_editor):
+    """
+    Отметка аккаунта — последнее письмо, уже не отмеченное как новое:
+    письма с is_new остаются новыми и после перехода на отметку.
+    """
+    EmailAccount = apps.get_model('app', 'EmailAccount')
+    EmailMessage = apps.get_model('app', 'EmailMessage')
+    seen = (EmailMessage.objects.filter(is_new=False).order_by().values('account')
+            .annotate(last_id=Max('id')).values_list('account', 'last_id'))
+    for account_id, last_id in seen:
+        EmailAccount.objects.filter(id=account_id).update(last_seen_message_id=last_id)
+
+
+def restore_is_new(apps, schema_editor):
+    EmailAccount = apps.get_model('app', 'EmailAccount')
+    EmailMessage = apps.get_model('app', 'EmailMessage')
+    for account_id, last_id in EmailAccount.objects.values_list('id', 'last_seen_message_id'):
+        EmailMessage.objects.filter(account_id=account_id, id__gt=last_id).update(is_new=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_emailmessage_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailaccount',
+            name='last_seen_message_id',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(set_last_seen, restore_is_new),
+    ]
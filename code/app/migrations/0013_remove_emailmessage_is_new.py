@@ -0,0 +1,25 @@
+# Generated by Django 4.2.16 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_emailaccount_last_seen_message_id'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='emailmessage',
+            name='message_account_new_idx',
+        ),
+        migrations.RemoveField(
+            model_name='emailmessage',
+            name='is_new',
+        ),
+        migrations.AddIndex(
+            model_name='emailmessage',
+            index=models.Index(fields=['account', 'id'], name='message_account_id_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_remove_emailmessage_is_new'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RawMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uid', models.PositiveBigIntegerField()),
+                ('segment', models.PositiveIntegerField()),
+                ('offset', models.PositiveBigIntegerField()),
+                ('length', models.PositiveIntegerField()),
+                ('size', models.PositiveIntegerField()),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.emailaccount')),
+                ('folder', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='raw_messages', to='app.mailfolder')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='rawmessage',
+            constraint=models.UniqueConstraint(fields=('folder', 'uid'), name='unique_raw_uid_per_folder'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Max
+
+BATCH_SIZE = 10_000
+
+
+def move_bodies(apps, schema_editor):
+    """
+    Тексты сохранённых писем переносятся в MessageContent диапазонами id.
+    Ключ — 'legacy:<id письма>': у старых писем без Message-ID он подставлен
+    как '<uid>@<провайдер>' и совпадает у разных аккаунтов, поэтому старые
+    письма не объединяются, общий текст получают письма новых синхронизаций.
+    """
+    EmailMessage = apps.get_model('app', 'EmailMessage')
+    MessageContent = apps.get_model('app', 'MessageContent')
+    max_id = EmailMessage.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    for start in range(0, max_id + 1, BATCH_SIZE):
+        messages = list(EmailMessage.objects
+                        .filter(id__gte=start, id__lt=start + BATCH_SIZE)
+                        .only('id', 'body', 'body_loaded'))
+        if not messages:
+            continue
+        MessageContent.objects.bulk_create([
+            MessageContent(key=f'legacy:{obj.id}', body=obj.body, body_loaded=obj.body_loaded) for obj in messages
+        ])
+        contents = MessageContent.objects.in_bulk([f'legacy:{obj.id}' for obj in messages], field_name='key')
+        for obj in messages:
+            obj.content_id = contents[f'legacy:{obj.id}'].id
+        EmailMessage.objects.bulk_update(messages, ['content'])
+
+
+class Migration(migrations.Migration):
+    # Столбец body удаляется и content становится обязательным в 0016:
+    # в PostgreSQL ALTER TABLE после изменения строк в той же транзакции
+    # не выполняется из-за отложенных проверок внешних ключей
+
+    dependencies = [
+        ('app', '0014_rawmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageContent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('body', models.TextField(blank=True, default='')),
+                ('body_loaded', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='emailmessage',
+            name='content',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT,
+                                    related_name='messages', to='app.messagecontent'),
+        ),
+        migrations.RunPython(move_bodies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_messagecontent'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='emailmessage',
+            name='body',
+        ),
+        migrations.AlterField(
+            model_name='emailmessage',
+            name='content',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT,
+                                    related_name='messages', to='app.messagecontent'),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 4.2.16 on 2026-10-18 19:20
+
+import hashlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db.models import Case, F, Max, OuterRef, Subquery, Value, When
+
+BATCH_SIZE = 10_000
+# Копий текстов за один bulk_create: тексты читаются в память целиком
+COPY_BATCH_SIZE = 500
+
+
+def split_contents(apps, schema_editor):
+    """
+    Общие тексты привязываются к аккаунту первого письма, письмам других
+    аккаунтов создаются собственные копии. Загруженным текстам считается digest.
+    """
+    EmailMessage = apps.get_model('app', 'EmailMessage')
+    MessageContent = apps.get_model('app', 'MessageContent')
+    MessageContent.objects.filter(messages__isnull=True).delete()
+    MessageContent.objects.update(account_id=Subquery(
+        EmailMessage.objects.filter(content_id=OuterRef('id')).order_by('id').values('account_id')[:1]))
+
+    # Копия создаётся одна на пару (текст, чужой аккаунт), письма пар
+    # переводятся на копии одним UPDATE на пачку
+    pairs = list(EmailMessage.objects
+                 .exclude(account_id=F('content__account_id'))
+                 .order_by('content_id', 'account_id')
+                 .values_list('content_id', 'account_id')
+                 .distinct())
+    fields = [field.attname for field in MessageContent._meta.concrete_fields
+              if not field.primary_key and field.attname != 'account_id']
+    for start in range(0, len(pairs), COPY_BATCH_SIZE):
+        chunk = pairs[start:start + COPY_BATCH_SIZE]
+        sources = MessageContent.objects.in_bulk({content_id for content_id, _ in chunk})
+        copies = MessageContent.objects.bulk_create([
+            MessageContent(account_id=account_id, **{name: getattr(sources[content_id], name) for name in fields})
+            for content_id, account_id in chunk
+        ])
+        EmailMessage.objects.filter(content_id__in=sources).update(content_id=Case(
+            *[When(content_id=content_id, account_id=account_id, then=Value(content.id))
+              for (content_id, account_id), content in zip(chunk, copies)],
+            default=F('content_id'), output_field=models.BigIntegerField()))
+
+    max_id = MessageContent.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    for start in range(0, max_id + 1, BATCH_SIZE):
+        contents = list(MessageContent.objects
+                        .filter(id__gte=start, id__lt=start + BATCH_SIZE, body_loaded=True)
+                        .only('id', 'body'))
+        for content in contents:
+            content.digest = hashlib.sha256(content.body.encode('utf-8', 'surrogatepass')).hexdigest()
+        MessageContent.objects.bulk_update(contents, ['digest'])
+
+
+class Migration(migrations.Migration):
+    # account становится обязательным и ограничение уникальности создаётся
+    # в 0018, см. комментарий в 0015
+
+    dependencies = [
+        ('app', '0016_remove_emailmessage_body'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messagecontent',
+            name='account',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE,
+                                    related_name='contents', to='app.emailaccount'),
+        ),
+        migrations.AddField(
+            model_name='messagecontent',
+            name='digest',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='messagecontent',
+            name='used_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='messagecontent',
+            name='key',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.RunPython(split_contents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.16 on 2026-10-18 19:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_messagecontent_account'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='messagecontent',
+            name='account',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                    related_name='contents', to='app.emailaccount'),
+        ),
+        migrations.AlterField(
+            model_name='emailmessage',
+            name='content',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT,
+                                    related_name='messages', to='app.messagecontent'),
+        ),
+        migrations.AddConstraint(
+            model_name='messagecontent',
+            constraint=models.UniqueConstraint(fields=('account', 'key', 'digest'),
+                                               name='unique_content_key_per_account'),
+        ),
+    ]
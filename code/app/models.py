@@ -1,32 +1,129 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.utils import timezone
 
 
 class EmailAccount(models.Model):
     email = models.EmailField(unique=True)
     password = models.CharField(max_length=256)
     provider = models.CharField(max_length=50)
+    # Отметка «просмотрено»: письма с id больше неё считаются новыми.
+    # Кнопка «Обновить список» сдвигает только эту отметку, а не флаги всех писем
+    last_seen_message_id = models.PositiveBigIntegerField(default=0)
 
     def __str__(self):
         return self.email
 
 
+class MailFolder(models.Model):
+    # Состояние синхронизации папки: при неизменном UIDVALIDITY загружаются
+    # только письма с UID больше last_uid
+    account = models.ForeignKey(EmailAccount, on_delete=models.CASCADE, related_name='folders')
+    name = models.CharField(max_length=255)
+    uidvalidity = models.PositiveBigIntegerField(null=True, blank=True)
+    last_uid = models.PositiveBigIntegerField(default=0)
+    highest_modseq = models.PositiveBigIntegerField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'name'], name='unique_folder_per_account'),
+        ]
+
+    def __str__(self):
+        return f'{self.account} / {self.name}'
+
+
+class MessageContent(models.Model):
+    # Текст письма хранится один раз на аккаунт: копии письма в разных папках
+    # (копия себе, метки Gmail) ссылаются на одну строку. key — нормализованный
+    # Message-ID с хэшем темы и даты (см. parsing.get_content_key), письма без
+    # Message-ID получают собственную строку без ключа. digest — SHA-256 текста:
+    # копия с тем же ключом, но другим текстом получает отдельную строку
+    account = models.ForeignKey(EmailAccount, on_delete=models.CASCADE, related_name='contents')
+    key = models.CharField(max_length=255, null=True, blank=True)
+    digest = models.CharField(max_length=64, blank=True, default='')
+    body = models.TextField(blank=True, default='')
+    body_loaded = models.BooleanField(default=False)
+    # Время последней привязки письма: cleanup_message_contents не удаляет
+    # недавно привязанные тексты, см. persistence.delete_unused_contents
+    used_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'key', 'digest'], name='unique_content_key_per_account'),
+        ]
+
+    def __str__(self):
+        return self.key or f'#{self.id}'
+
+
 class EmailMessage(models.Model):
     account = models.ForeignKey(EmailAccount, on_delete=models.CASCADE)
+    folder = models.ForeignKey(MailFolder, on_delete=models.CASCADE, related_name='messages')
+    # RESTRICT: текст удаляется вместе с аккаунтом, но не из-под его писем
+    content = models.ForeignKey(MessageContent, on_delete=models.RESTRICT, related_name='messages')
     subject = models.CharField(max_length=255)
     send_date = models.DateTimeField()
     receive_date = models.DateTimeField()
-    body = models.TextField()
-    message_id = models.CharField(max_length=255, unique=True)
-    uid = models.IntegerField(unique=True, null=True, blank=True)
-    is_new = models.BooleanField(default=False)
+    preview = models.CharField(max_length=255, blank=True, default='')
+    body_loaded = models.BooleanField(default=True)
+    message_id = models.CharField(max_length=255)
+    uid = models.PositiveBigIntegerField(null=True, blank=True)
+    flags = models.CharField(max_length=255, blank=True, default='')  # флаги IMAP: '\\Seen \\Flagged'
+    # Тема и текст для полнотекстового поиска (PostgreSQL), заполняется при записи пачки писем
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        constraints = [
+            # UID уникален только в пределах папки. Одно письмо может лежать
+            # в нескольких папках (входящие и отправленные себе, метки Gmail)
+            models.UniqueConstraint(fields=['folder', 'uid'], name='unique_uid_per_folder'),
+            models.UniqueConstraint(fields=['folder', 'message_id'], name='unique_message_per_folder'),
+        ]
+        indexes = [
+            # Список писем аккаунта листается по ключу (send_date, id), см. message_list.get_page
+            models.Index(fields=['account', 'send_date', 'id'], name='message_account_date_idx'),
+            # Новые письма — диапазон id выше отметки аккаунта, см. message_list.get_message_queryset
+            models.Index(fields=['account', 'id'], name='message_account_id_idx'),
+            # Создаётся только в PostgreSQL, см. миграцию 0011
+            GinIndex(fields=['search_vector'], name='message_search_idx'),
+        ]
 
     def __str__(self):
         return self.subject
 
 
 class Attachment(models.Model):
+    # Файл хранится по SHA-256 содержимого (attachments/ab/cd/<sha256>),
+    # одинаковые вложения разных писем ссылаются на один файл
     file = models.FileField(upload_to='attachments/')
     message = models.ForeignKey(EmailMessage, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255, blank=True, default='')
+    content_type = models.CharField(max_length=255, blank=True, default='')
+    size = models.PositiveBigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True, default='', db_index=True)
 
     def __str__(self):
         return self.file.name
+
+
+class RawMessage(models.Model):
+    # Исходное письмо в архиве (EMAIL_RAW_ARCHIVE): кадр zstd длиной length байт
+    # со смещения offset в сегменте <EMAIL_RAW_ARCHIVE_DIR>/<account>/<segment>.zst.
+    # UID уникален в пределах папки, поэтому ключ — (folder, uid)
+    account = models.ForeignKey(EmailAccount, on_delete=models.CASCADE)
+    folder = models.ForeignKey(MailFolder, on_delete=models.CASCADE, related_name='raw_messages')
+    uid = models.PositiveBigIntegerField()
+    segment = models.PositiveIntegerField()
+    offset = models.PositiveBigIntegerField()
+    length = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()  # размер письма до сжатия
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['folder', 'uid'], name='unique_raw_uid_per_folder'),
+        ]
+
+    def __str__(self):
+        return f'{self.folder} / {self.uid}'
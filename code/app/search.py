@@ -0,0 +1,56 @@
+from functools import reduce
+from operator import add, or_
+
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.db import connections
+from django.db.models import OuterRef, Q, Subquery
+
+from .models import MessageContent
+
+# Письма в основном на русском, но часто с английским: слова приводятся
+# к основе обоими словарями
+SEARCH_CONFIGS = ('russian', 'english')
+
+
+def is_search_supported(using='default'):
+    """
+    Полнотекстовый поиск по search_vector есть только в PostgreSQL.
+    """
+    return connections[using].vendor == 'postgresql'
+
+
+def build_search_vector():
+    """
+    Выражение для EmailMessage.search_vector: тема с весом A, текст с весом B.
+    Текст берётся подзапросом из MessageContent: UPDATE не допускает JOIN.
+    """
+    body = Subquery(MessageContent.objects.filter(id=OuterRef('content_id')).values('body')[:1])
+    return reduce(add, [SearchVector('subject', config=config, weight='A') for config in SEARCH_CONFIGS]
+                  + [SearchVector(body, config=config, weight='B') for config in SEARCH_CONFIGS])
+
+
+def build_search_query(text):
+    """
+    Поисковый запрос в синтаксисе веб-поиска ("фраза", -исключение, or)
+    по обоим словарям.
+    """
+    return reduce(or_, (SearchQuery(text, config=config, search_type='websearch') for config in SEARCH_CONFIGS))
+
+
+def update_search_vectors(queryset):
+    """
+    Пересчёт search_vector одним UPDATE на весь набор писем вместо триггера
+    на каждую строку. Вне PostgreSQL ничего не делает.
+    """
+    if is_search_supported(queryset.db):
+        queryset.update(search_vector=build_search_vector())
+
+
+def search_messages(queryset, text):
+    """
+    Письма, подходящие под поисковый запрос. В PostgreSQL поиск идёт по GIN-индексу
+    search_vector, в остальных базах (SQLite для разработки) — подстрокой.
+    """
+    if is_search_supported(queryset.db):
+        return queryset.filter(search_vector=build_search_query(text))
+    return queryset.filter(Q(subject__icontains=text) | Q(content__body__icontains=text))
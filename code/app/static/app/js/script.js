@@ -1,6 +1,10 @@
 var progressBar = document.getElementById('progress');
 var progressText = document.getElementById('progress-text');
 var messageList = document.getElementById('message-list');
+var loadMore = document.getElementById('load-more');
+var nextCursor = loadMore.dataset.next;
+var loadingPage = false;
+var searchQuery = new URLSearchParams(window.location.search).get('q') || '';
 
 var socket = new WebSocket('ws://' + window.location.host + '/ws/progress/');
 
@@ -14,13 +18,32 @@ socket.onmessage = function (e) {
         // Обновляем текст прогресса, если передан параметр status
         progressText.textContent = data.status;
     }
-    if (data.new_message) {
-        addMessageToTable(data.new_message);
+    if (data.new_messages) {
+        addMessagesToTable(data.new_messages);
     }
 };
 
-function addMessageToTable(message) {
+function addMessagesToTable(messages) {
+    if (searchQuery) {
+        // Новые письма могут не подходить под запрос: результаты поиска не дополняются
+        return;
+    }
+    // Новые письма добавляются в начало списка, самое свежее сверху
+    messageList.insertBefore(createMessageRows(messages.slice().reverse()), messageList.firstChild);
+}
+
+function createMessageRows(messages) {
+    // Вся пачка добавляется одной вставкой в DOM
+    var fragment = document.createDocumentFragment();
+    messages.forEach(function (message) {
+        fragment.appendChild(createMessageRow(message));
+    });
+    return fragment;
+}
+
+function createMessageRow(message) {
     var row = document.createElement('tr');
+    row.dataset.id = message.id;
 
     var idCell = document.createElement('td');
     idCell.textContent = message.id;
@@ -38,23 +61,80 @@ function addMessageToTable(message) {
     receiveDateCell.textContent = message.receive_date;
     row.appendChild(receiveDateCell);
 
-    var bodyCell = document.createElement('td');
-    bodyCell.textContent = message.body;
-    row.appendChild(bodyCell);
+    var previewCell = document.createElement('td');
+    previewCell.textContent = message.preview;
+    row.appendChild(previewCell);
 
-    messageList.appendChild(row);
+    return row;
 }
 
+// Подгрузка следующей страницы списка при прокрутке до его конца
+function loadNextPage() {
+    if (!nextCursor || loadingPage) {
+        return;
+    }
+    loadingPage = true;
+    var url = new URL('/messages/page/', window.location.origin);
+    url.searchParams.set('before', nextCursor);
+    url.searchParams.set('show_new', document.getElementById('show-new-messages').checked);
+    url.searchParams.set('q', searchQuery);
+    fetch(url)
+        .then(response => response.json())
+        .then(data => {
+            loadingPage = false;
+            if (data.messages) {
+                messageList.appendChild(createMessageRows(data.messages));
+                nextCursor = data.next;
+                // Страница могла не заполнить экран: конец списка всё ещё виден
+                if (loadMore.getBoundingClientRect().top < window.innerHeight) {
+                    loadNextPage();
+                }
+            }
+        })
+        .catch(() => {
+            loadingPage = false;
+        });
+}
+
+new IntersectionObserver(function (entries) {
+    if (entries[0].isIntersecting) {
+        loadNextPage();
+    }
+}).observe(loadMore);
+
+// Открытие письма: текст загружается по запросу, если при синхронизации его не скачивали
+messageList.addEventListener('click', function (e) {
+    var row = e.target.closest('tr');
+    if (!row || !row.dataset.id) {
+        return;
+    }
+    var messageBody = document.getElementById('message-body');
+    messageBody.textContent = 'Загрузка...';
+    fetch('/messages/' + row.dataset.id + '/body/')
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'busy') {
+                messageBody.textContent = 'Сервер почты занят, откройте письмо позже';
+            } else {
+                messageBody.textContent = data.status === 'error' ? 'Не удалось загрузить письмо' : data.body;
+            }
+        });
+});
+
 // Обработчик для кнопки "Обновить список"
 document.getElementById('refresh-button').addEventListener('click', function () {
     fetch('/refresh_messages/')
         .then(response => response.json())
         .then(data => {
-            if (data.status === 'ok') {
+            if (data.status === 'ok' && data.queued) {
                 // Очищаем таблицу сообщений
                 messageList.innerHTML = '';
+                nextCursor = null;
                 progressBar.style.width = '0%';
                 progressText.textContent = 'Начало обновления...';
+            } else if (data.status === 'ok') {
+                // Синхронизация уже идёт: её прогресс продолжает приходить в сокет
+                progressText.textContent = 'Обновление уже выполняется...';
             }
         });
 });
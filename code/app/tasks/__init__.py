@@ -1,3 +1,6 @@
-from .fetch_emails import fetch_emails
+from .cleanup import cleanup_message_contents
+from .fetch_all_emails import fetch_all_emails
+from .fetch_emails import backfill_email_bodies, fetch_emails, fetch_emails_batch, queue_sync
 
-__all__ = ['fetch_emails']
+__all__ = ['backfill_email_bodies', 'cleanup_message_contents', 'fetch_all_emails', 'fetch_emails', 'fetch_emails_batch',
+           'queue_sync']
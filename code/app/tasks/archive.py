@@ -0,0 +1,170 @@
+import fcntl
+import mmap
+import os
+import re
+
+import zstandard
+from django.conf import settings
+
+from .metrics import SyncMetrics
+from .parsing import parse_messages
+from .persistence import save_bodies
+from ..models import RawMessage
+
+_SEGMENT_RE = re.compile(r'^(\d+)\.zst$')
+
+
+def account_directory(account_id):
+    return os.path.join(settings.EMAIL_RAW_ARCHIVE_DIR, str(account_id))
+
+
+def segment_path(account_id, segment):
+    return os.path.join(account_directory(account_id), f'{segment:06d}.zst')
+
+
+def latest_segment(account_id):
+    """
+    Номер последнего сегмента аккаунта, 1 — если сегментов ещё нет.
+    """
+    try:
+        names = os.listdir(account_directory(account_id))
+    except FileNotFoundError:
+        return 1
+    numbers = [int(match.group(1)) for match in map(_SEGMENT_RE.match, names) if match]
+    return max(numbers, default=1)
+
+
+class RawArchiveWriter:
+    """
+    Запись исходных писем в архив аккаунта. Каждое письмо — отдельный кадр zstd,
+    дописываемый в конец текущего сегмента; по заполнении сегмента начинается
+    следующий. Дописывание защищено flock: в архив одного аккаунта могут писать
+    папки в разных потоках и процессы загрузки текстов.
+
+    Строки индекса RawMessage копятся до flush, который вызывается в транзакции
+    записи пачки писем: индекс ссылается только на данные, уже сброшенные на диск.
+    """
+
+    def __init__(self, account):
+        self.account = account
+        self.compressor = zstandard.ZstdCompressor(level=settings.EMAIL_RAW_ARCHIVE_LEVEL)
+        self.segment = None
+        self.file = None
+        self.pending = []
+
+    def open_segment(self):
+        """
+        Открытие последнего сегмента аккаунта или следующего за ним, если он заполнен.
+        """
+        self.close()
+        os.makedirs(account_directory(self.account.id), exist_ok=True)
+        segment = latest_segment(self.account.id)
+        path = segment_path(self.account.id, segment)
+        if os.path.exists(path) and os.path.getsize(path) >= settings.EMAIL_RAW_ARCHIVE_SEGMENT_SIZE:
+            segment += 1
+            path = segment_path(self.account.id, segment)
+        self.segment = segment
+        # Без буфера Python и с O_APPEND каждое письмо дописывается одним write
+        self.file = open(path, 'ab', buffering=0)
+
+    def append(self, folder, uid, raw_email):
+        """
+        Сжатие и запись письма в архив, строка индекса откладывается до flush.
+        """
+        data = self.compressor.compress(raw_email)
+        if self.file is None or os.fstat(self.file.fileno()).st_size >= settings.EMAIL_RAW_ARCHIVE_SEGMENT_SIZE:
+            self.open_segment()
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        try:
+            offset = os.fstat(self.file.fileno()).st_size
+            self.file.write(data)
+        finally:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.pending.append(RawMessage(account=self.account, folder=folder, uid=uid, segment=self.segment,
+                                       offset=offset, length=len(data), size=len(raw_email)))
+
+    def flush(self):
+        """
+        Сброс сегмента на диск и запись накопленных строк индекса. Повторно
+        загруженное письмо (например, текст после синхронизации заголовков)
+        получает в индексе новое место.
+        """
+        if not self.pending:
+            return
+        os.fsync(self.file.fileno())
+        entries, self.pending = self.pending, []
+        RawMessage.objects.bulk_create(entries, update_conflicts=True, unique_fields=['folder', 'uid'],
+                                       update_fields=['segment', 'offset', 'length', 'size'])
+
+    def close(self):
+        if self.file is not None:
+            # Строки индекса могут ссылаться на закрываемый сегмент
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+
+
+class RawArchiveReader:
+    """
+    Чтение писем из архива аккаунта по строкам индекса RawMessage. Сегменты
+    отображаются в память (mmap), письмо читается срезом без поиска по файлу.
+    """
+
+    def __init__(self, account):
+        self.account = account
+        self.decompressor = zstandard.ZstdDecompressor()
+        self.maps = {}
+
+    def segment_map(self, segment, end):
+        """
+        Отображение сегмента, покрывающее байты до end. Сегмент, дописанный
+        после отображения, отображается заново.
+        """
+        mapped = self.maps.get(segment)
+        if mapped is None or len(mapped) < end:
+            if mapped is not None:
+                mapped.close()
+            with open(segment_path(self.account.id, segment), 'rb') as file:
+                mapped = self.maps[segment] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return mapped
+
+    def read(self, entry):
+        end = entry.offset + entry.length
+        return self.decompressor.decompress(self.segment_map(entry.segment, end)[entry.offset:end])
+
+    def close(self):
+        for mapped in self.maps.values():
+            mapped.close()
+        self.maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def reprocess_account(account, chunk_size=None):
+    """
+    Повторный разбор писем аккаунта из архива без обращения к IMAP-серверу:
+    текст, превью и поисковый вектор перезаписываются результатом текущего
+    parse_raw_email, недостающие вложения добавляются. Письма читаются по
+    индексу чанками, с пулом процессов разбора (EMAIL_PARSE_WORKERS), если он
+    настроен. Возвращает число обновлённых писем.
+    """
+    chunk_size = chunk_size or settings.EMAIL_FETCH_CHUNK_SIZE
+    metrics = SyncMetrics(account)
+    updated = 0
+    with RawArchiveReader(account) as reader:
+        for folder in account.folders.order_by('id'):
+            last_uid = 0
+            while True:
+                entries = list(folder.raw_messages.filter(uid__gt=last_uid).order_by('uid')[:chunk_size])
+                if not entries:
+                    break
+                last_uid = entries[-1].uid
+                messages = {obj.uid: obj for obj in folder.messages
+                            .filter(uid__in=[entry.uid for entry in entries]).only('id', 'uid', 'content_id')}
+                raw_messages = ((entry.uid, reader.read(entry)) for entry in entries if entry.uid in messages)
+                updated += save_bodies(messages, parse_messages(raw_messages, account.provider, metrics))
+    return updated
@@ -0,0 +1,443 @@
+import asyncio
+import imaplib
+import re
+
+import aioimaplib
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from loguru import logger
+
+from .changes import apply_changes, changed_since_modifier, diff_flags, format_flags, local_flags
+from .email_processing import EmailFetcher
+from .folders import INBOX, parse_list_response, quote_folder, select_folders
+from .headers import HEADER_FETCH_ITEMS, get_attribute, parse_header_fetch, text_part_fetch_items, text_part_requests
+from .imap_parser import build_uid_set, chunked, iter_fetch_response
+from .locks import SyncLease, acquire_provider_slots, clear_sync_queued, release_provider_slot
+from .parsing import aparse_messages
+from .persistence import AsyncEmailMessageBuffer
+from .progress import ProgressReporter, SyncCounters, progress_group
+from .utils import handle_exception
+from ..models import EmailAccount
+
+_FETCH_LINE_RE = re.compile(rb'^(\d+) FETCH ')
+_SELECT_STATE_RES = {
+    'uidvalidity': re.compile(rb'\[UIDVALIDITY (\d+)\]'),
+    'highestmodseq': re.compile(rb'\[HIGHESTMODSEQ (\d+)\]'),
+    'exists': re.compile(rb'^(\d+) EXISTS'),
+}
+_CONNECTION_ERRORS = (aioimaplib.Abort, aioimaplib.CommandTimeout, asyncio.TimeoutError, ConnectionError)
+
+
+def to_imaplib_fetch_data(lines):
+    """
+    Приведение ответа FETCH aioimaplib к формату imaplib для iter_fetch_response:
+    строка, заканчивающаяся литералом {N}, объединяется с литералом в кортеж.
+    """
+    data = []
+    lines = iter(lines)
+    for line in lines:
+        if isinstance(line, bytearray):
+            continue
+        line = _FETCH_LINE_RE.sub(rb'\1 ', line)
+        if line.endswith(b'}'):
+            data.append((line, bytes(next(lines, b''))))
+        else:
+            data.append(line)
+    return data
+
+
+class AsyncEmailFetcher(EmailFetcher):
+    """
+    Асинхронный движок синхронизации с тем же интерфейсом, что и EmailFetcher.
+
+    Сетевые операции IMAP (aioimaplib), запись в базу (асинхронный ORM) и отправка
+    событий в channel layer не блокируют event loop, поэтому один процесс может
+    одновременно синхронизировать много аккаунтов (см. sync_accounts).
+    """
+
+    def __init__(self, account, folder_name=INBOX, progress=None, counters=None):
+        super().__init__(account, folder_name, progress, counters)
+        self.buffer = AsyncEmailMessageBuffer(account, on_flush=self.aon_batch_saved,
+                                              on_checkpoint=self.save_checkpoint, metrics=self.metrics)
+        self.select_lines = []
+
+    @staticmethod
+    def check_response(response, command):
+        if response.result != 'OK':
+            raise imaplib.IMAP4.error(f'{command}: {response.result} {response.lines}')
+        # Последняя строка — текст завершающего ответа с тегом
+        return response.lines[:-1]
+
+    async def aconnect(self):
+        """
+        Подключение к почтовому серверу и выбор папки. Уже открытая сессия
+        (после alist_folders) используется повторно.
+        """
+        with self.metrics.stage('connect'):
+            if self.mail is None:
+                await self.alogin()
+            self.select_lines = self.check_response(await self.mail.select(quote_folder(self.folder_name)), 'SELECT')
+
+    async def alogin(self):
+        """
+        Подключение и авторизация на почтовом сервере.
+        """
+        host, port = self.imap_address()
+        if settings.EMAIL_IMAP_SSL:
+            self.mail = aioimaplib.IMAP4_SSL(host=host, port=port)
+        else:
+            self.mail = aioimaplib.IMAP4(host=host, port=port)
+        await self.mail.wait_hello_from_server()
+        self.check_response(await self.mail.login(self.email_address, self.password), 'LOGIN')
+        await self.aenable_extensions()
+
+    async def alist_folders(self):
+        """
+        Папки ящика для синхронизации, как в BaseEmailFetcher.list_folders.
+        """
+        lines = self.check_response(await self.mail.list('""', '*'), 'LIST')
+        return select_folders(parse_list_response(lines))
+
+    async def aenable_extensions(self):
+        """
+        Включение QRESYNC или CONDSTORE, как в BaseEmailFetcher.enable_extensions.
+        aioimaplib сам обновляет список возможностей из ответа на LOGIN.
+        """
+        if not self.has_capability('ENABLE'):
+            return
+        if self.has_capability('QRESYNC'):
+            await self.mail.enable('QRESYNC')
+        elif self.has_capability('CONDSTORE'):
+            await self.mail.enable('CONDSTORE')
+
+    def has_capability(self, capability):
+        return self.mail.has_capability(capability)
+
+    def get_select_state(self):
+        state = dict.fromkeys(_SELECT_STATE_RES)
+        for line in self.select_lines:
+            for name, regex in _SELECT_STATE_RES.items():
+                match = regex.search(line)
+                if match:
+                    state[name] = int(match.group(1))
+        return state
+
+    async def adisconnect(self):
+        """
+        Отключение от почтового сервера.
+        """
+        if self.mail:
+            await self.mail.logout()
+            self.mail = None
+
+    async def adiscard(self):
+        """
+        Закрытие сессии после ошибки без выброса исключений.
+        """
+        if self.mail:
+            mail, self.mail = self.mail, None
+            try:
+                await mail.logout()
+            except Exception as e:
+                logger.debug(f'Ошибка при закрытии IMAP-сессии: {e}')
+
+    async def afetch_email_uids(self):
+        """
+        Получение UID писем, которые нужно обработать.
+        """
+        search_criteria = self.get_search_criteria(self.folder.last_uid)
+        with self.metrics.stage('search'):
+            lines = self.check_response(await self.mail.uid_search(search_criteria, charset=None), 'UID SEARCH')
+        email_uids = [uid for uid in map(int, lines[0].split()) if uid > self.folder.last_uid] if lines else []
+        self.total_emails = len(email_uids)
+        self.counters.add_total(self.total_emails)
+        return email_uids
+
+    async def afetch_messages(self, email_uids):
+        """
+        Пакетная загрузка писем чанками, как в EmailFetcher.fetch_messages.
+        """
+        for chunk in chunked(sorted(email_uids), self.fetch_chunk_size):
+            with self.metrics.stage('fetch'):
+                response = await self.mail.uid('fetch', build_uid_set(chunk), '(UID FLAGS RFC822)')
+            # Пропущенный чанк нельзя оставить позади, см. EmailFetcher.fetch_messages
+            data = to_imaplib_fetch_data(self.check_response(response, f'UID FETCH {chunk[0]}-{chunk[-1]}'))
+            self.metrics.count_fetched(data)
+
+            for _, attributes in iter_fetch_response(data):
+                uid = attributes.get('UID')
+                raw_email = attributes.get('RFC822')
+                if uid is None or raw_email is None:
+                    continue
+                self.fetched_flags[int(uid)] = format_flags(attributes.get('FLAGS'))
+                self.archive_message(int(uid), raw_email)
+                await self.progress.aupdate(*self.count_read())
+                yield int(uid), raw_email
+
+    async def afetch_headers(self, email_uids):
+        """
+        Загрузка заголовков и начала текстовой части писем, как в EmailFetcher.fetch_headers.
+        """
+        for chunk in chunked(sorted(email_uids), self.fetch_chunk_size):
+            with self.metrics.stage('fetch'):
+                response = await self.mail.uid('fetch', build_uid_set(chunk), HEADER_FETCH_ITEMS)
+            data = to_imaplib_fetch_data(self.check_response(response, f'UID FETCH {chunk[0]}-{chunk[-1]}'))
+            self.metrics.count_fetched(data)
+
+            headers = {int(attributes['UID']): attributes
+                       for _, attributes in iter_fetch_response(data) if attributes.get('UID')}
+            self.fetched_flags.update((uid, format_flags(attributes.get('FLAGS'))) for uid, attributes in headers.items())
+
+            requests, parts = text_part_requests(headers)
+            texts = {}
+            for section, uids in requests.items():
+                with self.metrics.stage('fetch'):
+                    response = await self.mail.uid('fetch', build_uid_set(uids), text_part_fetch_items(section))
+                if response.result != 'OK':
+                    logger.error(f'Ошибка при загрузке текста писем секции {section}: {response.lines}')
+                    continue
+                data = to_imaplib_fetch_data(response.lines[:-1])
+                self.metrics.count_fetched(data)
+                for _, attributes in iter_fetch_response(data):
+                    if attributes.get('UID'):
+                        texts[int(attributes['UID'])] = get_attribute(attributes, f'BODY[{section}]')
+
+            for uid in sorted(headers):
+                await self.progress.aupdate(*self.count_read())
+                yield uid, parse_header_fetch(uid, headers[uid], parts.get(uid), texts.get(uid), self.provider)
+
+    async def async_changes(self, state, new_count):
+        """
+        Синхронизация флагов и удалений, как в EmailFetcher.sync_changes.
+        aioimaplib отбрасывает ответы VANISHED, поэтому удаления и с QRESYNC
+        определяются сравнением числа писем, как для CONDSTORE.
+        """
+        last_uid = self.folder.last_uid
+        if not last_uid:
+            return
+
+        modseq = state['highestmodseq']
+        if modseq is None or self.folder.highest_modseq is None:
+            changed, vanished = await self.adiff_all_flags(last_uid)
+            updated, deleted = await sync_to_async(apply_changes)(self.folder, changed, vanished)
+        else:
+            changed = {}
+            if modseq != self.folder.highest_modseq:
+                changed = await self.afetch_changed_flags(last_uid)
+            vanished = await self.afind_expunged(last_uid, state['exists'], new_count)
+            updated, deleted = await sync_to_async(apply_changes)(self.folder, changed, vanished)
+
+        if updated or deleted:
+            logger.info(f'Папка {self.folder}: обновлены флаги {updated} писем, удалено {deleted}')
+
+    async def afetch_flags(self, uid_set, modifier=None):
+        """
+        UID FETCH флагов: {uid: флаги}.
+        """
+        # aioimaplib передаёт в FETCH только два аргумента, модификатор идёт вместе с атрибутами
+        items = f'(UID FLAGS) {modifier}' if modifier else '(UID FLAGS)'
+        lines = self.check_response(await self.mail.uid('fetch', uid_set, items), 'UID FETCH')
+        return {int(attributes['UID']): format_flags(attributes.get('FLAGS'))
+                for _, attributes in iter_fetch_response(to_imaplib_fetch_data(lines)) if attributes.get('UID')}
+
+    async def afetch_changed_flags(self, last_uid):
+        return await self.afetch_flags(f'1:{last_uid}', changed_since_modifier(self.folder.highest_modseq, False))
+
+    async def afind_expunged(self, last_uid, exists, new_count):
+        saved = self.folder.messages.filter(uid__isnull=False, uid__lte=last_uid)
+        if exists is not None and exists - new_count == await saved.acount():
+            return []
+        lines = self.check_response(await self.mail.uid_search(f'UID 1:{last_uid}', charset=None), 'UID SEARCH')
+        server_uids = set(map(int, lines[0].split())) if lines else set()
+        return [uid async for uid in saved.values_list('uid', flat=True) if uid not in server_uids]
+
+    async def adiff_all_flags(self, last_uid):
+        uids = [uid async for uid in (self.folder.messages
+                                      .filter(uid__isnull=False, uid__lte=last_uid)
+                                      .order_by('uid')
+                                      .values_list('uid', flat=True))]
+        changed, vanished = {}, []
+        for chunk in chunked(uids, settings.EMAIL_FLAGS_CHUNK_SIZE):
+            remote = await self.afetch_flags(build_uid_set(chunk))
+            chunk_changed, chunk_vanished = diff_flags(await sync_to_async(local_flags)(self.folder, chunk), remote)
+            changed.update(chunk_changed)
+            vanished.extend(chunk_vanished)
+        return changed, vanished
+
+    async def aon_batch_saved(self, batch, saved):
+        """
+        Обработка записанной пачки: одно уведомление и одно обновление прогресса.
+        """
+        if saved:
+            with self.metrics.stage('notify'):
+                await self.channel_layer.group_send(self.progress.group_name, self.new_messages_event(saved))
+        await self.progress.aupdate(*self.count_received(len(batch)))
+
+    async def arun_sync(self):
+        """
+        Получение и обработка новых писем через открытое подключение.
+        """
+        state = self.get_select_state()
+        await sync_to_async(self.prepare_folder)(state['uidvalidity'])
+        email_uids = await self.afetch_email_uids()
+
+        # HIGHESTMODSEQ запоминается только вместе с флагами, см. EmailFetcher.sync
+        if settings.EMAIL_SYNC_FLAGS:
+            await self.async_changes(state, len(email_uids))
+            await sync_to_async(self.save_modseq)(state['highestmodseq'])
+
+        if self.total_emails > 0:
+            await self.progress.aupdate(*self.found_status(), force=True)
+
+            if self.headers_only:
+                messages = self.afetch_headers(email_uids)
+            else:
+                messages = aparse_messages(self.afetch_messages(email_uids), self.provider, self.metrics)
+            async for uid, fields in messages:
+                await self.buffer.aadd(self.build_email_message(uid, fields))
+
+            await self.buffer.aflush()
+            await sync_to_async(self.close_archive)()
+
+        if not self.shared_progress:
+            await self.progress.aupdate('Все сообщения получены', progress=100, force=True)
+
+    async def afetch_and_process_emails(self):
+        """
+        Основной метод для получения и обработки писем.
+        Сетевые ошибки приводятся к imaplib.IMAP4.abort, как в синхронном движке.
+        """
+        try:
+            await self.aconnect()
+            await self.arun_sync()
+            await self.adisconnect()
+            logger.info(f'Папка {self.folder_name}: завершилось успешно')
+        except _CONNECTION_ERRORS as e:
+            logger.error(f"Папка {self.folder_name}: соединение с сервером было прервано: {e}")
+            self.metrics.count_error(e)
+            raise imaplib.IMAP4.abort(str(e)) from e
+        except Exception as e:
+            logger.error(f"Папка {self.folder_name}: ошибка при получении писем: {e}")
+            self.metrics.count_error(e)
+            raise e
+        finally:
+            # После успешной синхронизации сессия уже закрыта
+            await self.adiscard()
+
+    def fetch_and_process_emails(self):
+        async_to_sync(self.afetch_and_process_emails)()
+
+    @classmethod
+    async def async_folders(cls, account, max_connections=1):
+        """
+        Синхронизация папок аккаунта, как в EmailFetcher.sync_folders: сессия,
+        открытая для LIST, достаётся INBOX, остальные папки ждут свободного
+        подключения из max_connections.
+        """
+        progress = ProgressReporter(get_channel_layer(), progress_group(account.id))
+        counters = SyncCounters()
+        first = cls(account, progress=progress, counters=counters)
+        try:
+            await first.alogin()
+            names = await first.alist_folders()
+        except _CONNECTION_ERRORS as e:
+            await first.adiscard()
+            raise imaplib.IMAP4.abort(str(e)) from e
+        except BaseException:
+            await first.adiscard()
+            raise
+        if not names:
+            await first.adisconnect()
+            logger.warning(f'У аккаунта {account} нет папок, подходящих под EMAIL_SYNC_FOLDERS.')
+            return
+
+        first.folder_name = names[0]
+        fetchers = [first] + [cls(account, name, progress, counters) for name in names[1:]]
+        semaphore = asyncio.Semaphore(max_connections)
+
+        async def run(fetcher):
+            async with semaphore:
+                try:
+                    await fetcher.afetch_and_process_emails()
+                except Exception as e:
+                    return e
+            return None
+
+        errors = await asyncio.gather(*(run(fetcher) for fetcher in fetchers))
+        await progress.aupdate('Все сообщения получены', progress=100, force=True)
+        for error in errors:
+            if error is not None:
+                raise error
+
+    @classmethod
+    def sync_folders(cls, account, max_connections=1):
+        async_to_sync(cls.async_folders)(account, max_connections)
+
+
+async def sync_account(account_id, task_id):
+    """
+    Синхронизация одного аккаунта в общем event loop с учётом блокировки
+    аккаунта и лимита подключений к провайдеру. task_id — задача группы,
+    которая поставила аккаунт в очередь.
+    """
+    try:
+        account = await EmailAccount.objects.aget(id=account_id)
+    except EmailAccount.DoesNotExist:
+        logger.error(f"Аккаунт с ID {account_id} не найден.")
+        await sync_to_async(clear_sync_queued)(account_id, task_id)
+        return
+
+    lease = SyncLease(account_id, task_id)
+    if not await sync_to_async(lease.acquire)():
+        logger.info(f"Синхронизация аккаунта {account.email} уже выполняется. Пропуск.")
+        await sync_to_async(clear_sync_queued)(account_id, task_id)
+        return
+
+    slots = await sync_to_async(acquire_provider_slots)(account.provider, f'async:{account_id}',
+                                                        settings.EMAIL_ACCOUNT_MAX_CONNECTIONS)
+    if not slots:
+        # Лимит провайдера исчерпан: передаём аккаунт отдельной задаче с задержкой
+        await sync_to_async(lease.release)()
+        await sync_to_async(clear_sync_queued)(account_id, task_id)
+        from .fetch_emails import queue_sync
+        await sync_to_async(queue_sync)(account_id, countdown=settings.EMAIL_PROVIDER_RETRY_DELAY)
+        return
+
+    lease.slots = slots
+    await sync_to_async(clear_sync_queued)(account_id, task_id)
+    aborted = False
+    try:
+        await AsyncEmailFetcher.async_folders(account, len(slots))
+    except imaplib.IMAP4.abort as e:
+        logger.error(f"Соединение с {account.email} прервано, повтор отдельной задачей: {e}")
+        aborted = True
+    except Exception as e:
+        await sync_to_async(handle_exception)(e)
+        return
+    finally:
+        await sync_to_async(lease.release)()
+        for slot in slots:
+            await sync_to_async(release_provider_slot)(slot)
+
+    from .fetch_emails import queue_sync, schedule_body_backfill
+    if aborted:
+        # Повторы с экспоненциальной задержкой выполнит задача fetch_emails,
+        # папки продолжат с записанных отметок last_uid
+        await sync_to_async(queue_sync)(account_id, countdown=settings.EMAIL_SYNC_RETRY_BACKOFF)
+    else:
+        await sync_to_async(schedule_body_backfill)(account_id)
+
+
+async def sync_accounts(account_ids, task_id):
+    """
+    Одновременная синхронизация нескольких аккаунтов в одном процессе,
+    не более EMAIL_ASYNC_MAX_CONCURRENCY сразу.
+    """
+    semaphore = asyncio.Semaphore(settings.EMAIL_ASYNC_MAX_CONCURRENCY)
+
+    async def run(account_id):
+        async with semaphore:
+            await sync_account(account_id, task_id)
+
+    await asyncio.gather(*(run(account_id) for account_id in account_ids))
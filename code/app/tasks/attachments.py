@@ -0,0 +1,135 @@
+import binascii
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from loguru import logger
+
+from .charsets import decode_header_text
+
+ATTACHMENTS_DIR = 'attachments'
+CHUNK_SIZE = 64 * 1024
+
+
+def attachment_path(sha256):
+    """
+    Путь файла вложения относительно MEDIA_ROOT по его хешу: attachments/ab/cd/abcd....
+    Одинаковые файлы из разных писем хранятся один раз.
+    """
+    return os.path.join(ATTACHMENTS_DIR, sha256[:2], sha256[2:4], sha256)
+
+
+def decode_filename(part):
+    """
+    Имя файла вложения с декодированием RFC 2047/2231.
+    """
+    filename = part.get_filename()
+    if not filename:
+        return ''
+    try:
+        filename = decode_header_text(filename)
+    except Exception as e:
+        logger.error(f'Ошибка декодирования имени вложения: {e}')
+    return filename[:255]
+
+
+def iter_base64(payload):
+    """
+    Декодирование base64 фрагментами: в памяти не бывает больше CHUNK_SIZE
+    декодированных байт сразу.
+    """
+    tail = b''
+    for start in range(0, len(payload), CHUNK_SIZE):
+        data = tail + b''.join(payload[start:start + CHUNK_SIZE].encode('ascii', 'ignore').split())
+        cut = len(data) // 4 * 4
+        tail = data[cut:]
+        if cut:
+            yield binascii.a2b_base64(data[:cut])
+    if tail.rstrip(b'='):
+        yield binascii.a2b_base64(tail + b'=' * (-len(tail) % 4))
+
+
+def iter_quoted_printable(payload):
+    """
+    Декодирование quoted-printable фрагментами, разрезанными по границам строк.
+    """
+    start = 0
+    while start < len(payload):
+        end = payload.find('\n', start + CHUNK_SIZE)
+        end = len(payload) if end == -1 else end + 1
+        yield binascii.a2b_qp(payload[start:end].encode('raw-unicode-escape'))
+        start = end
+
+
+def iter_payload_bytes(part):
+    """
+    Декодированное содержимое части письма фрагментами.
+    """
+    payload = part.get_payload()
+    if isinstance(payload, str):
+        encoding = str(part.get('Content-Transfer-Encoding', '')).strip().lower()
+        if encoding == 'base64':
+            return iter_base64(payload)
+        if encoding == 'quoted-printable':
+            return iter_quoted_printable(payload)
+    return iter([part.get_payload(decode=True) or b''])
+
+
+def store_attachment(part):
+    """
+    Потоковая запись вложения во временный файл с подсчётом SHA-256 и перенос
+    в хранилище по хешу. Если такой файл уже есть, временный файл удаляется.
+    Возвращает поля Attachment.
+    """
+    tmp_dir = os.path.join(settings.MEDIA_ROOT, ATTACHMENTS_DIR, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+        try:
+            for chunk in iter_payload_bytes(part):
+                digest.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+        except Exception:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+
+    sha256 = digest.hexdigest()
+    path = attachment_path(sha256)
+    full_path = os.path.join(settings.MEDIA_ROOT, path)
+    if os.path.exists(full_path):
+        os.remove(tmp.name)
+    else:
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # os.replace атомарен: параллельная запись того же файла не оставит его недописанным
+        os.replace(tmp.name, full_path)
+
+    return {
+        'file': path,
+        'filename': decode_filename(part),
+        'content_type': part.get_content_type(),
+        'size': size,
+        'sha256': sha256,
+    }
+
+
+def extract_attachments(email_message):
+    """
+    Сохранение вложений письма в хранилище. Возвращает список полей Attachment;
+    вложение, которое не удалось сохранить, пропускается.
+    """
+    attachments = []
+    if not email_message.is_multipart():
+        return attachments
+    for part in email_message.walk():
+        if part.is_multipart() or 'attachment' not in str(part.get('Content-Disposition')):
+            continue
+        try:
+            attachments.append(store_attachment(part))
+        except Exception as e:
+            logger.error(f'Ошибка сохранения вложения: {e}')
+    return attachments
@@ -0,0 +1,115 @@
+import re
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db.models import Q
+
+from .imap_parser import chunked
+from ..models import EmailMessage
+
+_VANISHED_RE = re.compile(rb'^(?:VANISHED )?(?:\(EARLIER\) )?([\d:,]+)$')
+
+
+def format_flags(flags):
+    """
+    Флаги письма из ответа FETCH в строку для EmailMessage.flags: '\\Flagged \\Seen'.
+    """
+    return ' '.join(sorted(flags or []))[:255]
+
+
+def parse_uid_ranges(uid_set):
+    """
+    Разбор IMAP sequence set в пары (начало, конец): '1:3,7' -> [(1, 3), (7, 7)].
+    """
+    if isinstance(uid_set, bytes):
+        uid_set = uid_set.decode()
+    ranges = []
+    for item in uid_set.split(','):
+        start, _, end = item.partition(':')
+        start, end = int(start), int(end or start)
+        ranges.append((min(start, end), max(start, end)))
+    return ranges
+
+
+def parse_vanished(lines):
+    """
+    UID удалённых писем из ответов VANISHED (RFC 7162, QRESYNC) в виде пар (начало, конец).
+    Строки — данные ответа ('(EARLIER) 1:5,7') с префиксом VANISHED или без него.
+    """
+    ranges = []
+    for line in lines:
+        if not line:
+            continue
+        if isinstance(line, str):
+            line = line.encode()
+        match = _VANISHED_RE.match(line.strip())
+        if match:
+            ranges.extend(parse_uid_ranges(match.group(1)))
+    return ranges
+
+
+def changed_since_modifier(modseq, qresync):
+    """
+    Модификатор UID FETCH для загрузки только изменившихся с modseq писем.
+    С QRESYNC сервер заодно сообщает UID удалённых писем (VANISHED).
+    """
+    if qresync:
+        return f'(CHANGEDSINCE {modseq} VANISHED)'
+    return f'(CHANGEDSINCE {modseq})'
+
+
+def local_flags(folder, uids):
+    """
+    Сохранённые флаги писем папки: {uid: флаги}.
+    """
+    return dict(EmailMessage.objects
+                .filter(folder=folder, uid__in=uids)
+                .values_list('uid', 'flags'))
+
+
+def diff_flags(local, remote):
+    """
+    Сравнение сохранённых флагов с флагами на сервере для одного диапазона UID.
+    Возвращает (изменённые флаги {uid: флаги}, UID писем, которых на сервере больше нет).
+    """
+    changed = {uid: flags for uid, flags in remote.items() if uid in local and local[uid] != flags}
+    vanished = [uid for uid in local if uid not in remote]
+    return changed, vanished
+
+
+def apply_changes(folder, changed_flags, vanished_uids=(), vanished_ranges=()):
+    """
+    Запись изменений папки в базу: одно UPDATE на каждый набор флагов, удаление писем
+    по UID и по диапазонам UID. Возвращает (обновлено, удалено).
+    """
+    by_flags = defaultdict(list)
+    for uid, flags in changed_flags.items():
+        by_flags[flags].append(uid)
+
+    updated = 0
+    for flags, uids in by_flags.items():
+        for chunk in chunked(uids, settings.EMAIL_FLAGS_CHUNK_SIZE):
+            updated += (EmailMessage.objects
+                        .filter(folder=folder, uid__in=chunk)
+                        .exclude(flags=flags)
+                        .update(flags=flags))
+
+    deleted = 0
+    for chunk in chunked(list(vanished_uids), settings.EMAIL_FLAGS_CHUNK_SIZE):
+        deleted += delete_messages(EmailMessage.objects.filter(folder=folder, uid__in=chunk))
+    for chunk in chunked(list(vanished_ranges), 100):
+        condition = reduce(or_, (Q(uid__gte=start, uid__lte=end) for start, end in chunk))
+        deleted += delete_messages(EmailMessage.objects.filter(condition, folder=folder))
+    return updated, deleted
+
+
+def delete_messages(queryset):
+    """
+    Удаление писем вместе с вложениями. Общий текст остаётся: письмо могло
+    быть перемещено в папку, которая синхронизируется параллельно, его
+    удаляет cleanup_message_contents. Возвращает число удалённых писем.
+    """
+    _, deleted = queryset.delete()
+    return deleted.get(EmailMessage._meta.label, 0)
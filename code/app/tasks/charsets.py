@@ -0,0 +1,129 @@
+import codecs
+import re
+from email.header import decode_header
+from functools import lru_cache
+
+from django.conf import settings
+
+# Названия кодировок из писем, которых нет среди псевдонимов codecs
+CHARSET_ALIASES = {
+    'win-1251': 'cp1251',
+    'cp-1251': 'cp1251',
+    'x-cp1251': 'cp1251',
+    'win-1252': 'cp1252',
+    'x-cp1252': 'cp1252',
+    'x-mac-cyrillic': 'mac_cyrillic',
+    'x-mac-roman': 'mac_roman',
+    'iso-8859-8-i': 'iso8859_8',
+    'gb2312': 'gb18030',
+    'gbk': 'gb18030',
+    'x-gbk': 'gb18030',
+}
+
+# Байт начала текста, по которым выбирается запасная кодировка
+SNIFF_BYTES = 64 * 1024
+
+_SURROGATES_RE = re.compile('[\udc80-\udcff]')
+
+
+def normalize_charset(charset):
+    """
+    Название кодировки без кавычек, пробелов и регистра: ' "Windows-1251"' -> 'windows-1251'.
+    """
+    return charset.strip().strip('"\'').strip().lower()
+
+
+@lru_cache(maxsize=256)
+def resolve_charset(charset):
+    """
+    Имя кодека Python для кодировки из письма или None, если она не указана
+    или неизвестна. Результат кэшируется вместе с отрицательным: неизвестная
+    кодировка не стоит LookupError на каждом письме.
+    """
+    if not charset:
+        return None
+    name = normalize_charset(charset)
+    name = CHARSET_ALIASES.get(name, name)
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+
+def guess_charset(data):
+    """
+    Кодировка текста без известного charset: первая из EMAIL_FALLBACK_CHARSETS,
+    которой начало данных декодируется без ошибок, иначе последняя.
+    """
+    sample = data[:SNIFF_BYTES]
+    for charset in settings.EMAIL_FALLBACK_CHARSETS[:-1]:
+        try:
+            # Инкрементальный декодер не считает ошибкой символ, оборванный на границе выборки
+            codecs.getincrementaldecoder(charset)().decode(sample)
+        except UnicodeDecodeError:
+            continue
+        return charset
+    return settings.EMAIL_FALLBACK_CHARSETS[-1]
+
+
+def decode_bytes(data, charset):
+    """
+    Декодирование байтов в кодировке charset из письма, ошибки заменяются U+FFFD.
+    """
+    return data.decode(resolve_charset(charset) or guess_charset(data), errors='replace')
+
+
+def has_surrogates(value):
+    return _SURROGATES_RE.search(value) is not None
+
+
+def get_raw_header(email_message, name):
+    """
+    Значение заголовка name в том виде, в каком его сохранил парсер, или None.
+    email_message[name] для 8-битного заголовка возвращает объект Header, в str()
+    которого байты уже заменены на U+FFFD; в сыром значении они остаются
+    суррогатами и декодируются decode_encoded_header.
+    """
+    name = name.lower()
+    return next((value for key, value in email_message.raw_items() if key.lower() == name), None)
+
+
+def decode_header_text(value):
+    """
+    Декодирование заголовка письма в строку. ASCII-заголовок без encoded-word
+    возвращается как есть, остальные декодируются decode_encoded_header.
+    """
+    if value.isascii() and '=?' not in value:
+        return value
+    return decode_encoded_header(value)
+
+
+@lru_cache(maxsize=settings.EMAIL_HEADER_CACHE_SIZE)
+def decode_encoded_header(value):
+    """
+    Декодирование заголовка с encoded-word (RFC 2047) или 8-битными байтами.
+    Рассылки повторяют одни и те же темы, поэтому результат кэшируется.
+
+    Парсер писем хранит 8-битные байты заголовка как суррогаты: они
+    декодируются по EMAIL_FALLBACK_CHARSETS. Текст encoded-word декодируется
+    кодировкой из resolve_charset, ошибки заменяются, а не обрывают разбор.
+    """
+    if has_surrogates(value):
+        value = decode_bytes(value.encode('utf-8', 'surrogateescape'), None)
+    chunks = decode_header(value)
+    if isinstance(chunks[0][0], str):
+        # Без encoded-word decode_header возвращает строку без изменений
+        return value
+    # Незакодированные куски decode_header возвращает в raw-unicode-escape
+    words = []
+    last_charset = None
+    for data, charset in chunks:
+        word = decode_bytes(data, charset) if charset else data.decode('raw-unicode-escape')
+        # Как в make_header: на стыке encoded-word и текста без пробела или скобки ставится пробел
+        if words and (charset is None) != (last_charset is None):
+            edge = word[:1] if charset is None else words[-1][-1:]
+            if edge and not edge.isspace() and edge not in '()\\':
+                words.append(' ')
+        words.append(word)
+        last_charset = charset
+    return ''.join(words)
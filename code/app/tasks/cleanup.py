@@ -0,0 +1,23 @@
+from celery import shared_task
+from django.db import IntegrityError
+from loguru import logger
+
+from .persistence import delete_unused_contents
+
+
+@shared_task(name='app.tasks.cleanup_message_contents')
+def cleanup_message_contents():
+    """
+    Периодическое удаление общих текстов писем (MessageContent), на которые
+    больше не ссылается ни одно письмо. Недавно привязанные тексты пропускаются
+    (EMAIL_CONTENT_CLEANUP_GRACE). Если текст в это же время всё же привязала
+    идущая синхронизация, база отклонит удаление, и текст будет проверен
+    при следующем запуске.
+    """
+    try:
+        deleted = delete_unused_contents()
+    except IntegrityError as e:
+        logger.warning(f"Удаление неиспользуемых текстов писем отложено: {e}")
+        return 0
+    logger.info(f"Удалено неиспользуемых текстов писем: {deleted}")
+    return deleted
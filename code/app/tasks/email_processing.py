@@ -1,16 +1,23 @@
-import email
 import imaplib
-import time
-from datetime import datetime
-from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
 
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
-from django.db.utils import IntegrityError
+from django.conf import settings
+from django.db import connections
 from loguru import logger
 
-from .utils import decode_subject, get_email_body_content
-from ..models import EmailMessage
+from .changes import apply_changes, changed_since_modifier, diff_flags, format_flags, local_flags, parse_vanished
+from .folders import INBOX, parse_list_response, quote_folder, select_folders
+from .headers import HEADER_FETCH_ITEMS, get_attribute, parse_header_fetch, text_part_fetch_items, text_part_requests
+from .imap_parser import build_uid_set, chunked, iter_fetch_response
+from .imap_pool import connection_pool
+from .metrics import SyncMetrics
+from .parsing import parse_messages
+from .persistence import EmailMessageBuffer, build_email_message, save_bodies
+from .progress import ProgressReporter, SyncCounters, progress_group
+from ..message_list import message_row
+from ..models import MailFolder
 
 
 class BaseEmailFetcher:
@@ -18,27 +25,96 @@ class BaseEmailFetcher:
     Родительский класс, отвечающий за подключение и отключение от почтового сервера.
     """
 
-    def __init__(self, account):
+    def __init__(self, account, folder_name=INBOX):
         self.account = account
+        self.folder_name = folder_name
         self.provider = account.provider
         self.email_address = account.email
         self.password = account.password
         self.mail = None
+        self.metrics = SyncMetrics(account)
+
+    def imap_address(self):
+        """
+        Адрес IMAP-сервера: imap.<провайдер> или EMAIL_IMAP_HOST, если задан
+        (локальный сервер для тестов и нагрузочных замеров).
+        """
+        return settings.EMAIL_IMAP_HOST or f'imap.{self.provider}', settings.EMAIL_IMAP_PORT
+
+    def open_connection(self):
+        """
+        Новое подключение и авторизация на почтовом сервере.
+        """
+        host, port = self.imap_address()
+        if settings.EMAIL_IMAP_SSL:
+            mail = imaplib.IMAP4_SSL(host, port)
+        else:
+            mail = imaplib.IMAP4(host, port)
+        try:
+            mail.login(self.email_address, self.password)
+            self.enable_extensions(mail)
+        except BaseException:
+            connection_pool.discard(mail)
+            raise
+        return mail
+
+    @staticmethod
+    def enable_extensions(mail):
+        """
+        Включение QRESYNC или CONDSTORE (RFC 7162), если сервер их поддерживает.
+        ENABLE допустим только до SELECT, поэтому выполняется сразу после входа.
+        """
+        # Список возможностей после авторизации может отличаться от приветствия
+        _, data = mail.capability()
+        mail.capabilities = tuple(data[-1].decode().upper().split())
+        if 'ENABLE' not in mail.capabilities:
+            return
+        if 'QRESYNC' in mail.capabilities:
+            mail.enable('QRESYNC')
+        elif 'CONDSTORE' in mail.capabilities:
+            mail.enable('CONDSTORE')
 
     def connect(self):
         """
-        Подключение к почтовому серверу.
+        Подключение к почтовому серверу. Авторизованная сессия берётся из пула, если есть.
+        """
+        with self.metrics.stage('connect'):
+            self.mail = connection_pool.acquire(self.account, self.open_connection)
+            self.select_folder()
+
+    def select_folder(self):
+        """
+        Выбор синхронизируемой папки.
+        """
+        result, data = self.mail.select(quote_folder(self.folder_name))
+        if result != 'OK':
+            raise imaplib.IMAP4.error(f'Не удалось выбрать папку {self.folder_name}: {data}')
+
+    def list_folders(self):
+        """
+        Папки ящика для синхронизации по ответу LIST, INBOX первой.
         """
-        self.mail = imaplib.IMAP4_SSL(f'imap.{self.provider}')
-        self.mail.login(self.email_address, self.password)
-        self.mail.select('inbox')
+        result, data = self.mail.list()
+        if result != 'OK':
+            raise imaplib.IMAP4.error(f'Ошибка при получении списка папок: {data}')
+        return select_folders(parse_list_response(data))
 
     def disconnect(self):
         """
-        Отключение от почтового сервера.
+        Отключение от почтового сервера: сессия возвращается в пул.
         """
         if self.mail:
-            self.mail.logout()
+            connection_pool.release(self.account, self.mail)
+            self.mail = None
+
+    def discard(self):
+        """
+        Закрытие сессии после ошибки: её состояние неизвестно, поэтому в пул
+        она не возвращается.
+        """
+        if self.mail:
+            connection_pool.discard(self.mail)
+            self.mail = None
 
 
 class EmailFetcher(BaseEmailFetcher):
@@ -46,133 +122,361 @@ class EmailFetcher(BaseEmailFetcher):
     Дочерний класс, отвечающий за обработку входящих сообщений.
     """
 
-    def __init__(self, account):
-        super().__init__(account)
+    def __init__(self, account, folder_name=INBOX, progress=None, counters=None):
+        super().__init__(account, folder_name)
+        self.folder = None
         self.channel_layer = get_channel_layer()
         self.total_emails = 0
-        self.processed_emails = 0
-        self.read_emails = 0
+        # Прогресс и счётчики общие для папок, синхронизируемых параллельно (см. sync_folders)
+        self.shared_progress = progress is not None
+        self.counters = counters or SyncCounters()
+        self.fetch_chunk_size = settings.EMAIL_FETCH_CHUNK_SIZE
+        self.fetched_flags = {}
+        self.headers_only = settings.EMAIL_SYNC_MODE == 'headers'
+        self.buffer = EmailMessageBuffer(account, on_flush=self.on_batch_saved, on_checkpoint=self.save_checkpoint,
+                                         metrics=self.metrics)
+        self.progress = progress or ProgressReporter(self.channel_layer, progress_group(account.id))
+        self.archive = None
+        if settings.EMAIL_RAW_ARCHIVE:
+            # Импорт по требованию: zstandard нужен только архиву исходных писем
+            from .archive import RawArchiveWriter
+            self.archive = RawArchiveWriter(account)
+
+    def get_select_state(self):
+        """
+        UIDVALIDITY, HIGHESTMODSEQ и EXISTS из ответа на SELECT.
+        Отсутствующие в ответе значения — None.
+        """
+        state = {}
+        for name in ('UIDVALIDITY', 'HIGHESTMODSEQ', 'EXISTS'):
+            _, data = self.mail.response(name)
+            state[name.lower()] = int(data[-1]) if data and data[-1] else None
+        return state
 
-    def fetch_email_uids(self):
+    def has_capability(self, capability):
+        return capability in self.mail.capabilities
+
+    def prepare_folder(self, uidvalidity):
         """
-        Получение UID писем, которые нужно обработать.
+        Загрузка состояния синхронизации папки и сверка UIDVALIDITY.
+
+        Если UIDVALIDITY изменился (папка пересоздана на сервере), сохранённые UID
+        больше ничего не значат: они сбрасываются, и папка загружается заново.
+        Уже сохранённые письма при этом находятся по Message-ID и получают новые UID.
         """
-        # Получаем последний UID из базы данных
-        last_uid = (EmailMessage.objects
-                    .filter(account=self.account)
-                    .order_by('-uid')
-                    .values_list('uid', flat=True)
-                    .first())
+        self.folder, _ = MailFolder.objects.get_or_create(account=self.account, name=self.folder_name)
+        self.folder.account = self.account
+        if uidvalidity is None or uidvalidity == self.folder.uidvalidity:
+            return
+
+        if self.folder.uidvalidity is not None:
+            logger.warning(f'UIDVALIDITY папки {self.folder} изменился: '
+                           f'{self.folder.uidvalidity} -> {uidvalidity}, полная синхронизация.')
+            self.folder.messages.update(uid=None)
+            # Архив остаётся, но его индекс ссылается на старые UID
+            self.folder.raw_messages.all().delete()
+            self.folder.last_uid = 0
+            self.folder.highest_modseq = None
+        self.folder.uidvalidity = uidvalidity
+        self.folder.save(update_fields=['uidvalidity', 'last_uid', 'highest_modseq'])
+
+    def save_checkpoint(self, batch):
+        """
+        Сдвиг last_uid папки на последний UID пачки. Вызывается буфером в транзакции
+        записи пачки, поэтому отметка не опережает записанные письма. Условие
+        last_uid__lt не даёт параллельной синхронизации откатить отметку назад.
+        """
+        last_uid = max(obj.uid for obj in batch)
+        MailFolder.objects.filter(id=self.folder.id, last_uid__lt=last_uid).update(last_uid=last_uid)
+        self.folder.last_uid = max(self.folder.last_uid, last_uid)
+        if self.archive is not None:
+            self.archive.flush()
 
+    def archive_message(self, uid, raw_email):
+        """
+        Запись исходного письма в архив аккаунта, если он включён (EMAIL_RAW_ARCHIVE).
+        """
+        if self.archive is not None:
+            self.archive.append(self.folder, uid, raw_email)
+
+    def close_archive(self):
+        """
+        Индекс архива для писем, не попавших в записанные пачки (например,
+        не разобранных), и закрытие сегмента до следующей синхронизации.
+        """
+        if self.archive is not None:
+            self.archive.flush()
+            self.archive.close()
+
+    @staticmethod
+    def get_search_criteria(last_uid):
+        """
+        Критерий поиска писем, новее последнего сохранённого UID.
+        """
         if last_uid:
-            search_criteria = f'(UID {int(last_uid) + 1}:*)'
-        else:
-            search_criteria = 'ALL'
+            return f'(UID {int(last_uid) + 1}:*)'
+        return 'ALL'
 
-        # Ищем сообщения по UID
-        result, data = self.mail.uid('search', None, search_criteria)
-        email_uids = data[0].split()
+    def fetch_email_uids(self):
+        """
+        Получение UID писем, которые нужно обработать.
+        """
+        # Последний загруженный UID хранится в состоянии папки
+        search_criteria = self.get_search_criteria(self.folder.last_uid)
+
+        # Ищем сообщения по UID. На запрос N:* сервер всегда возвращает последнее
+        # письмо, даже если его UID меньше N, поэтому результат фильтруется
+        with self.metrics.stage('search'):
+            result, data = self.mail.uid('search', None, search_criteria)
+        email_uids = [uid for uid in map(int, data[0].split()) if uid > self.folder.last_uid]
         self.total_emails = len(email_uids)
+        self.counters.add_total(self.total_emails)
         return email_uids
 
-    def process_email(self, uid):
+    def save_modseq(self, modseq):
         """
-        Обработка отдельного письма по UID.
+        Запоминание HIGHESTMODSEQ папки для следующей синхронизации изменений.
         """
-        result, message_data = self.mail.uid('fetch', uid, '(RFC822)')
-        raw_email = message_data[0][1]
-        email_message = email.message_from_bytes(raw_email)
+        if modseq != self.folder.highest_modseq:
+            self.folder.highest_modseq = modseq
+            self.folder.save(update_fields=['highest_modseq'])
 
-        # Декодируем тему письма
-        subject_header = email_message['Subject']
-        subject = decode_subject(subject_header)
+    def sync_changes(self, state, new_count):
+        """
+        Синхронизация флагов и удалений писем с UID не больше last_uid.
 
-        # Парсим дату отправки
-        send_date = email_message['Date']
-        try:
-            send_date = parsedate_to_datetime(send_date)
-        except Exception as e:
-            logger.error(f'Ошибка при парсинге даты: {e}')
-            send_date = datetime.now()
+        С CONDSTORE загружаются только письма, изменившиеся после сохранённого
+        HIGHESTMODSEQ, с QRESYNC сервер заодно сообщает UID удалённых писем
+        (VANISHED). Без расширений флаги сравниваются чанками по всем письмам.
+        """
+        last_uid = self.folder.last_uid
+        if not last_uid:
+            return
+
+        modseq = state['highestmodseq']
+        if modseq is None or self.folder.highest_modseq is None:
+            changed, vanished = self.diff_all_flags(last_uid)
+            updated, deleted = apply_changes(self.folder, changed, vanished)
+        else:
+            changed, vanished_ranges = {}, []
+            if modseq != self.folder.highest_modseq:
+                changed, vanished_ranges = self.fetch_changed_flags(last_uid)
+            vanished = []
+            if not self.has_capability('QRESYNC'):
+                vanished = self.find_expunged(last_uid, state['exists'], new_count)
+            updated, deleted = apply_changes(self.folder, changed, vanished, vanished_ranges)
+
+        if updated or deleted:
+            logger.info(f'Папка {self.folder}: обновлены флаги {updated} писем, удалено {deleted}')
+
+    def fetch_changed_flags(self, last_uid):
+        """
+        Флаги писем, изменившихся после сохранённого HIGHESTMODSEQ, и диапазоны UID
+        удалённых писем (только с QRESYNC).
+        """
+        modifier = changed_since_modifier(self.folder.highest_modseq, self.has_capability('QRESYNC'))
+        result, data = self.mail.uid('fetch', f'1:{last_uid}', '(UID FLAGS)', modifier)
+        if result != 'OK':
+            raise imaplib.IMAP4.error(f'Ошибка при загрузке изменений: {data}')
+        changed = {int(attributes['UID']): format_flags(attributes.get('FLAGS'))
+                   for _, attributes in iter_fetch_response(data) if attributes.get('UID')}
+        _, vanished = self.mail.response('VANISHED')
+        return changed, parse_vanished(vanished)
+
+    def find_expunged(self, last_uid, exists, new_count):
+        """
+        UID удалённых с сервера писем без QRESYNC. Если число писем на сервере
+        совпадает с сохранённым, полный список UID не запрашивается.
+        """
+        saved = self.folder.messages.filter(uid__isnull=False, uid__lte=last_uid)
+        if exists is not None and exists - new_count == saved.count():
+            return []
+        result, data = self.mail.uid('search', None, f'UID 1:{last_uid}')
+        if result != 'OK':
+            raise imaplib.IMAP4.error(f'Ошибка при поиске писем: {data}')
+        server_uids = set(map(int, data[0].split()))
+        return [uid for uid in saved.values_list('uid', flat=True).iterator() if uid not in server_uids]
+
+    def diff_all_flags(self, last_uid):
+        """
+        Сравнение флагов всех сохранённых писем с сервером чанками по
+        EMAIL_FLAGS_CHUNK_SIZE UID, для серверов без CONDSTORE.
+        """
+        uids = list(self.folder.messages
+                    .filter(uid__isnull=False, uid__lte=last_uid)
+                    .order_by('uid')
+                    .values_list('uid', flat=True))
+        changed, vanished = {}, []
+        for chunk in chunked(uids, settings.EMAIL_FLAGS_CHUNK_SIZE):
+            result, data = self.mail.uid('fetch', build_uid_set(chunk), '(UID FLAGS)')
+            if result != 'OK':
+                raise imaplib.IMAP4.error(f'Ошибка при загрузке флагов: {data}')
+            remote = {int(attributes['UID']): format_flags(attributes.get('FLAGS'))
+                      for _, attributes in iter_fetch_response(data) if attributes.get('UID')}
+            chunk_changed, chunk_vanished = diff_flags(local_flags(self.folder, chunk), remote)
+            changed.update(chunk_changed)
+            vanished.extend(chunk_vanished)
+        return changed, vanished
+
+    def fetch_messages(self, email_uids):
+        """
+        Пакетная загрузка писем: один UID FETCH на чанк из EMAIL_FETCH_CHUNK_SIZE писем
+        вместо отдельного запроса на каждое письмо. Письма выдаются по одному
+        по мере разбора ответа сервера.
+        """
+        for chunk in chunked(sorted(email_uids), self.fetch_chunk_size):
+            with self.metrics.stage('fetch'):
+                result, data = self.mail.uid('fetch', build_uid_set(chunk), '(UID FLAGS RFC822)')
+            if result != 'OK':
+                # Пропущенный чанк нельзя оставить позади: отметка last_uid следующих пачек ушла бы дальше него
+                raise imaplib.IMAP4.error(f'Ошибка при загрузке писем UID {chunk[0]}-{chunk[-1]}: {data}')
+            self.metrics.count_fetched(data)
+
+            for _, attributes in iter_fetch_response(data):
+                uid = attributes.get('UID')
+                raw_email = attributes.get('RFC822')
+                if uid is None or raw_email is None:
+                    continue
+                self.fetched_flags[int(uid)] = format_flags(attributes.get('FLAGS'))
+                self.archive_message(int(uid), raw_email)
+                self.update_progress_reading()
+                yield int(uid), raw_email
+
+    def fetch_headers(self, email_uids):
+        """
+        Загрузка только заголовков, BODYSTRUCTURE и начала текстовой части писем
+        (режим EMAIL_SYNC_MODE = 'headers'). Выдаёт пары (uid, поля) без полного
+        текста: он загружается позже (см. EmailBodyFetcher).
+        """
+        for chunk in chunked(sorted(email_uids), self.fetch_chunk_size):
+            with self.metrics.stage('fetch'):
+                result, data = self.mail.uid('fetch', build_uid_set(chunk), HEADER_FETCH_ITEMS)
+            if result != 'OK':
+                raise imaplib.IMAP4.error(f'Ошибка при загрузке заголовков UID {chunk[0]}-{chunk[-1]}: {data}')
+            self.metrics.count_fetched(data)
+
+            headers = {int(attributes['UID']): attributes
+                       for _, attributes in iter_fetch_response(data) if attributes.get('UID')}
+            self.fetched_flags.update((uid, format_flags(attributes.get('FLAGS'))) for uid, attributes in headers.items())
+
+            # Начала текстовых частей: один запрос на каждую секцию (1, 1.1, ...)
+            requests, parts = text_part_requests(headers)
+            texts = {}
+            for section, uids in requests.items():
+                with self.metrics.stage('fetch'):
+                    result, data = self.mail.uid('fetch', build_uid_set(uids), text_part_fetch_items(section))
+                if result != 'OK':
+                    logger.error(f'Ошибка при загрузке текста писем секции {section}: {data}')
+                    continue
+                self.metrics.count_fetched(data)
+                for _, attributes in iter_fetch_response(data):
+                    if attributes.get('UID'):
+                        texts[int(attributes['UID'])] = get_attribute(attributes, f'BODY[{section}]')
+
+            for uid in sorted(headers):
+                self.update_progress_reading()
+                yield uid, parse_header_fetch(uid, headers[uid], parts.get(uid), texts.get(uid), self.provider)
+
+    def build_email_message(self, uid, fields):
+        """
+        Несохранённый объект EmailMessage из разобранных полей письма.
+        """
+        return build_email_message(fields, account=self.account, folder=self.folder, uid=uid,
+                                   flags=self.fetched_flags.pop(uid, ''))
 
-        # Получаем Message-ID
-        message_id = email_message.get('Message-ID')
-        if not message_id:
-            message_id = f"{uid.decode()}@{self.provider}"
+    def on_batch_saved(self, batch, saved):
+        """
+        Обработка записанной пачки: одно уведомление о новых письмах
+        и одно обновление прогресса на всю пачку.
+        """
+        if saved:
+            self.send_new_messages(saved)
+        self.update_progress_receiving(len(batch))
 
-        # Обрабатываем тело письма
-        body = get_email_body_content(email_message)
+    @staticmethod
+    def new_messages_event(email_message_objs):
+        """
+        Событие WebSocket со списком новых сообщений.
+        """
+        return {
+            'type': 'new_message',
+            'message': [message_row(email_message_obj) for email_message_obj in email_message_objs],
+        }
 
-        # Создаем объект EmailMessage
-        try:
-            email_message_obj = EmailMessage.objects.create(
-                account=self.account,
-                subject=subject,
-                send_date=send_date,
-                receive_date=send_date,
-                body=body,
-                message_id=message_id,
-                uid=int(uid),
-                is_new=True,  # Помечаем как новое сообщение
-            )
-
-            # Отправляем новое сообщение через WebSocket
-            self.send_new_message(email_message_obj)
-
-        except IntegrityError:
-            logger.error(f"Сообщение с UID {uid} уже существует. Пропуск.")
-
-    def send_new_message(self, email_message_obj):
-        """
-        Отправка информации о новом сообщении через WebSocket.
-        """
-        async_to_sync(self.channel_layer.group_send)(
-            'progress',
-            {
-                'type': 'new_message',
-                'message': {
-                    'id': email_message_obj.id,
-                    'subject': email_message_obj.subject,
-                    'send_date': email_message_obj.send_date.strftime('%d.%m.%Y %H:%M'),
-                    'receive_date': email_message_obj.receive_date.strftime('%d.%m.%Y %H:%M'),
-                    'body': email_message_obj.body[:50],
-                },
-            }
-        )
+    def send_new_messages(self, email_message_objs):
+        """
+        Отправка информации о новых сообщениях через WebSocket одним событием.
+        """
+        with self.metrics.stage('notify'):
+            async_to_sync(self.channel_layer.group_send)(self.progress.group_name,
+                                                         self.new_messages_event(email_message_objs))
 
-    def update_progress_reading(self):
+    def count_read(self, count=1):
         """
-        Обновление прогресса чтения сообщений.
+        Учёт прочитанных с сервера сообщений. Возвращает текст статуса без процента.
         """
-        self.read_emails += 1
-        message = f'Чтение сообщений {self.read_emails}'
+        return self.counters.count_read(count)
 
+    def count_received(self, count=1):
+        """
+        Учёт сохранённых сообщений. Возвращает текст статуса и процент выполнения.
+        """
+        return self.counters.count_received(count)
+
+    def found_status(self):
+        return f'Найдено новых сообщений: {self.counters.total}', self.counters.percent()
+
+    def update_progress_reading(self):
+        """
+        Обновление прогресса чтения сообщений с сервера.
+        """
         # Отправляем только текстовое сообщение без изменения прогресса
-        async_to_sync(self.channel_layer.group_send)(
-            'progress',
-            {
-                'type': 'progress_update',
-                'message': {'status': message},
-            }
-        )
-
-    def update_progress_receiving(self):
-        """
-        Обновление прогресса получения сообщений.
-        """
-        self.processed_emails += 1
-        remaining = self.total_emails - self.processed_emails
-        message = f'Получение сообщений {remaining}'
-        progress = int(
-            (self.processed_emails / self.total_emails) * 100) if self.total_emails > 0 else 100  # 0-100% для получения
-
-        async_to_sync(self.channel_layer.group_send)(
-            'progress',
-            {
-                'type': 'progress_update',
-                'message': {'progress': progress, 'status': message},
-            }
-        )
+        self.progress.update(*self.count_read())
+
+    def update_progress_receiving(self, count=1):
+        """
+        Обновление прогресса получения (сохранения) сообщений.
+        """
+        self.progress.update(*self.count_received(count))
+
+    def sync(self):
+        """
+        Получение и обработка новых писем через уже открытое подключение.
+        """
+        state = self.get_select_state()
+        self.prepare_folder(state['uidvalidity'])
+
+        # Этап поиска новых сообщений
+        email_uids = self.fetch_email_uids()
+
+        # Флаги и удаления уже сохранённых писем. Без свежего ответа SELECT
+        # (повторная синхронизация в сессии IDLE) их проверит плановая синхронизация.
+        # HIGHESTMODSEQ запоминается только вместе с флагами: иначе после включения
+        # EMAIL_SYNC_FLAGS изменения до сохранённого значения не были бы загружены
+        if state['uidvalidity'] is not None and settings.EMAIL_SYNC_FLAGS:
+            self.sync_changes(state, len(email_uids))
+            self.save_modseq(state['highestmodseq'])
+
+        if self.total_emails > 0:
+            self.progress.update(*self.found_status(), force=True)
+
+            # Чтение, разбор и сохранение сообщений, прогресс отражает реальную работу
+            if self.headers_only:
+                messages = self.fetch_headers(email_uids)
+            else:
+                messages = parse_messages(self.fetch_messages(email_uids), self.provider, self.metrics)
+            for uid, fields in messages:
+                # Добавляем письмо в буфер, запись в базу идёт пачками
+                self.buffer.add(self.build_email_message(uid, fields))
+
+            # Записываем остаток буфера
+            self.buffer.flush()
+            self.close_archive()
+
+        # Финальное обновление прогресса. При синхронизации нескольких папок
+        # его отправляет sync_folders после завершения всех папок
+        if not self.shared_progress:
+            self.progress.update('Все сообщения получены', progress=100, force=True)
 
     def fetch_and_process_emails(self):
         """
@@ -180,48 +484,141 @@ class EmailFetcher(BaseEmailFetcher):
         """
         try:
             self.connect()
-
-            # Этап чтения сообщений
-            email_uids = self.fetch_email_uids()
-
-            # Если нет новых сообщений
-            if self.total_emails == 0:
-                async_to_sync(self.channel_layer.group_send)(
-                    'progress',
-                    {
-                        'type': 'progress_update',
-                        'message': {'progress': 100, 'status': 'Все сообщения получены'},
-                    }
-                )
-            else:
-                # Этап чтения сообщений
-                for uid in email_uids:
-                    self.update_progress_reading()
-                    time.sleep(0.05)  # Симуляция времени чтения
-
-                # Этап получения сообщений
-                for uid in email_uids:
-                    try:
-                        self.process_email(uid)
-                        self.update_progress_receiving()
-                        time.sleep(0.1)  # Симуляция времени получения
-                    except Exception as e:
-                        logger.error(f"Ошибка при обработке письма UID {uid}: {e}")
-
-                # Финальное обновление прогресса
-                async_to_sync(self.channel_layer.group_send)(
-                    'progress',
-                    {
-                        'type': 'progress_update',
-                        'message': {'progress': 100, 'status': 'Все сообщения получены'},
-                    }
-                )
-
+            self.sync()
             self.disconnect()
-            logger.info('Завершилось успешно')
+            logger.info(f'Папка {self.folder_name}: завершилось успешно')
         except imaplib.IMAP4.abort as e:
-            logger.error(f"Соединение с сервером было прервано: {e}")
+            logger.error(f"Папка {self.folder_name}: соединение с сервером было прервано: {e}")
+            self.metrics.count_error(e)
             raise e
         except Exception as e:
-            logger.error(f"Ошибка при получении писем: {e}")
+            logger.error(f"Папка {self.folder_name}: ошибка при получении писем: {e}")
+            self.metrics.count_error(e)
             raise e
+        finally:
+            # После успешной синхронизации сессия уже возвращена в пул
+            self.discard()
+
+    @classmethod
+    def sync_folders(cls, account, max_connections=1):
+        """
+        Синхронизация всех папок аккаунта (EMAIL_SYNC_FOLDERS), каждая через свою
+        IMAP-сессию и со своей отметкой last_uid, не более max_connections папок сразу.
+        INBOX запускается первой, поэтому большой архив не задерживает новые входящие.
+        Ошибка одной папки не прерывает остальные: после завершения всех папок
+        выбрасывается первая ошибка.
+        """
+        discovery = cls(account)
+        discovery.mail = connection_pool.acquire(account, discovery.open_connection)
+        try:
+            names = discovery.list_folders()
+        except BaseException:
+            discovery.discard()
+            raise
+        # Сессия возвращается в пул и достанется первой папке
+        discovery.disconnect()
+        if not names:
+            logger.warning(f'У аккаунта {account} нет папок, подходящих под EMAIL_SYNC_FOLDERS.')
+            return
+
+        progress = ProgressReporter(get_channel_layer(), progress_group(account.id))
+        counters = SyncCounters()
+        fetchers = [cls(account, name, progress, counters) for name in names]
+        workers = min(max_connections, len(fetchers))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'sync-{account.id}') as executor:
+                errors = list(executor.map(cls.run_folder_thread, fetchers))
+        else:
+            errors = [cls.run_folder(fetcher) for fetcher in fetchers]
+
+        progress.update('Все сообщения получены', progress=100, force=True)
+        for error in errors:
+            if error is not None:
+                raise error
+
+    @staticmethod
+    def run_folder(fetcher):
+        """
+        Синхронизация одной папки. Возвращает исключение вместо выброса.
+        """
+        try:
+            fetcher.fetch_and_process_emails()
+        except Exception as e:
+            return e
+        return None
+
+    @classmethod
+    def run_folder_thread(cls, fetcher):
+        try:
+            return cls.run_folder(fetcher)
+        finally:
+            # Подключения к базе у каждого потока свои
+            connections.close_all()
+
+
+class EmailBodyFetcher(EmailFetcher):
+    """
+    Загрузка полных текстов писем, сохранённых в режиме заголовков:
+    фоновой задачей для всех таких писем или по запросу для одного письма.
+    """
+
+    def pending_uids(self):
+        """
+        UID писем папки без загруженного текста, новые первыми.
+        """
+        return list(self.folder.messages
+                    .filter(body_loaded=False, uid__isnull=False)
+                    .order_by('-uid')
+                    .values_list('uid', flat=True))
+
+    def load_bodies(self, email_uids):
+        """
+        Загрузка писем целиком и запись текста в уже сохранённые строки.
+        Возвращает число обновлённых писем.
+        """
+        loaded = 0
+        for chunk in chunked(email_uids, self.fetch_chunk_size):
+            messages = {obj.uid: obj for obj in self.folder.messages
+                        .filter(uid__in=chunk).only('id', 'uid', 'content_id')}
+            loaded += save_bodies(messages, parse_messages(self.fetch_messages(chunk), self.provider, self.metrics))
+            self.close_archive()
+        return loaded
+
+    def load_message_body(self, email_message_obj):
+        """
+        Загрузка текста одного письма при его открытии.
+        """
+        self.folder = email_message_obj.folder
+        self.folder_name = self.folder.name
+        try:
+            self.connect()
+            self.load_bodies([email_message_obj.uid])
+            self.disconnect()
+        finally:
+            # Загрузка идёт в процессе веб-сервера: после ошибки сессия закрывается
+            self.discard()
+        # Отличающийся текст копии мог получить собственный MessageContent
+        email_message_obj.refresh_from_db(fields=['preview', 'body_loaded', 'content'])
+        email_message_obj.content.refresh_from_db(fields=['body', 'body_loaded'])
+
+    def update_progress_reading(self):
+        # Фоновая загрузка текстов не отображается в прогрессе синхронизации
+        pass
+
+    def update_progress_receiving(self, count=1):
+        pass
+
+    def sync(self):
+        """
+        Загрузка текстов всех писем аккаунта, сохранённых без них, по папкам.
+        """
+        folders = MailFolder.objects.filter(account=self.account, messages__body_loaded=False).distinct()
+        for folder in folders:
+            self.folder = folder
+            email_uids = self.pending_uids()
+            if not email_uids:
+                continue
+            self.folder_name = self.folder.name
+            self.select_folder()
+            logger.info(f'Папка {self.folder_name}: загружено текстов писем '
+                        f'{self.load_bodies(email_uids)} из {len(email_uids)}')
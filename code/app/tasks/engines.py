@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .email_processing import EmailFetcher
+
+
+def get_fetcher_class():
+    """
+    Класс движка синхронизации по настройке EMAIL_FETCHER_ENGINE: 'sync' или 'async'.
+    """
+    engine = settings.EMAIL_FETCHER_ENGINE
+    if engine == 'sync':
+        return EmailFetcher
+    if engine == 'async':
+        # Импорт по требованию: aioimaplib нужен только асинхронному движку
+        from .async_processing import AsyncEmailFetcher
+        return AsyncEmailFetcher
+    raise ImproperlyConfigured(f'Неизвестный движок синхронизации: {engine}')
@@ -0,0 +1,53 @@
+from collections import defaultdict
+from itertools import chain, zip_longest
+
+from celery import shared_task
+from celery.utils import uuid
+from django.conf import settings
+from loguru import logger
+
+from .fetch_emails import fetch_emails, fetch_emails_batch
+from .imap_parser import chunked
+from .locks import busy_accounts, mark_sync_queued
+from ..models import EmailAccount
+
+
+@shared_task(name='app.tasks.fetch_all_emails')
+def fetch_all_emails():
+    """
+    Планировщик: ставит синхронизацию каждого аккаунта отдельной задачей,
+    чтобы аккаунты обрабатывались параллельно всеми воркерами Celery.
+    Аккаунты, синхронизация которых уже в очереди или выполняется, пропускаются.
+    С асинхронным движком аккаунты ставятся группами: одна задача синхронизирует
+    до EMAIL_ASYNC_ACCOUNTS_PER_TASK аккаунтов одновременно.
+    """
+    accounts_by_provider = defaultdict(list)
+    for account_id, provider in EmailAccount.objects.order_by('id').values_list('id', 'provider'):
+        accounts_by_provider[provider].append(account_id)
+
+    # Чередуем провайдеров, чтобы первые в очереди задачи не упирались
+    # в лимит подключений одного провайдера
+    account_ids = [account_id
+                   for account_id in chain.from_iterable(zip_longest(*accounts_by_provider.values()))
+                   if account_id is not None]
+    busy = busy_accounts(account_ids)
+    free = [account_id for account_id in account_ids if account_id not in busy]
+
+    # Отметка очереди хранит id задачи, см. fetch_emails.queue_sync
+    queued = []
+    if settings.EMAIL_FETCHER_ENGINE == 'async':
+        for batch in chunked(free, settings.EMAIL_ASYNC_ACCOUNTS_PER_TASK):
+            task_id = uuid()
+            batch = [account_id for account_id in batch if mark_sync_queued(account_id, task_id)]
+            if batch:
+                fetch_emails_batch.apply_async((batch,), task_id=task_id)
+                queued.extend(batch)
+    else:
+        for account_id in free:
+            task_id = uuid()
+            if mark_sync_queued(account_id, task_id):
+                fetch_emails.apply_async((account_id,), task_id=task_id)
+                queued.append(account_id)
+
+    logger.info(f"Поставлено синхронизаций: {len(queued)}, пропущено: {len(account_ids) - len(queued)}")
+    return len(queued)
@@ -1,36 +1,161 @@
 import imaplib
-import time
 
+from asgiref.sync import async_to_sync
 from celery import shared_task
+from celery.utils import uuid
+from django.conf import settings
 from loguru import logger
 
-from .email_processing import EmailFetcher
+from .email_processing import EmailBodyFetcher
+from .engines import get_fetcher_class
+from .imap_pool import connection_pool
+from .locks import (
+    SyncLease,
+    acquire_provider_slot,
+    acquire_provider_slots,
+    active_sync,
+    clear_sync_queued,
+    mark_sync_queued,
+    release_provider_slot,
+)
+from .metrics import sampled_profile
 from .utils import handle_exception
 from ..models import EmailAccount
 
 
-@shared_task
-def fetch_emails(account_id):
+# Сетевые ошибки, после которых синхронизацию стоит повторить. Асинхронный движок
+# приводит свои ошибки соединения к imaplib.IMAP4.abort
+RETRY_EXCEPTIONS = (imaplib.IMAP4.abort, ConnectionError, TimeoutError)
+
+
+@shared_task(bind=True, autoretry_for=RETRY_EXCEPTIONS, max_retries=settings.EMAIL_SYNC_MAX_RETRIES,
+             retry_backoff=settings.EMAIL_SYNC_RETRY_BACKOFF, retry_backoff_max=settings.EMAIL_SYNC_RETRY_BACKOFF_MAX,
+             retry_jitter=True)
+def fetch_emails(self, account_id):
+    """
+    Синхронизация всех папок аккаунта. При обрыве соединения задача повторяется
+    Celery с экспоненциальной задержкой, не занимая воркер ожиданием. Каждая папка
+    продолжает с отметки last_uid последней записанной пачки.
+    """
+    task_id = self.request.id
     try:
         account = EmailAccount.objects.get(id=account_id)
     except EmailAccount.DoesNotExist:
         logger.error(f"Аккаунт с ID {account_id} не найден.")
+        clear_sync_queued(account_id, task_id)
+        return
+
+    lease = SyncLease(account_id, task_id)
+    if not lease.acquire():
+        logger.info(f"Синхронизация аккаунта {account.email} уже выполняется. Пропуск.")
+        clear_sync_queued(account_id, task_id)
         return
 
-    max_retries = 3
-    attempt = 0
-
-    while attempt < max_retries:
-        try:
-            fetcher = EmailFetcher(account)
-            fetcher.fetch_and_process_emails()
-            break  # Успешно завершили
-        except imaplib.IMAP4.abort as e:
-            attempt += 1
-            logger.error(f"Попытка переподключения {attempt} из {max_retries}...")
-            time.sleep(5)
-            if attempt == max_retries:
-                logger.error("Превышено максимальное количество попыток переподключения.")
-        except Exception as e:
+    # Ограничиваем число одновременных IMAP-сессий к провайдеру. Папки аккаунта
+    # синхронизируются параллельно в пределах захваченных слотов
+    slots = acquire_provider_slots(account.provider, task_id, settings.EMAIL_ACCOUNT_MAX_CONNECTIONS)
+    if not slots:
+        # Отметка очереди остаётся: повторные запросы получат id этой задачи
+        lease.release()
+        connection_pool.close_provider(account.provider)
+        logger.info(f"Нет свободных подключений к {account.provider}, повтор через "
+                    f"{settings.EMAIL_PROVIDER_RETRY_DELAY} с.")
+        # Ожидание слота не тратит попытки повтора после обрыва соединения:
+        # задача ставится заново с тем же id и тем же счётчиком попыток
+        self.apply_async((account_id,), task_id=task_id, countdown=settings.EMAIL_PROVIDER_RETRY_DELAY,
+                         retries=self.request.retries)
+        return
+
+    lease.slots = slots
+    clear_sync_queued(account_id, task_id)
+    try:
+        with sampled_profile(f'account-{account_id}'):
+            get_fetcher_class().sync_folders(account, len(slots))
+    except RETRY_EXCEPTIONS as e:
+        if self.request.retries >= self.max_retries:
+            logger.error("Превышено максимальное количество попыток переподключения.")
             handle_exception(e)
-            break
+            return
+        # До повтора аккаунт числится в очереди за этой же задачей
+        mark_sync_queued(account_id, task_id)
+        logger.error(f"Соединение прервано, попытка {self.request.retries + 1} из {self.max_retries}: {e}")
+        raise
+    except Exception as e:
+        handle_exception(e)
+        return
+    finally:
+        lease.release()
+        for slot in slots:
+            release_provider_slot(slot)
+
+    schedule_body_backfill(account_id)
+
+
+def queue_sync(account_id, countdown=None):
+    """
+    Постановка синхронизации аккаунта, если она ещё не стоит в очереди и не
+    выполняется: повторные нажатия «Обновить» и открытые вкладки не плодят задачи.
+    Возвращает (id задачи, поставлена ли новая задача). Если синхронизация уже
+    идёт, возвращается id выполняющей её задачи: её прогресс приходит в ту же
+    группу аккаунта.
+    """
+    task_id = active_sync(account_id)
+    if task_id:
+        return task_id, False
+    task_id = uuid()
+    if not mark_sync_queued(account_id, task_id):
+        # Задачу успел поставить параллельный запрос
+        return active_sync(account_id), False
+    fetch_emails.apply_async((account_id,), task_id=task_id, countdown=countdown)
+    return task_id, True
+
+
+def schedule_body_backfill(account_id):
+    """
+    Постановка фоновой загрузки текстов после синхронизации в режиме заголовков.
+    """
+    if settings.EMAIL_SYNC_MODE == 'headers' and settings.EMAIL_BODY_BACKFILL:
+        backfill_email_bodies.delay(account_id)
+
+
+@shared_task(bind=True, max_retries=None)
+def backfill_email_bodies(self, account_id):
+    """
+    Загрузка полных текстов писем, сохранённых в режиме заголовков.
+    Задача занимает ту же блокировку аккаунта и слот провайдера, что и синхронизация.
+    """
+    try:
+        account = EmailAccount.objects.get(id=account_id)
+    except EmailAccount.DoesNotExist:
+        logger.error(f"Аккаунт с ID {account_id} не найден.")
+        return
+
+    lease = SyncLease(account_id, self.request.id)
+    if not lease.acquire():
+        # Идущая синхронизация сама поставит загрузку текстов после завершения
+        logger.info(f"Синхронизация аккаунта {account.email} уже выполняется. Пропуск.")
+        return
+
+    slot = acquire_provider_slot(account.provider, self.request.id)
+    if slot is None:
+        lease.release()
+        raise self.retry(countdown=settings.EMAIL_PROVIDER_RETRY_DELAY)
+
+    lease.slots = [slot]
+    try:
+        EmailBodyFetcher(account).fetch_and_process_emails()
+    except Exception as e:
+        handle_exception(e)
+    finally:
+        lease.release()
+        release_provider_slot(slot)
+
+
+@shared_task(bind=True)
+def fetch_emails_batch(self, account_ids):
+    """
+    Синхронизация группы аккаунтов асинхронным движком в одном процессе.
+    """
+    from .async_processing import sync_accounts
+    with sampled_profile(f'batch-{self.request.id}'):
+        async_to_sync(sync_accounts)(account_ids, self.request.id)
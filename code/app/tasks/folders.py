@@ -0,0 +1,86 @@
+import re
+from fnmatch import fnmatchcase
+
+from django.conf import settings
+
+INBOX = 'INBOX'
+
+_LIST_RE = re.compile(rb'^\((?P<flags>[^)]*)\) (?:"(?:[^"\\]|\\.)*"|NIL) (?P<name>.*)$', re.IGNORECASE)
+_LITERAL_RE = re.compile(rb'\{\d+\}$')
+
+# Папки, которые нельзя выбрать командой SELECT (RFC 3501, RFC 5258)
+NOSELECT_FLAGS = {'\\noselect', '\\nonexistent'}
+
+
+def iter_list_lines(data):
+    """
+    Строки ответа LIST в виде (строка, литерал или None). Имя папки с пробелами
+    или не-ASCII символами сервер может прислать литералом {N}: imaplib отдаёт его
+    кортежем, aioimaplib — отдельной строкой после строки с {N}.
+    """
+    data = iter(data)
+    for line in data:
+        if isinstance(line, tuple):
+            yield bytes(line[0]), bytes(line[1])
+        elif line and _LITERAL_RE.search(line):
+            yield bytes(line), bytes(next(data, b''))
+        elif line:
+            yield bytes(line), None
+
+
+def unquote(name):
+    if name.startswith(b'"') and name.endswith(b'"'):
+        return re.sub(rb'\\(.)', rb'\1', name[1:-1])
+    return name
+
+
+def parse_list_response(data):
+    """
+    Разбор ответа LIST: список пар (имя папки, множество атрибутов в нижнем регистре).
+    Имя остаётся в модифицированной UTF-7 (RFC 3501, 5.1.3), как его ждёт SELECT.
+    """
+    folders = []
+    for line, literal in iter_list_lines(data):
+        match = _LIST_RE.match(line)
+        if not match:
+            continue
+        name = literal if literal is not None else unquote(match.group('name'))
+        name = name.decode('ascii', errors='replace')
+        if name.upper() == INBOX:
+            # Имя INBOX не зависит от регистра
+            name = INBOX
+        flags = set(match.group('flags').decode('ascii', errors='replace').lower().split())
+        folders.append((name, flags))
+    return folders
+
+
+def is_selected(name, flags):
+    """
+    Нужно ли синхронизировать папку: её можно выбрать, она подходит под один из
+    шаблонов EMAIL_SYNC_FOLDERS и не отмечена атрибутом из EMAIL_SKIP_FOLDER_FLAGS
+    (SPECIAL-USE, RFC 6154: \\All дублирует все письма, \\Junk и \\Trash — мусор).
+    """
+    if flags & NOSELECT_FLAGS:
+        return False
+    if flags & {flag.lower() for flag in settings.EMAIL_SKIP_FOLDER_FLAGS}:
+        return False
+    return any(fnmatchcase(name, pattern) for pattern in settings.EMAIL_SYNC_FOLDERS)
+
+
+def select_folders(folders):
+    """
+    Имена папок для синхронизации. INBOX идёт первым, чтобы большие архивы
+    не задерживали новые входящие, остальные — в порядке ответа сервера.
+    """
+    names = []
+    for name, flags in folders:
+        if name not in names and is_selected(name, flags):
+            names.append(name)
+    return sorted(names, key=lambda name: name != INBOX)
+
+
+def quote_folder(name):
+    """
+    Имя папки для SELECT в кавычках: imaplib и aioimaplib передают аргумент как есть.
+    """
+    return '"' + name.replace('\\', '\\\\').replace('"', '\\"') + '"'
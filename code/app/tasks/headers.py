@@ -0,0 +1,130 @@
+import binascii
+import email
+
+from django.conf import settings
+from loguru import logger
+
+from .charsets import decode_bytes
+from .parsing import parse_header_fields
+from .utils import html_to_text
+
+HEADER_FIELDS = 'BODY.PEEK[HEADER.FIELDS (SUBJECT DATE MESSAGE-ID)]'
+HEADER_FETCH_ITEMS = f'(UID FLAGS {HEADER_FIELDS} BODYSTRUCTURE)'
+
+
+def get_attribute(attributes, prefix):
+    """
+    Значение атрибута FETCH по началу ключа: сервер может вернуть
+    BODY[HEADER.FIELDS (...)] с другим регистром или порядком полей.
+    """
+    for key, value in attributes.items():
+        if key.startswith(prefix):
+            return value
+    return None
+
+
+def _text(value):
+    return value.lower() if isinstance(value, str) else ''
+
+
+def iter_text_parts(bodystructure, section=''):
+    """
+    Текстовые части письма по BODYSTRUCTURE (RFC 3501, 7.4.2):
+    кортежи (секция, подтип, кодировка передачи, charset). Вложения пропускаются.
+    """
+    if not isinstance(bodystructure, list) or not bodystructure:
+        return
+
+    if isinstance(bodystructure[0], list):
+        # multipart: вложенные части идут первыми, затем подтип
+        for number, part in enumerate(bodystructure, 1):
+            if not isinstance(part, list):
+                break
+            yield from iter_text_parts(part, f'{section}.{number}' if section else str(number))
+        return
+
+    if _text(bodystructure[0]) != 'text' or len(bodystructure) < 6:
+        return
+    disposition = bodystructure[9] if len(bodystructure) > 9 else None
+    if isinstance(disposition, list) and _text(disposition[0]) == 'attachment':
+        return
+
+    params = bodystructure[2] if isinstance(bodystructure[2], list) else []
+    charset = None
+    for i in range(0, len(params) - 1, 2):
+        if _text(params[i]) == 'charset':
+            charset = params[i + 1]
+    yield section or '1', _text(bodystructure[1]), _text(bodystructure[5]), charset
+
+
+def find_text_part(bodystructure):
+    """
+    Часть, из которой строится превью: первая text/plain, иначе первая text/html.
+    """
+    html_part = None
+    for part in iter_text_parts(bodystructure):
+        if part[1] == 'plain':
+            return part
+        if part[1] == 'html' and html_part is None:
+            html_part = part
+    return html_part
+
+
+def decode_partial(data, encoding, charset):
+    """
+    Декодирование начала части письма, полученного частичным FETCH <0.N>.
+    Оборванный хвост base64 или quoted-printable отбрасывается.
+    """
+    if encoding == 'base64':
+        data = b''.join(data.split())
+        data = binascii.a2b_base64(data[:len(data) // 4 * 4])
+    elif encoding == 'quoted-printable':
+        if b'\n' in data:
+            data = data[:data.rindex(b'\n') + 1]
+        data = binascii.a2b_qp(data)
+    return decode_bytes(data, charset)
+
+
+def text_part_requests(headers):
+    """
+    Группировка писем по секции текстовой части, чтобы загрузить начала текстов
+    одним UID FETCH на секцию. headers — {uid: атрибуты FETCH}.
+    Возвращает ({секция: [uid, ...]}, {uid: (подтип, кодировка, charset)}).
+    """
+    requests = {}
+    parts = {}
+    for uid, attributes in headers.items():
+        part = find_text_part(attributes.get('BODYSTRUCTURE'))
+        if part is None:
+            continue
+        section, subtype, encoding, charset = part
+        requests.setdefault(section, []).append(uid)
+        parts[uid] = (subtype, encoding, charset)
+    return requests, parts
+
+
+def text_part_fetch_items(section):
+    return f'(UID BODY.PEEK[{section}]<0.{settings.EMAIL_HEADERS_TEXT_BYTES}>)'
+
+
+def parse_header_fetch(uid, attributes, part, data, provider):
+    """
+    Поля EmailMessage из заголовков и начала текстовой части письма.
+    Полный текст не загружен: body пустой, body_loaded = False.
+    """
+    header = get_attribute(attributes, 'BODY[HEADER') or b''
+    fields = parse_header_fields(email.message_from_bytes(header), uid, provider)
+
+    preview = ''
+    if part is not None and data:
+        subtype, encoding, charset = part
+        try:
+            text = decode_partial(data, encoding, charset)
+            if subtype == 'html':
+                text = html_to_text(text)
+            preview = text[:settings.EMAIL_PREVIEW_LENGTH]
+        except Exception as e:
+            logger.error(f'Ошибка разбора начала письма UID {uid}: {e}')
+
+    fields.update(body='', preview=preview, body_loaded=False)
+    return fields
@@ -0,0 +1,198 @@
+import imaplib
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from loguru import logger
+
+from .email_processing import EmailFetcher
+from .locks import SyncLease, acquire_idle_slot, refresh_provider_slot, release_provider_slot
+from ..models import EmailAccount
+
+
+class IdleLineReader:
+    """
+    Чтение строк ответа сервера напрямую из сокета с таймаутом.
+    Файловый объект imaplib после таймаута становится непригоден, поэтому
+    во время IDLE читаем сокет сами.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b''
+
+    def readline(self, timeout):
+        """
+        Чтение одной строки без CRLF. Возвращает None, если за timeout строка не пришла.
+        """
+        deadline = time.monotonic() + timeout
+        while b'\r\n' not in self.buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.sock.settimeout(remaining)
+            try:
+                chunk = self.sock.recv(65536)
+            except socket.timeout:
+                return None
+            if not chunk:
+                raise imaplib.IMAP4.abort('Сервер закрыл соединение во время IDLE')
+            self.buffer += chunk
+        line, self.buffer = self.buffer.split(b'\r\n', 1)
+        return line
+
+
+class IdleWatcher(threading.Thread):
+    """
+    Долгоживущая IMAP-сессия аккаунта в режиме IDLE (RFC 2177).
+
+    Сервер сообщает о новых письмах сразу (* N EXISTS), после чего новые UID
+    обрабатываются обычным путём EmailFetcher.sync() через эту же сессию.
+    """
+
+    poll_interval = 1
+
+    def __init__(self, account_id, stop_event):
+        super().__init__(name=f'imap-idle-{account_id}', daemon=True)
+        self.account_id = account_id
+        self.stop_event = stop_event
+        self.mail = None
+        self.slot = None
+        self.pending = False
+        # Неудачных подключений подряд и ожидание свободного слота IDLE
+        self.failures = 0
+        self.waiting_slot = False
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.watch()
+            except EmailAccount.DoesNotExist:
+                logger.info(f'Аккаунт {self.account_id} удалён, IDLE остановлен.')
+                break
+            except (imaplib.IMAP4.error, OSError) as e:
+                logger.error(f'IDLE аккаунта {self.account_id} прерван: {e}')
+            finally:
+                self.close()
+                close_old_connections()
+            self.stop_event.wait(self.reconnect_delay())
+
+    def reconnect_delay(self):
+        """
+        Пауза перед переподключением: EMAIL_IDLE_RECONNECT_DELAY, удваивается
+        с каждой неудачной попыткой подряд до EMAIL_IDLE_RECONNECT_DELAY_MAX.
+        Слотов IDLE меньше, чем наблюдателей, и без роста паузы все ждущие
+        наблюдатели проверяли бы слоты каждые EMAIL_IDLE_RECONNECT_DELAY секунд.
+        """
+        delay = settings.EMAIL_IDLE_RECONNECT_DELAY * 2 ** min(self.failures, 16)
+        self.failures += 1
+        return min(delay, settings.EMAIL_IDLE_RECONNECT_DELAY_MAX)
+
+    def watch(self):
+        """
+        Подключение, догоняющая синхронизация и ожидание новых писем в цикле IDLE.
+        """
+        account = EmailAccount.objects.get(id=self.account_id)
+
+        # Сессия IDLE тоже занимает подключение к провайдеру, но из своего предела:
+        # иначе наблюдатели заняли бы все слоты синхронизации
+        self.slot = acquire_idle_slot(account.provider, f'idle:{self.account_id}')
+        if self.slot is None:
+            # В лог попадает только первая попытка подряд, повторы идут с растущей паузой
+            if not self.waiting_slot:
+                logger.info(f'Нет свободных IDLE-подключений к {account.provider} для аккаунта {account.email}, '
+                            f'повтор с растущей паузой.')
+                self.waiting_slot = True
+            return
+        if self.waiting_slot:
+            logger.info(f'IDLE-подключение к {account.provider} для аккаунта {account.email} получено.')
+            self.waiting_slot = False
+
+        # IDLE следит только за INBOX, остальные папки синхронизируются по расписанию
+        self.mail = EmailFetcher(account).open_connection()
+        self.mail.select('inbox')
+        if 'IDLE' not in self.mail.capabilities:
+            logger.error(f'Сервер {account.provider} не поддерживает IDLE, используется опрос по расписанию.')
+            self.stop_event.wait(settings.EMAIL_IDLE_TIMEOUT)
+            return
+
+        self.failures = 0
+        self.pending = True
+        while not self.stop_event.is_set():
+            if self.pending:
+                self.sync(account)
+
+            refresh_provider_slot(self.slot)
+            timeout = settings.EMAIL_IDLE_RECONNECT_DELAY if self.pending else settings.EMAIL_IDLE_TIMEOUT
+            if self.idle(timeout):
+                self.pending = True
+
+    def idle(self, timeout):
+        """
+        Команда IDLE до уведомления о новом письме, таймаута или остановки.
+        Возвращает True, если сервер сообщил о новых письмах.
+        """
+        tag = self.mail._new_tag()
+        self.mail.send(tag + b' IDLE\r\n')
+        reader = IdleLineReader(self.mail.sock)
+
+        line = reader.readline(settings.EMAIL_IDLE_RECONNECT_DELAY)
+        if line is None or not line.startswith(b'+'):
+            raise imaplib.IMAP4.error(f'Сервер отклонил IDLE: {line}')
+
+        has_new = False
+        deadline = time.monotonic() + timeout
+        while not has_new and not self.stop_event.is_set() and time.monotonic() < deadline:
+            line = reader.readline(self.poll_interval)
+            if line is None:
+                continue
+            if line.startswith(b'* BYE'):
+                raise imaplib.IMAP4.abort(line.decode(errors='replace'))
+            if line.startswith(b'* ') and line.endswith(b' EXISTS'):
+                has_new = True
+
+        self.mail.send(b'DONE\r\n')
+        while True:
+            line = reader.readline(settings.EMAIL_IDLE_RECONNECT_DELAY)
+            if line is None:
+                raise imaplib.IMAP4.abort('Нет ответа на завершение IDLE')
+            if line.startswith(tag):
+                break
+
+        self.mail.sock.settimeout(None)
+        return has_new
+
+    def sync(self, account):
+        """
+        Обработка новых писем через сессию IDLE. Если аккаунт уже синхронизируется
+        задачей Celery, попытка повторяется после короткого IDLE.
+        """
+        lease = SyncLease(account.id, f'idle:{account.id}')
+        if not lease.acquire():
+            logger.info(f'Синхронизация {account.email} уже выполняется, IDLE повторит попытку.')
+            return
+
+        try:
+            fetcher = EmailFetcher(account)
+            fetcher.mail = self.mail
+            fetcher.sync()
+            self.pending = False
+        finally:
+            lease.release()
+            close_old_connections()
+
+    def close(self):
+        """
+        Закрытие сессии и освобождение слота провайдера.
+        """
+        if self.mail:
+            try:
+                self.mail.logout()
+            except (imaplib.IMAP4.error, OSError):
+                pass
+            self.mail = None
+        if self.slot:
+            release_provider_slot(self.slot)
+            self.slot = None
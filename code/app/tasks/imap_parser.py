@@ -0,0 +1,122 @@
+import re
+
+_LITERAL_RE = re.compile(rb'\{(\d+)\}$')
+_TOKEN_RE = re.compile(rb'''
+    [ ]*(?:
+        (?P<open>\()
+      | (?P<close>\))
+      | "(?P<quoted>(?:[^"\\]|\\.)*)"
+      | (?P<atom>(?:[^\s()"\[\]]|\[[^\]]*\])+)
+    )
+''', re.VERBOSE)
+_QUOTED_ESCAPE_RE = re.compile(rb'\\(.)')
+
+_OPEN = object()
+_CLOSE = object()
+_LITERAL = object()
+
+
+def build_uid_set(uids):
+    """
+    Сжатие списка UID в IMAP sequence set: [1, 2, 3, 7, 9, 10] -> '1:3,7,9:10'.
+    """
+    ranges = []
+    start = prev = None
+    for uid in sorted(set(int(uid) for uid in uids)):
+        if start is None:
+            start = prev = uid
+        elif uid == prev + 1:
+            prev = uid
+        else:
+            ranges.append((start, prev))
+            start = prev = uid
+    if start is not None:
+        ranges.append((start, prev))
+    return ','.join(str(a) if a == b else f'{a}:{b}' for a, b in ranges)
+
+
+def chunked(items, size):
+    """
+    Разбиение последовательности на чанки фиксированного размера.
+    """
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _tokenize(text):
+    """
+    Разбор строки ответа сервера на токены: скобки, строки в кавычках и атомы.
+    Атомы вида BODY[HEADER.FIELDS (SUBJECT)]<0> возвращаются целиком.
+    """
+    literal = _LITERAL_RE.search(text)
+    if literal:
+        text = text[:literal.start()]
+
+    pos = 0
+    length = len(text)
+    while pos < length:
+        match = _TOKEN_RE.match(text, pos)
+        if not match:
+            if text[pos:].strip():
+                raise ValueError(f'Не удалось разобрать ответ IMAP: {text[pos:]!r}')
+            break
+        pos = match.end()
+        if match.group('open'):
+            yield _OPEN
+        elif match.group('close'):
+            yield _CLOSE
+        elif match.group('quoted') is not None:
+            yield _QUOTED_ESCAPE_RE.sub(rb'\1', match.group('quoted')).decode('utf-8', errors='replace')
+        else:
+            atom = match.group('atom').decode('utf-8', errors='replace')
+            yield None if atom.upper() == 'NIL' else atom
+
+    if literal:
+        yield _LITERAL
+
+
+def _pairs_to_dict(items):
+    """
+    Преобразование списка атрибутов FETCH [ключ, значение, ...] в словарь.
+    """
+    return {str(items[i]).upper(): items[i + 1] for i in range(0, len(items) - 1, 2)}
+
+
+def iter_fetch_response(data):
+    """
+    Потоковый разбор ответа FETCH, полученного через imaplib.
+
+    imaplib возвращает список, где литералы ({N}) вынесены в кортежи
+    (строка_до_литерала, литерал), а продолжение строки идёт отдельным элементом.
+    Генератор выдаёт пары (порядковый номер, словарь атрибутов) по мере разбора,
+    не дожидаясь обработки всего ответа. Литералы возвращаются как bytes,
+    вложенные списки (FLAGS, BODYSTRUCTURE) — как списки Python.
+    """
+    stack = []
+    seq = None
+    for item in data:
+        if item is None:
+            continue
+        if isinstance(item, tuple):
+            text, literal = item
+        else:
+            text, literal = item, None
+
+        for token in _tokenize(text):
+            if token is _LITERAL:
+                stack[-1].append(literal)
+            elif token is _OPEN:
+                stack.append([])
+            elif token is _CLOSE:
+                if not stack:
+                    continue
+                closed = stack.pop()
+                if stack:
+                    stack[-1].append(closed)
+                elif seq is not None:
+                    yield seq, _pairs_to_dict(closed)
+                    seq = None
+            elif stack:
+                stack[-1].append(token)
+            else:
+                seq = int(token) if token and token.isdigit() else None
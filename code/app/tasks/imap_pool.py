@@ -0,0 +1,136 @@
+import imaplib
+import threading
+import time
+
+from django.conf import settings
+from loguru import logger
+
+
+
+class IMAPConnectionPool:
+    """
+    Пул авторизованных IMAP-сессий в пределах процесса.
+
+    Сессия, освобождённая после синхронизации, остаётся открытой до
+    EMAIL_IMAP_POOL_MAX_IDLE секунд и переиспользуется следующей синхронизацией
+    того же аккаунта в этом процессе без повторных TLS-рукопожатия и LOGIN.
+    На аккаунт хранится не больше max_per_account сессий (по одной на папку,
+    синхронизируемую параллельно).
+
+    Свободная сессия не занимает слот провайдера: слоты ограничивают одновременные
+    синхронизации, а плановая синхронизация аккаунта приходит реже, чем истекает
+    EMAIL_IMAP_POOL_MAX_IDLE, и простаивающие сессии не давали бы синхронизировать
+    другие аккаунты. Когда синхронизации не хватает слотов, свободные сессии
+    провайдера в процессе закрываются (close_provider).
+    """
+
+    def __init__(self, max_idle=None, max_per_account=None):
+        self.max_idle = settings.EMAIL_IMAP_POOL_MAX_IDLE if max_idle is None else max_idle
+        self.max_per_account = max_per_account or settings.EMAIL_ACCOUNT_MAX_CONNECTIONS
+        self._lock = threading.Lock()
+        self._connections = {}
+        self._timer = None
+
+    @staticmethod
+    def get_key(account):
+        return account.id, account.provider, account.email
+
+    def acquire(self, account, connect):
+        """
+        Получение сессии из пула или новое подключение через connect().
+        """
+        while True:
+            with self._lock:
+                entries = self._connections.get(self.get_key(account))
+                if not entries:
+                    break
+                mail, released_at = entries.pop()
+
+            if time.monotonic() - released_at < self.max_idle:
+                try:
+                    # Проверяем, что сервер не закрыл сессию по таймауту
+                    mail.noop()
+                    return mail
+                except (imaplib.IMAP4.error, OSError):
+                    pass
+            self.discard(mail)
+
+        return connect()
+
+    def release(self, account, mail):
+        """
+        Возврат сессии в пул. Если у аккаунта уже max_per_account свободных сессий,
+        закрывается самая старая.
+        """
+        if self.max_idle <= 0:
+            self.discard(mail)
+            return
+
+        with self._lock:
+            entries = self._connections.setdefault(self.get_key(account), [])
+            entries.append((mail, time.monotonic()))
+            previous = entries.pop(0) if len(entries) > self.max_per_account else None
+            if self._timer is None:
+                self.schedule_close(self.max_idle)
+        if previous:
+            self.discard(previous[0])
+        self.close_expired()
+
+    def schedule_close(self, delay):
+        """
+        Закрытие простоявших сессий по таймеру: без него сессия оставалась бы
+        открытой до следующего release в этом процессе.
+        """
+        self._timer = threading.Timer(delay, self.close_expired_by_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def close_expired_by_timer(self):
+        with self._lock:
+            self._timer = None
+        self.close_expired()
+        with self._lock:
+            released = [released_at for entries in self._connections.values() for _, released_at in entries]
+            if released and self._timer is None:
+                # Следующий запуск — когда истечёт самая старая из оставшихся сессий
+                self.schedule_close(max(0, min(released) + self.max_idle - time.monotonic()))
+
+    def close_expired(self):
+        """
+        Закрытие сессий, простоявших в пуле дольше EMAIL_IMAP_POOL_MAX_IDLE.
+        """
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, entries in list(self._connections.items()):
+                expired.extend(entry for entry in entries if now - entry[1] >= self.max_idle)
+                entries[:] = [entry for entry in entries if now - entry[1] < self.max_idle]
+                if not entries:
+                    del self._connections[key]
+        for mail, _ in expired:
+            self.discard(mail)
+
+    def close_provider(self, provider):
+        """
+        Закрытие свободных сессий провайдера: синхронизации не хватило слотов,
+        и открытые без дела подключения к провайдеру больше не нужны.
+        """
+        closed = []
+        with self._lock:
+            for key in [key for key in self._connections if key[1] == provider]:
+                closed.extend(self._connections.pop(key))
+        for mail, _ in closed:
+            self.discard(mail)
+
+    @staticmethod
+    def discard(mail):
+        """
+        Закрытие сессии без выброса исключений.
+        """
+        try:
+            mail.logout()
+        except (imaplib.IMAP4.error, OSError) as e:
+            logger.debug(f'Ошибка при закрытии IMAP-сессии: {e}')
+
+
+connection_pool = IMAPConnectionPool()
@@ -0,0 +1,211 @@
+import hashlib
+import mmap
+import os
+import re
+import time
+
+from django.conf import settings
+from loguru import logger
+
+from .metrics import SyncMetrics
+from .parsing import parse_messages
+from .persistence import EmailMessageBuffer, build_email_message
+from ..models import MailFolder
+
+# Экранированная строка «From » в mboxrd: при чтении снимается один «>»
+_QUOTED_FROM_RE = re.compile(rb'^>(>*From )', re.MULTILINE)
+
+# Флаги Maildir (буквы после «:2,» в имени файла) и соответствующие флаги IMAP
+MAILDIR_FLAGS = {
+    'D': '\\Draft',
+    'F': '\\Flagged',
+    'R': '\\Answered',
+    'S': '\\Seen',
+    'T': '\\Deleted',
+}
+
+
+def iter_mbox(path):
+    """
+    Письма файла mbox по одному. Файл отображается в память (mmap) и в память
+    процесса целиком не читается: границы писем ищутся по строкам «From »,
+    копируется только текущее письмо. Выдаёт пары (сырое письмо, флаги IMAP).
+    """
+    with open(path, 'rb') as file:
+        if not os.fstat(file.fileno()).st_size:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:5] == b'From ':
+                position = 0
+            else:
+                position = data.find(b'\nFrom ') + 1
+                if not position:
+                    return
+            while True:
+                # Строка-разделитель «From отправитель дата» письму не принадлежит
+                start = data.find(b'\n', position) + 1
+                if not start:
+                    return
+                end = data.find(b'\nFrom ', start - 1) + 1
+                if not end:
+                    yield mbox_message(data[start:]), ''
+                    return
+                yield mbox_message(data[start:end]), ''
+                position = end
+
+
+def mbox_message(raw_email):
+    # Пустая строка перед следующим разделителем письму не принадлежит
+    if raw_email.endswith(b'\n\n'):
+        raw_email = raw_email[:-1]
+    elif raw_email.endswith(b'\r\n\r\n'):
+        raw_email = raw_email[:-2]
+    if b'>From ' in raw_email:
+        raw_email = _QUOTED_FROM_RE.sub(rb'\1', raw_email)
+    return raw_email
+
+
+def maildir_flags(filename):
+    """
+    Флаги IMAP из имени файла Maildir: '1700000000.M1P2.host:2,FS' -> '\\Flagged \\Seen'.
+    """
+    _, separator, info = filename.rpartition(':2,')
+    if not separator:
+        return ''
+    return ' '.join(MAILDIR_FLAGS[letter] for letter in info if letter in MAILDIR_FLAGS)
+
+
+def is_maildir(path):
+    return all(os.path.isdir(os.path.join(path, name)) for name in ('cur', 'new'))
+
+
+def iter_maildir(path):
+    """
+    Письма каталога Maildir (cur и new) по одному файлу.
+    """
+    for subdirectory in ('cur', 'new'):
+        directory = os.path.join(path, subdirectory)
+        for filename in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, filename), 'rb') as file:
+                yield file.read(), maildir_flags(filename)
+
+
+def iter_eml_files(path):
+    """
+    Файлы .eml каталога и его подкаталогов по одному.
+    """
+    for root, directories, filenames in os.walk(path):
+        directories.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith('.eml'):
+                with open(os.path.join(root, filename), 'rb') as file:
+                    yield file.read(), ''
+
+
+def import_sources(path, folder_name=None):
+    """
+    Папки источника импорта: пары (имя папки, генератор писем).
+    Файл .eml — одно письмо, другой файл — mbox, каталог с cur и new — Maildir
+    (подпапки Maildir++ вида .Archive.2020 становятся папками 'имя/Archive/2020'),
+    остальные каталоги — набор файлов .eml. По умолчанию папка называется
+    по имени файла или каталога.
+    """
+    path = os.path.abspath(path)
+    folder_name = folder_name or os.path.splitext(os.path.basename(path))[0]
+
+    if os.path.isfile(path):
+        if path.lower().endswith('.eml'):
+            with open(path, 'rb') as file:
+                return [(folder_name, iter([(file.read(), '')]))]
+        return [(folder_name, iter_mbox(path))]
+
+    if not is_maildir(path):
+        return [(folder_name, iter_eml_files(path))]
+
+    sources = [(folder_name, iter_maildir(path))]
+    for name in sorted(os.listdir(path)):
+        subfolder = os.path.join(path, name)
+        if name.startswith('.') and is_maildir(subfolder):
+            sources.append((f"{folder_name}/{name[1:].replace('.', '/')}", iter_maildir(subfolder)))
+    return sources
+
+
+class EmailImporter:
+    """
+    Импорт писем из файлов в папку аккаунта через тот же разбор (parse_messages,
+    с пулом процессов EMAIL_PARSE_WORKERS) и ту же пакетную запись
+    (EmailMessageBuffer), что и синхронизация по IMAP. Повторный импорт
+    не создаёт дубликатов: письма уже сохранённые в папке по message_id
+    пропускаются базой.
+    """
+
+    # Интервал записи скорости импорта в лог, сек
+    LOG_INTERVAL = 10
+
+    def __init__(self, account, batch_size=None):
+        self.account = account
+        self.metrics = SyncMetrics(account)
+        self.buffer = EmailMessageBuffer(account, batch_size=batch_size, on_flush=self.on_batch_saved,
+                                         metrics=self.metrics)
+        self.messages = 0
+        self.saved = 0
+        self.bytes_read = 0
+        self.started = None
+        self.logged = None
+
+    def read(self, messages, flags):
+        """
+        Пары (ключ, сырое письмо) для parse_messages. Ключ — SHA-1 письма: письмам
+        без Message-ID он даёт устойчивый message_id '<sha1>@<папка>', и повторный
+        импорт того же файла узнаёт их. Флаги запоминаются по ключу.
+        """
+        for raw_email, message_flags in messages:
+            key = hashlib.sha1(raw_email).hexdigest()
+            flags[key] = message_flags
+            self.messages += 1
+            self.bytes_read += len(raw_email)
+            yield key, raw_email
+
+    def import_folder(self, folder_name, messages):
+        """
+        Импорт писем одной папки, папка создаётся при первом импорте.
+        """
+        folder, _ = MailFolder.objects.get_or_create(account=self.account, name=folder_name)
+        flags = {}
+        for key, fields in parse_messages(self.read(messages, flags), folder_name, self.metrics):
+            self.buffer.add(build_email_message(fields, account=self.account, folder=folder,
+                                                flags=flags.pop(key, '')))
+        self.buffer.flush()
+
+    def run(self, sources):
+        """
+        Импорт всех папок источника. Возвращает итог: писем прочитано,
+        писем в папках после записи (новых и уже импортированных раньше), байт,
+        секунд, писем и мегабайт в секунду.
+        """
+        self.started = self.logged = time.perf_counter()
+        for folder_name, messages in sources:
+            logger.info(f'Импорт папки {folder_name} в аккаунт {self.account}')
+            self.import_folder(folder_name, messages)
+        return self.stats()
+
+    def on_batch_saved(self, batch, saved):
+        self.saved += len(saved)
+        now = time.perf_counter()
+        if now - self.logged >= self.LOG_INTERVAL:
+            self.logged = now
+            stats = self.stats()
+            logger.info(f"Импорт: прочитано {stats['messages']}, в папках {stats['saved']}, "
+                        f"{stats['messages_per_second']} писем/с, {stats['megabytes_per_second']} МБ/с")
+
+    def stats(self):
+        seconds = time.perf_counter() - self.started
+        return {
+            'messages': self.messages,
+            'saved': self.saved,
+            'bytes': self.bytes_read,
+            'seconds': round(seconds, 3),
+            'messages_per_second': round(self.messages / seconds, 1) if seconds else 0,
+            'megabytes_per_second': round(self.bytes_read / seconds / 1024 / 1024, 2) if seconds else 0,
+            'workers': settings.EMAIL_PARSE_WORKERS,
+        }
@@ -0,0 +1,175 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from loguru import logger
+
+SYNC_LOCK_KEY = 'sync-lock:{account_id}'
+SYNC_QUEUED_KEY = 'sync-queued:{account_id}'
+PROVIDER_SLOT_KEY = 'sync-slot:{provider}:{slot}'
+IDLE_SLOT_KEY = 'idle-slot:{provider}:{slot}'
+
+
+def provider_connection_limit(provider):
+    """
+    Максимальное число одновременных IMAP-сессий для провайдера.
+    """
+    return settings.EMAIL_PROVIDER_CONNECTION_LIMITS.get(provider, settings.EMAIL_PROVIDER_MAX_CONNECTIONS)
+
+
+def acquire_provider_slot(provider, owner):
+    """
+    Захват одного из слотов подключения к провайдеру.
+    Возвращает ключ слота или None, если все слоты заняты.
+    """
+    keys = acquire_provider_slots(provider, owner, 1)
+    return keys[0] if keys else None
+
+
+def acquire_provider_slots(provider, owner, count):
+    """
+    Захват до count свободных слотов подключения к провайдеру без ожидания.
+    Возвращает список ключей захваченных слотов, пустой, если все слоты заняты.
+    """
+    keys = []
+    for slot in range(provider_connection_limit(provider)):
+        if len(keys) >= count:
+            break
+        key = PROVIDER_SLOT_KEY.format(provider=provider, slot=slot)
+        if cache.add(key, owner, timeout=settings.EMAIL_SYNC_LOCK_TIMEOUT):
+            keys.append(key)
+    return keys
+
+
+def acquire_idle_slot(provider, owner):
+    """
+    Захват слота IDLE-сессии. Сессии IDLE живут часами, поэтому у них свой предел
+    EMAIL_IDLE_MAX_CONNECTIONS на провайдера, и слоты синхронизации они не занимают.
+    Возвращает ключ слота или None. Продлевается и освобождается как слот провайдера.
+    """
+    for slot in range(settings.EMAIL_IDLE_MAX_CONNECTIONS):
+        key = IDLE_SLOT_KEY.format(provider=provider, slot=slot)
+        if cache.add(key, owner, timeout=settings.EMAIL_SYNC_LOCK_TIMEOUT):
+            return key
+    return None
+
+
+def refresh_provider_slot(key):
+    """
+    Продление слота для долгоживущей сессии. Возвращает False, если слот уже истёк.
+    """
+    return cache.touch(key, timeout=settings.EMAIL_SYNC_LOCK_TIMEOUT)
+
+
+def release_provider_slot(key):
+    """
+    Освобождение слота подключения к провайдеру.
+    """
+    cache.delete(key)
+
+
+def acquire_sync_lock(account_id, owner):
+    """
+    Блокировка синхронизации аккаунта на время аренды EMAIL_SYNC_LOCK_LEASE.
+    В блокировке хранится её владелец (id задачи). Возвращает False,
+    если синхронизация уже идёт.
+    """
+    return cache.add(SYNC_LOCK_KEY.format(account_id=account_id), owner, timeout=settings.EMAIL_SYNC_LOCK_LEASE)
+
+
+def renew_sync_lock(account_id, owner):
+    """
+    Продление аренды блокировки. Возвращает False, если блокировка истекла
+    или принадлежит другой задаче.
+    """
+    key = SYNC_LOCK_KEY.format(account_id=account_id)
+    if cache.get(key) != owner:
+        return False
+    return cache.touch(key, timeout=settings.EMAIL_SYNC_LOCK_LEASE)
+
+
+def release_sync_lock(account_id, owner):
+    """
+    Снятие блокировки синхронизации аккаунта, если она ещё принадлежит owner:
+    блокировку, перехваченную после истечения аренды, чужая задача не снимает.
+    """
+    key = SYNC_LOCK_KEY.format(account_id=account_id)
+    if cache.get(key) == owner:
+        cache.delete(key)
+
+
+class SyncLease:
+    """
+    Блокировка синхронизации аккаунта с арендой. Пока она захвачена, фоновый поток
+    продлевает её каждые EMAIL_SYNC_LOCK_LEASE / 3 секунд вместе со слотами
+    провайдера из slots. Блокировка упавшего воркера освобождается за время
+    аренды, а не висит до истечения EMAIL_SYNC_LOCK_TIMEOUT.
+    """
+
+    def __init__(self, account_id, owner):
+        self.account_id = account_id
+        self.owner = owner
+        self.slots = []
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def acquire(self):
+        if not acquire_sync_lock(self.account_id, self.owner):
+            return False
+        self.thread = threading.Thread(target=self.heartbeat, name=f'sync-lease-{self.account_id}', daemon=True)
+        self.thread.start()
+        return True
+
+    def heartbeat(self):
+        while not self.stopped.wait(settings.EMAIL_SYNC_LOCK_LEASE / 3):
+            if not renew_sync_lock(self.account_id, self.owner):
+                logger.error(f"Аренда блокировки аккаунта {self.account_id} потеряна, продление остановлено.")
+                return
+            for slot in self.slots:
+                refresh_provider_slot(slot)
+
+    def release(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        release_sync_lock(self.account_id, self.owner)
+
+
+def mark_sync_queued(account_id, owner):
+    """
+    Отметка о поставленной в очередь синхронизации с id задачи. Возвращает False,
+    если синхронизация аккаунта уже стоит в очереди.
+    """
+    return cache.add(SYNC_QUEUED_KEY.format(account_id=account_id), owner, timeout=settings.EMAIL_SYNC_LOCK_TIMEOUT)
+
+
+def clear_sync_queued(account_id, owner):
+    """
+    Снятие отметки о синхронизации в очереди, если её поставила задача owner.
+    """
+    key = SYNC_QUEUED_KEY.format(account_id=account_id)
+    if cache.get(key) == owner:
+        cache.delete(key)
+
+
+def active_sync(account_id):
+    """
+    Id задачи, которая синхронизирует аккаунт или стоит в очереди, или None.
+    """
+    lock_key = SYNC_LOCK_KEY.format(account_id=account_id)
+    queued_key = SYNC_QUEUED_KEY.format(account_id=account_id)
+    values = cache.get_many([lock_key, queued_key])
+    return values.get(lock_key) or values.get(queued_key)
+
+
+def busy_accounts(account_ids):
+    """
+    Множество аккаунтов, синхронизация которых уже в очереди или выполняется.
+    Проверка выполняется одним запросом к кэшу.
+    """
+    keys = {}
+    for account_id in account_ids:
+        keys[SYNC_LOCK_KEY.format(account_id=account_id)] = account_id
+        keys[SYNC_QUEUED_KEY.format(account_id=account_id)] = account_id
+    return {keys[key] for key in cache.get_many(keys)}
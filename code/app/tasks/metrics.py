@@ -0,0 +1,211 @@
+import cProfile
+import os
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from celery import current_app
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from loguru import logger
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+    from prometheus_client.core import GaugeMetricFamily
+except ImportError:
+    # Метрики необязательны: без prometheus_client замеры не собираются
+    prometheus_client = None
+
+# От разбора одного письма (миллисекунды) до загрузки чанка и целой задачи (минуты)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+if prometheus_client is not None:
+    SYNC_STAGE_SECONDS = prometheus_client.Histogram(
+        'eml_sync_stage_seconds', 'Время этапов синхронизации почты', ['stage', 'provider', 'account'], buckets=BUCKETS)
+    SYNC_MESSAGES = prometheus_client.Counter(
+        'eml_sync_messages', 'Письма, записанные в базу синхронизацией', ['provider', 'account'])
+    SYNC_FETCHED_BYTES = prometheus_client.Counter(
+        'eml_sync_fetched_bytes', 'Байт писем, полученных с IMAP-сервера', ['provider', 'account'])
+    SYNC_ERRORS = prometheus_client.Counter(
+        'eml_sync_errors', 'Ошибки синхронизации папок', ['provider', 'account', 'error'])
+    TASK_SECONDS = prometheus_client.Histogram(
+        'eml_celery_task_seconds', 'Длительность задач Celery', ['task', 'state'], buckets=BUCKETS)
+
+_task_started = {}
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def metrics_enabled():
+    return prometheus_client is not None and settings.EMAIL_METRICS_ENABLED
+
+
+def fetched_size(data):
+    """
+    Размер литералов ответа FETCH в формате imaplib: тексты и заголовки писем.
+    """
+    return sum(len(item[1]) for item in data if isinstance(item, tuple))
+
+
+class SyncMetrics:
+    """
+    Замеры синхронизации папки: время этапов (connect, search, fetch, parse,
+    persist, notify), записанные письма, полученные байты и ошибки с метками
+    провайдера и аккаунта.
+    Без prometheus_client или с EMAIL_METRICS_ENABLED = False ничего не делает.
+    """
+
+    def __init__(self, account):
+        self.enabled = metrics_enabled()
+        self.labels = {
+            'provider': account.provider,
+            'account': str(account.id) if settings.EMAIL_METRICS_PER_ACCOUNT else '',
+        }
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Замер времени этапа. В асинхронном движке в него входит и время
+        других корутин, выполнявшихся во время ожидания.
+        """
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        histogram = self.stages.get(name)
+        if histogram is None:
+            histogram = self.stages[name] = SYNC_STAGE_SECONDS.labels(stage=name, **self.labels)
+        histogram.observe(seconds)
+
+    def count_messages(self, count):
+        if self.enabled:
+            SYNC_MESSAGES.labels(**self.labels).inc(count)
+
+    def count_fetched(self, data):
+        if self.enabled:
+            SYNC_FETCHED_BYTES.labels(**self.labels).inc(fetched_size(data))
+
+    def count_error(self, error):
+        if self.enabled:
+            SYNC_ERRORS.labels(error=type(error).__name__, **self.labels).inc()
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def observe_task(task_id=None, task=None, state=None, **kwargs):
+    """
+    Длительность завершённой задачи Celery, затем отправка метрик воркера в Pushgateway.
+    """
+    started = _task_started.pop(task_id, None)
+    if started is None or not metrics_enabled():
+        return
+    TASK_SECONDS.labels(task=task.name, state=state or 'UNKNOWN').observe(time.perf_counter() - started)
+    push_metrics()
+
+
+def push_metrics():
+    """
+    Отправка метрик процесса в Pushgateway (EMAIL_METRICS_PUSHGATEWAY). Воркеры
+    Celery и IDLE-слушатель сами /metrics не отдают; каждый процесс пишет
+    в свою группу instance, значения в ней накопительные.
+    """
+    if not settings.EMAIL_METRICS_PUSHGATEWAY or not metrics_enabled():
+        return
+    try:
+        prometheus_client.push_to_gateway(settings.EMAIL_METRICS_PUSHGATEWAY, job='eml_getter',
+                                          registry=prometheus_client.REGISTRY,
+                                          grouping_key={'instance': f'{socket.gethostname()}:{os.getpid()}'})
+    except OSError as e:
+        logger.warning(f'Не удалось отправить метрики в Pushgateway: {e}')
+
+
+class CeleryQueueCollector:
+    """
+    Глубина очередей Celery (EMAIL_METRICS_QUEUES), читается у брокера при каждом опросе.
+    """
+
+    @staticmethod
+    def describe():
+        return [GaugeMetricFamily('eml_celery_queue_depth', 'Задач в очереди Celery', labels=['queue'])]
+
+    def collect(self):
+        gauge = self.describe()[0]
+        try:
+            with current_app.connection_for_read() as connection:
+                channel = connection.default_channel
+                for queue in settings.EMAIL_METRICS_QUEUES:
+                    _, count, _ = channel.queue_declare(queue=queue, passive=True)
+                    gauge.add_metric([queue], count)
+        except Exception as e:
+            logger.warning(f'Не удалось получить глубину очередей Celery: {e}')
+        yield gauge
+
+
+def metrics_registry():
+    """
+    Реестр метрик для /metrics. С PROMETHEUS_MULTIPROC_DIR (несколько процессов
+    gunicorn или воркеры на общем томе) метрики собираются из файлов всех процессов.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+                registry = prometheus_client.CollectorRegistry()
+                multiprocess.MultiProcessCollector(registry)
+            else:
+                registry = prometheus_client.REGISTRY
+            registry.register(CeleryQueueCollector())
+            _registry = registry
+    return _registry
+
+
+def render_metrics():
+    """
+    Текст метрик в формате Prometheus и его Content-Type.
+    """
+    return prometheus_client.generate_latest(metrics_registry()), prometheus_client.CONTENT_TYPE_LATEST
+
+
+@contextmanager
+def sampled_profile(name):
+    """
+    cProfile для доли EMAIL_PROFILE_SAMPLE_RATE синхронизаций. Профиль сохраняется
+    в EMAIL_PROFILE_DIR, только если синхронизация шла не меньше
+    EMAIL_PROFILE_SLOW_SECONDS. cProfile видит только текущий поток: папки,
+    синхронизируемые в пуле потоков, в профиль не попадают.
+    """
+    rate = settings.EMAIL_PROFILE_SAMPLE_RATE
+    if rate <= 0 or random.random() >= rate:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        seconds = time.perf_counter() - started
+        if seconds >= settings.EMAIL_PROFILE_SLOW_SECONDS:
+            os.makedirs(settings.EMAIL_PROFILE_DIR, exist_ok=True)
+            path = os.path.join(settings.EMAIL_PROFILE_DIR, f'{name}-{datetime.now():%Y%m%d-%H%M%S}.prof')
+            profiler.dump_stats(path)
+            logger.info(f'Синхронизация {name} заняла {seconds:.1f} с, профиль сохранён в {path}')
@@ -0,0 +1,234 @@
+import asyncio
+import email
+import hashlib
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+import django
+from django.conf import settings
+from loguru import logger
+
+from .attachments import extract_attachments
+from .charsets import get_raw_header
+from .utils import decode_subject, get_email_body_content
+
+_executor = None
+_thread_executor = None
+
+_MESSAGE_ID_RE = re.compile(r'<([^<>]+)>')
+
+# Длины MessageContent.key, EmailMessage.subject и EmailMessage.message_id
+CONTENT_KEY_MAX_LENGTH = 255
+SUBJECT_MAX_LENGTH = 255
+MESSAGE_ID_MAX_LENGTH = 255
+
+
+def shorten_key(value, max_length):
+    """
+    Значение ключа, которое помещается в max_length символов: длинное
+    заменяется его SHA-256. Замена устойчива — одно и то же значение всегда
+    даёт один и тот же ключ, поэтому по нему по-прежнему находятся дубликаты.
+    """
+    if len(value) <= max_length:
+        return value
+    return f"sha256:{hashlib.sha256(value.encode('utf-8', 'surrogatepass')).hexdigest()}"
+
+
+def normalize_message_id(value):
+    """
+    Message-ID без угловых скобок, пробелов переноса заголовка и с доменом
+    в нижнем регистре: '<A1B2@Mail.Example.COM >' -> 'A1B2@mail.example.com'.
+    """
+    value = ''.join(str(value).split())
+    match = _MESSAGE_ID_RE.search(value)
+    if match:
+        value = match.group(1)
+    local, at, domain = value.rpartition('@')
+    return f'{local}@{domain.lower()}' if at else value
+
+
+def get_content_key(email_message):
+    """
+    Ключ MessageContent: нормализованный Message-ID и хэш темы и даты в том
+    виде, в каком они записаны в заголовках. Копии одного письма в разных папках
+    аккаунта совпадают (в том числе при синхронизации только заголовков), а письма,
+    которым отправитель выдал одинаковый Message-ID, — нет.
+    Письмо без Message-ID ключа не получает и текст ни с кем не делит:
+    одинаковые заголовки не означают одинаковый текст.
+    """
+    message_id = email_message.get('Message-ID')
+    if not message_id:
+        return None
+    headers = '\n'.join(''.join(str(email_message.get(name, '')).split()) for name in ('Subject', 'Date'))
+    digest = hashlib.sha1(headers.encode('utf-8', 'surrogatepass')).hexdigest()[:16]
+    return shorten_key(f'{normalize_message_id(message_id)}/{digest}', CONTENT_KEY_MAX_LENGTH)
+
+
+def get_content_digest(body):
+    """
+    MessageContent.digest: SHA-256 текста письма.
+    """
+    return hashlib.sha256(body.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def parse_header_fields(email_message, uid, provider):
+    """
+    Тема, дата отправки, Message-ID и ключ общего текста письма из заголовков.
+    Тема обрезается, а слишком длинный Message-ID заменяется хэшем по длине
+    полей EmailMessage: иначе одно такое письмо не даст записать всю пачку.
+    """
+    # Декодируем тему письма: 8-битные байты есть только в сыром значении заголовка
+    subject = decode_subject(get_raw_header(email_message, 'Subject'))[:SUBJECT_MAX_LENGTH]
+
+    # Парсим дату отправки
+    send_date = email_message['Date']
+    try:
+        send_date = parsedate_to_datetime(send_date)
+    except Exception as e:
+        logger.error(f'Ошибка при парсинге даты: {e}')
+        send_date = datetime.now()
+
+    # Получаем Message-ID
+    message_id = email_message.get('Message-ID')
+    if not message_id:
+        message_id = f"{uid}@{provider}"
+    message_id = shorten_key(str(message_id), MESSAGE_ID_MAX_LENGTH)
+
+    return {
+        'subject': subject,
+        'send_date': send_date,
+        'message_id': message_id,
+        'content_key': get_content_key(email_message),
+    }
+
+
+def parse_raw_email(uid, raw_email, provider):
+    """
+    Разбор сырого письма RFC822 в словарь полей EmailMessage и список полей
+    его вложений (ключ 'attachments').
+    Функция не обращается к базе и может выполняться в отдельном процессе.
+    """
+    email_message = email.message_from_bytes(raw_email)
+    fields = parse_header_fields(email_message, uid, provider)
+
+    # Обрабатываем тело письма
+    body = get_email_body_content(email_message)
+    fields.update(body=body, preview=body[:settings.EMAIL_PREVIEW_LENGTH])
+
+    # Вложения пишутся в хранилище сразу, в базу попадают только их поля
+    fields['attachments'] = extract_attachments(email_message) if settings.EMAIL_SAVE_ATTACHMENTS else []
+    return fields
+
+
+def parse_raw_email_safe(uid, raw_email, provider):
+    """
+    parse_raw_email, который вместо исключения возвращает None: ошибка одного
+    письма не должна прерывать обработку пачки в пуле процессов.
+    """
+    try:
+        return parse_raw_email(uid, raw_email, provider)
+    except Exception as e:
+        logger.error(f"Ошибка при обработке письма UID {uid}: {e}")
+        return None
+
+
+def parse_raw_email_timed(uid, raw_email, provider):
+    """
+    parse_raw_email_safe и время разбора в секундах: в пуле процессов разбор
+    замеряется в дочернем процессе, а метрика пишется в родительском.
+    """
+    started = time.perf_counter()
+    fields = parse_raw_email_safe(uid, raw_email, provider)
+    return fields, time.perf_counter() - started
+
+
+def get_parse_executor():
+    """
+    Пул процессов для разбора писем (создаётся один раз на процесс).
+    None, если EMAIL_PARSE_WORKERS = 0 и разбор идёт в текущем потоке.
+    """
+    global _executor
+    if settings.EMAIL_PARSE_WORKERS <= 0:
+        return None
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.EMAIL_PARSE_WORKERS, initializer=django.setup)
+    return _executor
+
+
+def get_parse_thread():
+    """
+    Поток разбора писем асинхронного движка без пула процессов (один на процесс).
+    Разбор не ускоряется, но event loop продолжает читать ответы сервера других
+    аккаунтов. Поток один: несколько потоков разбора не быстрее из-за GIL
+    и отнимали бы больше времени у event loop.
+    """
+    global _thread_executor
+    if _thread_executor is None:
+        _thread_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='parse')
+    return _thread_executor
+
+
+def parse_messages(messages, provider, metrics):
+    """
+    Стадия разбора писем. Принимает пары (uid, сырое письмо), выдаёт (uid, поля).
+    Время разбора каждого письма пишется в metrics (SyncMetrics).
+
+    С пулом процессов письма разбираются параллельно, пока генератор messages
+    загружает следующий чанк по сети. Порядок писем сохраняется, в обработке
+    одновременно не больше EMAIL_FETCH_CHUNK_SIZE писем.
+    """
+    executor = get_parse_executor()
+    if executor is None:
+        for uid, raw_email in messages:
+            fields, seconds = parse_raw_email_timed(uid, raw_email, provider)
+            metrics.observe('parse', seconds)
+            if fields is not None:
+                yield uid, fields
+        return
+
+    pending = deque()
+    for uid, raw_email in messages:
+        pending.append((uid, executor.submit(parse_raw_email_timed, uid, raw_email, provider)))
+        while pending and (pending[0][1].done() or len(pending) >= settings.EMAIL_FETCH_CHUNK_SIZE):
+            uid, future = pending.popleft()
+            fields, seconds = future.result()
+            metrics.observe('parse', seconds)
+            if fields is not None:
+                yield uid, fields
+
+    while pending:
+        uid, future = pending.popleft()
+        fields, seconds = future.result()
+        metrics.observe('parse', seconds)
+        if fields is not None:
+            yield uid, fields
+
+
+async def aparse_messages(messages, provider, metrics):
+    """
+    Асинхронный вариант parse_messages: разбор не блокирует event loop. Без пула
+    процессов (EMAIL_PARSE_WORKERS = 0) письма разбираются в отдельном потоке
+    (см. get_parse_thread).
+    """
+    executor = get_parse_executor() or get_parse_thread()
+    loop = asyncio.get_running_loop()
+    pending = deque()
+    async for uid, raw_email in messages:
+        pending.append((uid, loop.run_in_executor(executor, parse_raw_email_timed, uid, raw_email, provider)))
+        while pending and (pending[0][1].done() or len(pending) >= settings.EMAIL_FETCH_CHUNK_SIZE):
+            uid, future = pending.popleft()
+            fields, seconds = await future
+            metrics.observe('parse', seconds)
+            if fields is not None:
+                yield uid, fields
+
+    while pending:
+        uid, future = pending.popleft()
+        fields, seconds = await future
+        metrics.observe('parse', seconds)
+        if fields is not None:
+            yield uid, fields
@@ -0,0 +1,385 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DataError, IntegrityError, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from loguru import logger
+
+from .parsing import get_content_digest
+from ..models import Attachment, EmailMessage, MessageContent
+from ..search import update_search_vectors
+
+
+def build_email_message(fields, **kwargs):
+    """
+    Несохранённый объект EmailMessage из полей parse_raw_email или
+    parse_header_fetch, kwargs — поля письма в ящике (account, folder, uid, flags).
+    Вложения, текст и ключ общего текста хранятся в атрибутах объекта до записи пачки.
+    """
+    fields = dict(fields)
+    attachments = fields.pop('attachments', [])
+    body = fields.pop('body')
+    content_key = fields.pop('content_key')
+    email_message_obj = EmailMessage(receive_date=fields['send_date'], **kwargs, **fields)
+    email_message_obj.attachment_fields = attachments
+    email_message_obj.body = body
+    email_message_obj.content_key = content_key
+    return email_message_obj
+
+
+class EmailMessageBuffer:
+    """
+    Буфер сохранения писем: накапливает разобранные письма и записывает их
+    в базу пачками через bulk_create.
+    """
+
+    def __init__(self, account, batch_size=None, on_flush=None, on_checkpoint=None, metrics=None):
+        self.account = account
+        self.batch_size = batch_size or settings.EMAIL_PERSIST_BATCH_SIZE
+        self.on_flush = on_flush
+        self.on_checkpoint = on_checkpoint
+        # SyncMetrics синхронизации: время записи пачек и число записанных писем
+        self.metrics = metrics
+        self.pending = []
+
+    def add(self, email_message_obj):
+        """
+        Добавление письма в буфер. При заполнении буфера пачка записывается в базу.
+        """
+        self.pending.append(email_message_obj)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Запись накопленных писем пачкой, затем on_flush (уведомления, прогресс).
+        """
+        if not self.pending:
+            return []
+
+        batch, self.pending = self.pending, []
+        saved = self.timed_write(batch)
+        if self.on_flush:
+            self.on_flush(batch, saved)
+        return saved
+
+    def timed_write(self, batch):
+        """
+        write с замером этапа persist, если буфер создан с metrics.
+        """
+        if self.metrics is None:
+            return self.write(batch)
+        with self.metrics.stage('persist'):
+            saved = self.write(batch)
+        self.metrics.count_messages(len(batch))
+        return saved
+
+    def write(self, batch):
+        """
+        Запись пачки (write_batch). Если база отклоняет данные пачки, пачка
+        записывается по одному письму: письма, которые база не принимает,
+        пропускаются с ошибкой в логе, а отметка on_checkpoint сдвигается за
+        пачку — иначе одно такое письмо останавливало бы синхронизацию папки на
+        этой пачке навсегда. Ошибки соединения с базой не перехватываются.
+        """
+        body_loaded = [(obj, obj.body_loaded) for obj in batch]
+        try:
+            return self.write_batch(batch)
+        except (DataError, IntegrityError) as e:
+            logger.error(f'Ошибка записи пачки из {len(batch)} писем аккаунта {self.account}: {e}; '
+                         f'запись по одному письму')
+
+        saved = []
+        for obj, loaded in body_loaded:
+            # body_loaded мог измениться в link_contents откаченной транзакции
+            obj.body_loaded = loaded
+            try:
+                saved.extend(self.write_batch([obj], checkpoint=False))
+            except (DataError, IntegrityError) as e:
+                logger.error(f'Письмо UID {obj.uid} ({obj.message_id}) аккаунта {self.account} не записано: {e}')
+        if self.on_checkpoint:
+            with transaction.atomic():
+                self.on_checkpoint(batch)
+        return saved
+
+    def write_batch(self, batch, checkpoint=True):
+        """
+        Запись пачки одним INSERT. Письма, уже сохранённые в папке (по message_id),
+        отсеиваются одним запросом message_id IN (...) до записи: их тексты не
+        передаются в базу, а INSERT не упирается в ограничения уникальности.
+        Совпадения, появившиеся между проверкой и записью, пропускает сама база.
+        Уже сохранённым письмам без UID (после смены UIDVALIDITY) UID восстанавливается.
+        Поисковый вектор новых писем считается одним UPDATE на пачку.
+
+        Тексты, пачка и отметка on_checkpoint (если checkpoint) фиксируются одной
+        транзакцией: прерванная синхронизация продолжается с первой незаписанной
+        пачки и не теряет писем записанной не до конца. Проверка писем выполняется до неё,
+        чтобы транзакция начиналась с записи (см. link_contents).
+        """
+        stored = set(self.get_saved(batch).values_list('folder_id', 'message_id'))
+        new = [obj for obj in batch if (obj.folder_id, obj.message_id) not in stored]
+
+        with transaction.atomic():
+            if new:
+                self.link_contents(new)
+                EmailMessage.objects.bulk_create(new, ignore_conflicts=True)
+            saved = list(self.get_saved(batch))
+            update_search_vectors(self.unindexed(saved))
+
+            relinked = self.relink_uids(batch, saved)
+            if relinked:
+                EmailMessage.objects.bulk_update(relinked, ['uid'])
+
+            if self.has_attachments(batch):
+                existing = set(Attachment.objects
+                               .filter(message__in=[obj.id for obj in saved])
+                               .values_list('message_id', flat=True))
+                Attachment.objects.bulk_create(self.build_attachments(batch, saved, existing))
+
+            if checkpoint and self.on_checkpoint:
+                self.on_checkpoint(batch)
+        return saved
+
+    def link_contents(self, new):
+        """
+        Привязка новых писем к текстам MessageContent своего аккаунта по ключу.
+        Письмо с телом получает текст с тем же digest; текст, сохранённый без тела
+        (в режиме заголовков), дополняется телом из пачки, а копия с тем же ключом,
+        но другим телом получает собственный текст. Письмо без тела получает уже
+        загруженный текст с этим ключом и сразу body_loaded. Письма без ключа
+        получают собственные тексты.
+
+        Выполняется в транзакции пачки и начинается с UPDATE used_at найденных
+        текстов: строки остаются заблокированными до INSERT писем, и
+        cleanup_message_contents не удалит их в промежутке, а в SQLite транзакция
+        начинается с записи — чтение в начале транзакции при параллельной
+        синхронизации папок не повышается до записи.
+        """
+        now = timezone.now()
+        keys = {obj.content_key for obj in new if obj.content_key}
+        contents = defaultdict(list)
+        existing = MessageContent.objects.filter(account=self.account, key__in=keys)
+        if keys and existing.update(used_at=now):
+            for content in existing.only('id', 'key', 'digest', 'body_loaded'):
+                contents[content.key].append(content)
+
+        created = []
+        completed = []
+        for obj in new:
+            digest = get_content_digest(obj.body) if obj.body_loaded else ''
+            content = self.choose_content(contents[obj.content_key], obj.body_loaded, digest) if obj.content_key else None
+            if content is None:
+                content = MessageContent(account=self.account, key=obj.content_key, digest=digest,
+                                         body=obj.body, body_loaded=obj.body_loaded, used_at=now)
+                if obj.content_key:
+                    contents[obj.content_key].append(content)
+                created.append(content)
+            elif obj.body_loaded and not content.body_loaded:
+                content.body = obj.body
+                content.digest = digest
+                content.body_loaded = True
+                if content.pk:
+                    completed.append(content)
+            obj.content = content
+
+        # content_id писем bulk_create берёт из созданных текстов
+        create_contents(created)
+        for obj in new:
+            obj.body_loaded = obj.content.body_loaded
+        if completed:
+            MessageContent.objects.bulk_update(completed, ['body', 'digest', 'body_loaded'])
+            # Письма других папок с этим текстом тоже получают его
+            EmailMessage.objects.filter(content__in=completed, body_loaded=False).update(body_loaded=True)
+            update_search_vectors(EmailMessage.objects.filter(content__in=completed))
+
+    @staticmethod
+    def choose_content(candidates, body_loaded, digest):
+        """
+        Текст с тем же ключом для нового письма: для письма с телом — с тем же
+        digest или ещё не загруженный, для письма без тела — загруженный или любой.
+        None — письму нужен новый текст.
+        """
+        if body_loaded:
+            return (next((content for content in candidates if content.digest == digest), None)
+                    or next((content for content in candidates if not content.body_loaded), None))
+        return next((content for content in candidates if content.body_loaded), None) or next(iter(candidates), None)
+
+    @staticmethod
+    def relink_uids(batch, saved):
+        """
+        Письма, сохранённые до смены UIDVALIDITY, остались без UID: им
+        присваиваются новые UID из пачки. Возвращает изменённые объекты.
+        """
+        uids = {(obj.folder_id, obj.message_id): obj.uid for obj in batch}
+        relinked = []
+        for obj in saved:
+            uid = uids.get((obj.folder_id, obj.message_id))
+            if obj.uid is None and uid is not None:
+                obj.uid = uid
+                relinked.append(obj)
+        return relinked
+
+    @staticmethod
+    def unindexed(saved):
+        """
+        Записанные письма пачки без поискового вектора, то есть только что добавленные.
+        """
+        return EmailMessage.objects.filter(id__in=[obj.id for obj in saved], search_vector__isnull=True)
+
+    @staticmethod
+    def has_attachments(batch):
+        return any(getattr(obj, 'attachment_fields', None) for obj in batch)
+
+    @staticmethod
+    def build_attachments(batch, saved, existing):
+        """
+        Строки Attachment для записанных писем пачки. Файлы уже лежат в хранилище,
+        письма, у которых вложения были записаны раньше, пропускаются.
+        """
+        saved_by_key = {(obj.folder_id, obj.message_id): obj for obj in saved if obj.id not in existing}
+        attachments = []
+        for obj in batch:
+            message = saved_by_key.pop((obj.folder_id, obj.message_id), None)
+            if message is None:
+                continue
+            attachments.extend(Attachment(message=message, **fields)
+                               for fields in getattr(obj, 'attachment_fields', []))
+        return attachments
+
+    def get_saved(self, batch):
+        """
+        При ignore_conflicts база не возвращает первичные ключи, поэтому
+        сохранённые письма пачки перечитываются одним запросом.
+        """
+        return (EmailMessage.objects
+                .filter(account=self.account,
+                        folder__in={obj.folder_id for obj in batch},
+                        message_id__in=[obj.message_id for obj in batch])
+                .order_by('send_date'))
+
+
+def create_contents(contents):
+    """
+    INSERT новых MessageContent с заполнением их первичных ключей. Текст с ключом
+    могла только что записать параллельная синхронизация другой папки аккаунта:
+    такие строки пропускаются базой и перечитываются.
+    """
+    batch_size = settings.EMAIL_PERSIST_BATCH_SIZE
+    MessageContent.objects.bulk_create([content for content in contents if not content.key], batch_size=batch_size)
+    keyed = [content for content in contents if content.key]
+    if not keyed:
+        return
+    MessageContent.objects.bulk_create(keyed, ignore_conflicts=True, batch_size=batch_size)
+    ids = {(content.account_id, content.key, content.digest): content.id for content in MessageContent.objects
+           .filter(account__in={content.account_id for content in keyed}, key__in={content.key for content in keyed})
+           .only('id', 'account_id', 'key', 'digest')}
+    for content in keyed:
+        content.id = ids[(content.account_id, content.key, content.digest)]
+
+
+def save_bodies(messages, parsed):
+    """
+    Запись текстов в уже сохранённые письма: messages — {uid: EmailMessage}
+    с content_id, parsed — пары (uid, поля parse_raw_email). Текст пишется
+    в MessageContent письма, body_loaded получают все письма с этим текстом,
+    их поисковый вектор пересчитывается с текстом. Если текст уже загружен через
+    другую папку и отличается (по digest), письмо получает собственный текст.
+    Вложения добавляются письмам, у которых их ещё нет. Возвращает число
+    обновлённых писем.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # Транзакция начинается с записи, см. EmailMessageBuffer.link_contents
+        linked = MessageContent.objects.filter(id__in={obj.content_id for obj in messages.values()})
+        linked.update(used_at=now)
+        contents = linked.only('id', 'account_id', 'key', 'digest', 'body_loaded').in_bulk()
+        shared = dict(EmailMessage.objects
+                      .filter(content__in=list(contents))
+                      .values('content')
+                      .annotate(count=Count('id'))
+                      .values_list('content', 'count'))
+
+        updated = []
+        filled = {}
+        separate = {}
+        attachment_fields = {}
+        for uid, fields in parsed:
+            obj = messages.get(uid)
+            if obj is None:
+                continue
+            obj.preview = fields['preview']
+            obj.body_loaded = True
+            updated.append(obj)
+            digest = get_content_digest(fields['body'])
+            content = contents[obj.content_id]
+            if not content.body_loaded or (content.digest != digest and shared[content.id] == 1):
+                content.body = fields['body']
+                content.digest = digest
+                content.body_loaded = True
+                filled[content.id] = content
+            elif content.digest != digest:
+                key = (content.key, digest) if content.key else obj.id
+                if key not in separate:
+                    separate[key] = MessageContent(account_id=content.account_id, key=content.key, digest=digest,
+                                                   body=fields['body'], body_loaded=True, used_at=now)
+                obj.content = separate[key]
+            if fields['attachments']:
+                attachment_fields[obj.id] = (obj, fields['attachments'])
+
+        create_contents(separate.values())
+        MessageContent.objects.bulk_update(filled.values(), ['body', 'digest', 'body_loaded'],
+                                           batch_size=settings.EMAIL_PERSIST_BATCH_SIZE)
+        EmailMessage.objects.bulk_update(updated, ['preview', 'content', 'body_loaded'],
+                                         batch_size=settings.EMAIL_PERSIST_BATCH_SIZE)
+        EmailMessage.objects.filter(content__in=list(filled), body_loaded=False).update(body_loaded=True)
+        # Вектор мог быть посчитан только по теме: пересчитываем с текстом
+        update_search_vectors(EmailMessage.objects.filter(Q(id__in=[obj.id for obj in updated])
+                                                          | Q(content__in=list(filled))))
+        existing = set(Attachment.objects
+                       .filter(message__in=list(attachment_fields))
+                       .values_list('message_id', flat=True))
+        Attachment.objects.bulk_create([Attachment(message=obj, **attachment)
+                                        for message_id, (obj, attachments) in attachment_fields.items()
+                                        if message_id not in existing
+                                        for attachment in attachments],
+                                       batch_size=settings.EMAIL_PERSIST_BATCH_SIZE)
+    return len(updated)
+
+
+def delete_unused_contents():
+    """
+    Удаление текстов, на которые не ссылается ни одно письмо: после удаления
+    писем на сервере или аккаунта. Тексты, привязанные к письмам позже чем
+    EMAIL_CONTENT_CLEANUP_GRACE секунд назад, не удаляются: их может использовать
+    идущая запись пачки. Возвращает число удалённых строк.
+    """
+    used_before = timezone.now() - timedelta(seconds=settings.EMAIL_CONTENT_CLEANUP_GRACE)
+    _, deleted = MessageContent.objects.filter(messages__isnull=True, used_at__lt=used_before).delete()
+    return deleted.get(MessageContent._meta.label, 0)
+
+
+class AsyncEmailMessageBuffer(EmailMessageBuffer):
+    """
+    Буфер сохранения писем для асинхронного движка: пачка записывается в потоке,
+    on_flush — корутина.
+    """
+
+    async def aadd(self, email_message_obj):
+        self.pending.append(email_message_obj)
+        if len(self.pending) >= self.batch_size:
+            await self.aflush()
+
+    async def aflush(self):
+        if not self.pending:
+            return []
+
+        batch, self.pending = self.pending, []
+        # Асинхронный ORM не поддерживает transaction.atomic: пачка записывается
+        # той же транзакцией синхронным кодом в потоке
+        saved = await sync_to_async(self.timed_write)(batch)
+        if self.on_flush:
+            await self.on_flush(batch, saved)
+        return saved
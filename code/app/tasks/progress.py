@@ -0,0 +1,131 @@
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+
+PROGRESS_SNAPSHOT_KEY = 'progress-snapshot:{group_name}'
+
+
+def progress_group(account_id):
+    """
+    Группа channel layer аккаунта: события синхронизации получают только его сокеты.
+    """
+    return f'progress.{account_id}'
+
+
+def snapshot_key(group_name):
+    return PROGRESS_SNAPSHOT_KEY.format(group_name=group_name)
+
+
+class ProgressReporter:
+    """
+    Отправка прогресса синхронизации через WebSocket с ограничением частоты.
+
+    Обновление уходит в channel layer не чаще PROGRESS_MAX_UPDATES_PER_SECOND раз
+    в секунду и только если процент изменился хотя бы на PROGRESS_MIN_DELTA.
+    Принудительные обновления (force=True) отправляются всегда.
+
+    Последнее отправленное состояние хранится в кэше: сокет, подключившийся
+    посреди синхронизации, сразу получает его (см. ProgressConsumer).
+    """
+
+    def __init__(self, channel_layer, group_name, max_rate=None, min_delta=None):
+        self.channel_layer = channel_layer
+        self.group_name = group_name
+        self.min_interval = 1 / (max_rate or settings.PROGRESS_MAX_UPDATES_PER_SECOND)
+        self.min_delta = settings.PROGRESS_MIN_DELTA if min_delta is None else min_delta
+        self.last_sent_at = None
+        self.last_progress = None
+
+    def should_send(self, progress, now):
+        """
+        Проверка ограничений по времени и по изменению процента.
+        """
+        if self.last_sent_at is None:
+            return True
+        if now - self.last_sent_at < self.min_interval:
+            return False
+        if progress is not None and self.last_progress is not None:
+            return abs(progress - self.last_progress) >= self.min_delta
+        return True
+
+    def prepare(self, status, progress=None, force=False):
+        """
+        Формирование события прогресса или None, если обновление нужно пропустить.
+        """
+        now = time.monotonic()
+        if not force and not self.should_send(progress, now):
+            return None
+
+        message = {'status': status}
+        if progress is not None:
+            message['progress'] = progress
+            self.last_progress = progress
+        if self.last_progress is not None:
+            # Снимок для новых сокетов содержит и последний процент
+            message['progress'] = self.last_progress
+        self.last_sent_at = now
+        return {
+            'type': 'progress_update',
+            'message': message,
+        }
+
+    def update(self, status, progress=None, force=False):
+        """
+        Отправка обновления прогресса. Возвращает True, если сообщение было отправлено.
+        """
+        event = self.prepare(status, progress, force)
+        if event is None:
+            return False
+        async_to_sync(self.channel_layer.group_send)(self.group_name, event)
+        cache.set(snapshot_key(self.group_name), event['message'], timeout=settings.PROGRESS_SNAPSHOT_TIMEOUT)
+        return True
+
+    async def aupdate(self, status, progress=None, force=False):
+        """
+        Асинхронный вариант update() для асинхронного движка.
+        """
+        event = self.prepare(status, progress, force)
+        if event is None:
+            return False
+        await self.channel_layer.group_send(self.group_name, event)
+        await cache.aset(snapshot_key(self.group_name), event['message'], timeout=settings.PROGRESS_SNAPSHOT_TIMEOUT)
+        return True
+
+
+class SyncCounters:
+    """
+    Счётчики прогресса синхронизации. Папки аккаунта синхронизируются параллельно
+    и ведут общий счёт, чтобы прогресс-бар показывал работу по всему ящику.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.read = 0
+        self.processed = 0
+
+    def add_total(self, count):
+        with self._lock:
+            self.total += count
+
+    def percent(self):
+        return int((self.processed / self.total) * 100) if self.total > 0 else 100  # 0-100% для получения
+
+    def count_read(self, count=1):
+        """
+        Учёт прочитанных с сервера сообщений. Возвращает текст статуса без процента.
+        """
+        with self._lock:
+            self.read += count
+            return f'Чтение сообщений {self.read} из {self.total}', None
+
+    def count_received(self, count=1):
+        """
+        Учёт сохранённых сообщений. Возвращает текст статуса и процент выполнения.
+        """
+        with self._lock:
+            self.processed += count
+            return f'Получение сообщений {self.total - self.processed}', self.percent()
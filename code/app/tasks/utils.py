@@ -1,68 +1,229 @@
-from email.header import decode_header, make_header
+import codecs
+import html
+from html.entities import html5
+from html.parser import HTMLParser
+
 from bs4 import BeautifulSoup
 from loguru import logger
 from django.core.mail import send_mail
 from django.conf import settings
 
+from .charsets import decode_header_text, guess_charset, resolve_charset
+
 
 def decode_subject(subject_header):
     """
-    Декодирование заголовка темы письма.
+    Декодирование заголовка темы письма. 8-битная тема декодируется, только если
+    передано сырое значение (см. charsets.get_raw_header): в str() объекта Header
+    её байты уже потеряны.
     """
+    if subject_header is None:
+        return 'Без темы'
     try:
-        return str(make_header(decode_header(subject_header)))
+        return decode_header_text(str(subject_header))
     except Exception as e:
         logger.error(f'Ошибка декодирования темы: {e}')
         return 'Без темы'
 
 
-def get_email_body_content(email_message):
+class HTMLTextExtractor(HTMLParser):
+    """
+    Потоковое извлечение текста из HTML без построения дерева.
+
+    Повторяет поведение BeautifulSoup(payload, 'html.parser').get_text(): тот же
+    токенизатор, пропуск script/style/template/rt/rp и комментариев, замена
+    строк из одних пробелов на один перевод строки или пробел вне pre/textarea.
+    """
+
+    skip_tags = frozenset({'script', 'style', 'template', 'rt', 'rp'})
+    preserve_whitespace_tags = frozenset({'pre', 'textarea'})
+    empty_element_tags = frozenset({
+        'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta',
+        'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex',
+        'nextid', 'spacer',
+    })
+    ascii_spaces = ' \n\t\x0c\r'
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.parts = []
+        self.length = 0
+        self.current = []
+        self.stack = []
+        self.skip_depth = 0
+        self.preserve_depth = 0
+        self.closed_empty_elements = {}
+
+    def end_data(self):
+        if not self.current:
+            return
+        data = ''.join(self.current)
+        self.current = []
+        if self.skip_depth:
+            return
+        if not self.preserve_depth and not data.strip(self.ascii_spaces):
+            data = '\n' if '\n' in data else ' '
+        self.parts.append(data)
+        self.length += len(data)
+
+    def handle_starttag(self, tag, attrs):
+        self.end_data()
+        if tag in self.empty_element_tags:
+            # Парный закрывающий тег пустого элемента потом игнорируется
+            self.closed_empty_elements[tag] = self.closed_empty_elements.get(tag, 0) + 1
+            return
+        self.stack.append(tag)
+        if tag in self.skip_tags:
+            self.skip_depth += 1
+        if tag in self.preserve_whitespace_tags:
+            self.preserve_depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self.end_data()
+
+    def handle_endtag(self, tag):
+        if self.closed_empty_elements.get(tag):
+            self.closed_empty_elements[tag] -= 1
+            return
+        self.end_data()
+        if tag not in self.stack:
+            return
+        while True:
+            closed = self.stack.pop()
+            if closed in self.skip_tags:
+                self.skip_depth -= 1
+            if closed in self.preserve_whitespace_tags:
+                self.preserve_depth -= 1
+            if closed == tag:
+                break
+
+    def handle_data(self, data):
+        self.current.append(data)
+
+    def handle_charref(self, name):
+        self.current.append(html.unescape(f'&#{name};'))
+
+    def handle_entityref(self, name):
+        self.current.append(html5.get(f'{name};', f'&{name}'))
+
+    def handle_comment(self, data):
+        self.end_data()
+
+    def handle_decl(self, decl):
+        self.end_data()
+
+    def handle_pi(self, data):
+        self.end_data()
+
+    def unknown_decl(self, data):
+        self.end_data()
+        if data.upper().startswith('CDATA['):
+            self.current.append(data[len('CDATA['):])
+            self.end_data()
+
+    def close(self):
+        super().close()
+        self.end_data()
+
+    def get_text(self):
+        return ''.join(self.parts)
+
+
+def html_to_text(chunks, max_length=0):
+    """
+    Извлечение текста из HTML. Бэкенд задаётся настройкой EMAIL_HTML_TO_TEXT:
+    'stream' — HTMLTextExtractor, 'bs4' — BeautifulSoup.
+
+    chunks — строка или последовательность фрагментов документа. Потоковый
+    бэкенд прекращает разбор, как только набрано max_length символов текста.
+    """
+    if isinstance(chunks, str):
+        chunks = [chunks]
+    if settings.EMAIL_HTML_TO_TEXT == 'bs4':
+        text = BeautifulSoup(''.join(chunks), 'html.parser').get_text()
+        return text[:max_length] if max_length else text
+
+    extractor = HTMLTextExtractor()
+    for chunk in chunks:
+        extractor.feed(chunk)
+        if max_length and extractor.length >= max_length:
+            return extractor.get_text()[:max_length]
+    extractor.close()
+    text = extractor.get_text()
+    return text[:max_length] if max_length else text
+
+
+def iter_decoded_payload(part, chunk_size=64 * 1024):
+    """
+    Декодирование содержимого части письма в str фрагментами по chunk_size байт,
+    чтобы не переводить в строку целиком многомегабайтные части. Без charset
+    или с неизвестным charset кодировка выбирается по началу текста.
+    """
+    payload = part.get_payload(decode=True)
+    if not payload:
+        return
+    charset = resolve_charset(part.get_content_charset()) or guess_charset(payload)
+    decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+    for start in range(0, len(payload), chunk_size):
+        yield decoder.decode(payload[start:start + chunk_size])
+    yield decoder.decode(b'', final=True)
+
+
+def get_part_text(part, max_length=0):
+    """
+    Текст части text/plain или text/html, не длиннее max_length символов
+    (0 — без ограничения).
+    """
+    content_type = part.get_content_type()
+    if content_type not in ('text/plain', 'text/html'):
+        return ''
+    try:
+        if content_type == 'text/html':
+            return html_to_text(iter_decoded_payload(part), max_length)
+        texts = []
+        length = 0
+        for text in iter_decoded_payload(part):
+            texts.append(text)
+            length += len(text)
+            if max_length and length >= max_length:
+                break
+        return ''.join(texts)
+    except Exception as e:
+        logger.error(f'Ошибка декодирования части письма: {e}')
+        return 'Не удалось декодировать содержимое.'
+
+
+def get_email_body_content(email_message, max_length=None):
     """
     Извлечение текстового содержимого из письма.
+
+    Текст собирается не длиннее max_length символов (по умолчанию
+    EMAIL_BODY_MAX_LENGTH, 0 — без ограничения): после того как лимит набран,
+    остальные части письма не декодируются.
     """
-    body = ''
+    if max_length is None:
+        max_length = settings.EMAIL_BODY_MAX_LENGTH
+
     if email_message.is_multipart():
-        for part in email_message.walk():
-            content_type = part.get_content_type()
-            content_disposition = str(part.get('Content-Disposition'))
-            if 'attachment' not in content_disposition:
-                charset = part.get_content_charset()
-                payload = part.get_payload(decode=True)
-                if payload:
-                    try:
-                        if charset:
-                            payload = payload.decode(charset, errors='replace')
-                        else:
-                            payload = payload.decode('utf-8', errors='replace')
-                    except Exception as e:
-                        logger.error(f'Ошибка декодирования части письма: {e}')
-                        payload = 'Не удалось декодировать содержимое.'
-                    if content_type == 'text/plain':
-                        body += payload
-                    elif content_type == 'text/html':
-                        soup = BeautifulSoup(payload, 'html.parser')
-                        text = soup.get_text()
-                        body += text
+        parts = (part for part in email_message.walk()
+                 if not part.is_multipart() and 'attachment' not in str(part.get('Content-Disposition')))
     else:
-        charset = email_message.get_content_charset()
-        payload = email_message.get_payload(decode=True)
-        if payload:
-            try:
-                if charset:
-                    payload = payload.decode(charset, errors='replace')
-                else:
-                    payload = payload.decode('utf-8', errors='replace')
-            except Exception as e:
-                logger.error(f'Ошибка декодирования письма: {e}')
-                payload = 'Не удалось декодировать содержимое.'
-            content_type = email_message.get_content_type()
-            if content_type == 'text/plain':
-                body += payload
-            elif content_type == 'text/html':
-                soup = BeautifulSoup(payload, 'html.parser')
-                text = soup.get_text()
-                body += text
-    return body
+        parts = [email_message]
+
+    texts = []
+    length = 0
+    for part in parts:
+        remaining = max_length - length if max_length else 0
+        text = get_part_text(part, remaining)
+        if not text:
+            continue
+        texts.append(text)
+        length += len(text)
+        if max_length and length >= max_length:
+            break
+
+    body = ''.join(texts)
+    return body[:max_length] if max_length else body
 
 
 def handle_exception(exception):
@@ -1,3 +1,917 @@
-from django.test import TestCase
+"""
+Тесты не требуют PostgreSQL, Redis и IMAP-сервера:
 
-# Create your tests here.
+    python manage.py test app --settings eml_getter.settings_bench
+"""
+import email
+import hashlib
+import imaplib
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.encoders import encode_base64, encode_quopri
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from unittest import mock
+
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DataError
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from .message_list import decode_cursor, encode_cursor, get_message_queryset, get_page
+from .models import EmailAccount, EmailMessage, MailFolder, MessageContent
+from .tasks.attachments import CHUNK_SIZE, extract_attachments, iter_base64, iter_quoted_printable
+from .tasks.changes import apply_changes, changed_since_modifier, diff_flags, format_flags, parse_vanished
+from .tasks.charsets import (
+    SNIFF_BYTES,
+    decode_bytes,
+    decode_header_text,
+    get_raw_header,
+    guess_charset,
+    resolve_charset,
+)
+from .tasks.email_processing import EmailBodyFetcher, EmailFetcher
+from .tasks.fetch_emails import queue_sync
+from .tasks.folders import parse_list_response, quote_folder, select_folders
+from .tasks.idle import IdleWatcher
+from .tasks.imap_parser import build_uid_set, chunked, iter_fetch_response
+from .tasks.imap_pool import IMAPConnectionPool
+from .tasks.importing import EmailImporter, import_sources, iter_mbox, maildir_flags
+from .tasks.locks import (
+    SyncLease,
+    acquire_provider_slots,
+    active_sync,
+    busy_accounts,
+    provider_connection_limit,
+    release_sync_lock,
+)
+from .tasks.parsing import get_content_key, parse_messages, parse_raw_email
+from .tasks.persistence import EmailMessageBuffer, build_email_message, delete_unused_contents
+from .tasks.progress import ProgressReporter, snapshot_key
+from .tasks.utils import decode_subject, get_email_body_content, html_to_text
+
+SEND_DATE = datetime(2024, 1, 1, 10, 0, tzinfo=timezone.utc)
+
+
+def build_raw_email(subject=b'Test', message_id=b'<1@example.com>', body=b'Text'):
+    """
+    Простое письмо RFC 822 в байтах. subject и body передаются байтами как есть,
+    в том числе 8-битными.
+    """
+    headers = [b'Subject: ' + subject, b'From: sender@example.com', b'Date: Mon, 1 Jan 2024 10:00:00 +0000',
+               b'Content-Type: text/plain; charset=utf-8']
+    if message_id:
+        headers.append(b'Message-ID: ' + message_id)
+    return b'\r\n'.join(headers) + b'\r\n\r\n' + body
+
+
+class DecodeSubjectTests(SimpleTestCase):
+    def test_8bit_cp1251_subject(self):
+        message = email.message_from_bytes(build_raw_email('Счёт за апрель'.encode('cp1251')))
+        self.assertEqual(decode_subject(get_raw_header(message, 'Subject')), 'Счёт за апрель')
+
+    def test_8bit_utf8_subject(self):
+        message = email.message_from_bytes(build_raw_email('Счёт за апрель'.encode()))
+        self.assertEqual(decode_subject(get_raw_header(message, 'Subject')), 'Счёт за апрель')
+
+    def test_encoded_word_subject(self):
+        message = email.message_from_bytes(build_raw_email(b'=?windows-1251?B?0ffl8g==?= 42'))
+        self.assertEqual(decode_subject(get_raw_header(message, 'Subject')), 'Счет 42')
+
+    def test_missing_subject(self):
+        self.assertEqual(decode_subject(None), 'Без темы')
+
+    def test_parse_raw_email_decodes_8bit_subject(self):
+        fields = parse_raw_email(1, build_raw_email('Привет'.encode('cp1251')), 'example.com')
+        self.assertEqual(fields['subject'], 'Привет')
+
+
+class ContentKeyTests(SimpleTestCase):
+    def get_key(self, **kwargs):
+        return get_content_key(email.message_from_bytes(build_raw_email(**kwargs)))
+
+    def test_normalized_message_id(self):
+        self.assertEqual(self.get_key(message_id=b'<A1@Mail.Example.COM>'),
+                         self.get_key(message_id=b' <A1@mail.example.com >'))
+
+    def test_same_message_id_other_subject(self):
+        self.assertNotEqual(self.get_key(subject=b'First'), self.get_key(subject=b'Second'))
+
+    def test_no_message_id(self):
+        self.assertIsNone(self.get_key(message_id=None))
+
+
+class HeaderLengthTests(SimpleTestCase):
+    def parse(self):
+        raw_email = build_raw_email(subject=b'S' * 300, message_id=b'<' + b'a' * 300 + b'@example.com>')
+        return parse_raw_email(1, raw_email, 'example.com')
+
+    def test_long_subject_clamped(self):
+        self.assertEqual(self.parse()['subject'], 'S' * 255)
+
+    def test_long_message_id_shortened(self):
+        fields = self.parse()
+        self.assertLessEqual(len(fields['message_id']), 255)
+        # Повторная синхронизация находит письмо по тому же message_id
+        self.assertEqual(fields['message_id'], self.parse()['message_id'])
+
+    def test_short_message_id_unchanged(self):
+        fields = parse_raw_email(1, build_raw_email(), 'example.com')
+        self.assertEqual(fields['message_id'], '<1@example.com>')
+
+
+class LinkContentsTests(TestCase):
+    def setUp(self):
+        self.account = EmailAccount.objects.create(email='user@example.com', password='x', provider='example.com')
+        self.other_account = EmailAccount.objects.create(email='other@example.com', password='x',
+                                                         provider='example.com')
+        self.inbox = MailFolder.objects.create(account=self.account, name='INBOX')
+        self.sent = MailFolder.objects.create(account=self.account, name='Sent')
+
+    def write(self, folder, uid, body, key='key@example.com/1', body_loaded=True):
+        fields = {'subject': 'Test', 'send_date': SEND_DATE, 'message_id': f'{key}:{uid}', 'content_key': key,
+                  'body': body, 'preview': body[:100], 'body_loaded': body_loaded}
+        obj = build_email_message(fields, account=folder.account, folder=folder, uid=uid)
+        EmailMessageBuffer(folder.account).write([obj])
+        return EmailMessage.objects.select_related('content').get(folder=folder, uid=uid)
+
+    def test_copies_in_folders_share_content(self):
+        inbox = self.write(self.inbox, 1, 'Text')
+        sent = self.write(self.sent, 1, 'Text')
+        self.assertEqual(inbox.content_id, sent.content_id)
+        self.assertEqual(MessageContent.objects.count(), 1)
+
+    def test_other_account_gets_own_content(self):
+        own = self.write(self.inbox, 1, 'Text')
+        folder = MailFolder.objects.create(account=self.other_account, name='INBOX')
+        other = self.write(folder, 1, 'Text')
+        self.assertNotEqual(own.content_id, other.content_id)
+        self.assertEqual(other.content.account, self.other_account)
+
+    def test_different_body_gets_own_content(self):
+        inbox = self.write(self.inbox, 1, 'Text')
+        sent = self.write(self.sent, 1, 'Other text')
+        self.assertNotEqual(inbox.content_id, sent.content_id)
+        self.assertEqual(sent.content.body, 'Other text')
+
+    def test_body_completes_headers_only_copy(self):
+        headers_only = self.write(self.inbox, 1, '', body_loaded=False)
+        self.assertFalse(headers_only.body_loaded)
+        full = self.write(self.sent, 1, 'Text')
+        headers_only.refresh_from_db()
+        self.assertEqual(full.content_id, headers_only.content_id)
+        self.assertTrue(headers_only.body_loaded)
+        self.assertEqual(headers_only.content.body, 'Text')
+
+    def test_no_message_id_not_shared(self):
+        first = self.write(self.inbox, 1, 'Text', key=None)
+        second = self.write(self.sent, 1, 'Text', key=None)
+        self.assertNotEqual(first.content_id, second.content_id)
+
+    @override_settings(EMAIL_CONTENT_CLEANUP_GRACE=3600)
+    def test_cleanup_keeps_recently_used(self):
+        message = self.write(self.inbox, 1, 'Text')
+        message.delete()
+        self.assertEqual(delete_unused_contents(), 0)
+        MessageContent.objects.update(used_at=SEND_DATE)
+        self.assertEqual(delete_unused_contents(), 1)
+
+
+class FailingFetchMail:
+    """
+    Заглушка сессии imaplib: UID FETCH отдаёт письма, чанк с UID из fail_uids
+    сервер отклоняет.
+    """
+
+    def __init__(self, messages, fail_uids):
+        self.messages = messages
+        self.fail_uids = fail_uids
+
+    def uid(self, command, uid_set, items):
+        uids = []
+        for item in uid_set.split(','):
+            first, _, last = item.partition(':')
+            uids.extend(range(int(first), int(last or first) + 1))
+        if self.fail_uids & set(uids):
+            return 'NO', [b'FETCH failed']
+        data = []
+        for uid in uids:
+            raw_email = self.messages[uid]
+            data.append((f'{uid} (UID {uid} FLAGS () RFC822 {{{len(raw_email)}}}'.encode(), raw_email))
+            data.append(b')')
+        return 'OK', data
+
+
+@override_settings(EMAIL_FETCH_CHUNK_SIZE=2, EMAIL_PERSIST_BATCH_SIZE=2, EMAIL_PARSE_WORKERS=0)
+class CheckpointTests(TestCase):
+    def setUp(self):
+        self.account = EmailAccount.objects.create(email='user@example.com', password='x', provider='example.com')
+        self.fetcher = EmailFetcher(self.account)
+        self.fetcher.prepare_folder(1)
+        self.messages = {uid: build_raw_email(subject=f'Message {uid}'.encode(),
+                                              message_id=f'<{uid}@example.com>'.encode()) for uid in range(1, 7)}
+
+    def sync(self, fail_uids):
+        self.fetcher.mail = FailingFetchMail(self.messages, fail_uids)
+        messages = parse_messages(self.fetcher.fetch_messages(list(self.messages)), 'example.com',
+                                  self.fetcher.metrics)
+        for uid, fields in messages:
+            self.fetcher.buffer.add(self.fetcher.build_email_message(uid, fields))
+        self.fetcher.buffer.flush()
+
+    def test_failed_chunk_stops_checkpoint(self):
+        with self.assertRaises(imaplib.IMAP4.error):
+            self.sync(fail_uids={3})
+        folder = MailFolder.objects.get(id=self.fetcher.folder.id)
+        self.assertEqual(folder.last_uid, 2)
+        self.assertEqual(sorted(folder.messages.values_list('uid', flat=True)), [1, 2])
+
+    def test_all_chunks_advance_checkpoint(self):
+        self.sync(fail_uids=set())
+        self.assertEqual(MailFolder.objects.get(id=self.fetcher.folder.id).last_uid, 6)
+
+    def test_rejected_message_skipped(self):
+        bulk_create = EmailMessage.objects.bulk_create
+
+        def reject_message_3(objs, **kwargs):
+            if any(obj.message_id == '<3@example.com>' for obj in objs):
+                raise DataError('value too long for type character varying(255)')
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(EmailMessage.objects, 'bulk_create', side_effect=reject_message_3):
+            self.sync(fail_uids=set())
+        folder = MailFolder.objects.get(id=self.fetcher.folder.id)
+        self.assertEqual(folder.last_uid, 6)
+        self.assertEqual(sorted(folder.messages.values_list('uid', flat=True)), [1, 2, 4, 5, 6])
+
+
+class SelectedMail:
+    """
+    Заглушка сессии imaplib после SELECT: ответы UIDVALIDITY, HIGHESTMODSEQ
+    и EXISTS, пустой результат UID SEARCH.
+    """
+
+    capabilities = ('IMAP4REV1', 'CONDSTORE')
+
+    def response(self, name):
+        return name, [{'UIDVALIDITY': b'1', 'HIGHESTMODSEQ': b'500', 'EXISTS': b'0'}[name]]
+
+    def uid(self, command, *args):
+        return 'OK', [b'']
+
+
+class ModseqTests(TestCase):
+    def setUp(self):
+        self.account = EmailAccount.objects.create(email='user@example.com', password='x', provider='example.com')
+        self.fetcher = EmailFetcher(self.account)
+        self.fetcher.mail = SelectedMail()
+
+    @override_settings(EMAIL_SYNC_FLAGS=False)
+    def test_not_saved_without_flag_sync(self):
+        self.fetcher.sync()
+        self.assertIsNone(MailFolder.objects.get(account=self.account).highest_modseq)
+
+    @override_settings(EMAIL_SYNC_FLAGS=True)
+    def test_saved_with_flag_sync(self):
+        self.fetcher.sync()
+        self.assertEqual(MailFolder.objects.get(account=self.account).highest_modseq, 500)
+
+
+class SessionErrorTests(TestCase):
+    def setUp(self):
+        self.account = EmailAccount.objects.create(email='user@example.com', password='x', provider='example.com')
+        self.mail = mock.Mock()
+
+    def test_session_closed_after_sync_error(self):
+        fetcher = EmailFetcher(self.account)
+
+        def connect():
+            fetcher.mail = self.mail
+
+        with mock.patch.object(fetcher, 'connect', side_effect=connect), \
+                mock.patch.object(fetcher, 'sync', side_effect=imaplib.IMAP4.error('SELECT failed')), \
+                mock.patch('app.tasks.email_processing.connection_pool') as pool:
+            with self.assertRaises(imaplib.IMAP4.error):
+                fetcher.fetch_and_process_emails()
+        pool.discard.assert_called_once_with(self.mail)
+        pool.release.assert_not_called()
+
+    def test_async_session_closed_after_sync_error(self):
+        from .tasks.async_processing import AsyncEmailFetcher
+        fetcher = AsyncEmailFetcher(self.account)
+        self.mail.logout = mock.AsyncMock()
+
+        async def connect():
+            fetcher.mail = self.mail
+
+        with mock.patch.object(fetcher, 'aconnect', side_effect=connect), \
+                mock.patch.object(fetcher, 'arun_sync', side_effect=imaplib.IMAP4.error('SELECT failed')):
+            with self.assertRaises(imaplib.IMAP4.error):
+                fetcher.fetch_and_process_emails()
+        self.mail.logout.assert_awaited_once()
+        self.assertIsNone(fetcher.mail)
+
+    def test_session_closed_after_body_load_error(self):
+        folder = MailFolder.objects.create(account=self.account, name='INBOX')
+        message = mock.Mock(folder=folder, uid=1)
+        fetcher = EmailBodyFetcher(self.account)
+
+        def connect():
+            fetcher.mail = self.mail
+
+        with mock.patch.object(fetcher, 'connect', side_effect=connect), \
+                mock.patch.object(fetcher, 'load_bodies', side_effect=imaplib.IMAP4.abort('socket error')), \
+                mock.patch('app.tasks.email_processing.connection_pool') as pool:
+            with self.assertRaises(imaplib.IMAP4.abort):
+                fetcher.load_message_body(message)
+        pool.discard.assert_called_once_with(self.mail)
+        pool.release.assert_not_called()
+
+
+class MessageBodyViewTests(TestCase):
+    def setUp(self):
+        self.account = EmailAccount.objects.create(email='user@example.com', password='x', provider='example.com')
+        self.other_account = EmailAccount.objects.create(email='other@example.com', password='x',
+                                                         provider='example.com')
+        self.folder = MailFolder.objects.create(account=self.account, name='INBOX')
+        self.loaded = self.create_message(1, 'Text')
+        self.unloaded = self.create_message(2, '', body_loaded=False)
+        self.addCleanup(cache.clear)
+
+    def create_message(self, uid, body, body_loaded=True):
+        content = MessageContent.objects.create(account=self.account, body=body, body_loaded=body_loaded)
+        return EmailMessage.objects.create(account=self.account, folder=self.folder, content=content, uid=uid,
+                                           subject='Test', send_date=SEND_DATE, receive_date=SEND_DATE,
+                                           message_id=f'<{uid}@example.com>', body_loaded=body_loaded)
+
+    def login(self, account):
+        session = self.client.session
+        session['account_id'] = account.id
+        session.save()
+
+    def get_body(self, message):
+        return self.client.get(f'/messages/{message.id}/body/')
+
+    def test_requires_session_account(self):
+        self.assertEqual(self.get_body(self.loaded).status_code, 403)
+
+    def test_other_account_message_not_found(self):
+        self.login(self.other_account)
+        self.assertEqual(self.get_body(self.loaded).status_code, 404)
+
+    def test_own_message(self):
+        self.login(self.account)
+        response = self.get_body(self.loaded)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['body'], 'Text')
+
+    def test_message_without_uid(self):
+        EmailMessage.objects.filter(id=self.unloaded.id).update(uid=None)
+        self.login(self.account)
+        with mock.patch('app.views.EmailBodyFetcher') as fetcher_class:
+            self.assertEqual(self.get_body(self.unloaded).status_code, 409)
+        fetcher_class.assert_not_called()
+
+    def test_no_free_provider_slot(self):
+        acquire_provider_slots('example.com', 'sync', 1000)
+        self.login(self.account)
+        with mock.patch('app.views.EmailBodyFetcher') as fetcher_class:
+            response = self.get_body(self.unloaded)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        fetcher_class.assert_not_called()
+
+    def test_loads_body_and_releases_slot(self):
+        self.login(self.account)
+        with mock.patch('app.views.EmailBodyFetcher') as fetcher_class:
+            self.assertEqual(self.get_body(self.unloaded).status_code, 200)
+        fetcher_class.return_value.load_message_body.assert_called_once()
+        self.assertEqual(len(acquire_provider_slots('example.com', 'sync', 1000)),
+                         provider_connection_limit('example.com'))
+
+
+class IMAPConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.account = EmailAccount(id=1, email='user@example.com', provider='example.com')
+        self.pool = IMAPConnectionPool(max_idle=60)
+        self.addCleanup(cache.clear)
+
+    def test_pooled_session_keeps_provider_slots_free(self):
+        self.pool.release(self.account, mock.Mock())
+        self.assertEqual(len(acquire_provider_slots('example.com', 'sync', 1000)),
+                         provider_connection_limit('example.com'))
+
+    def test_reuses_released_session(self):
+        mail = mock.Mock()
+        self.pool.release(self.account, mail)
+        self.assertIs(self.pool.acquire(self.account, mock.Mock()), mail)
+
+    def test_close_provider(self):
+        mail = mock.Mock()
+        self.pool.release(self.account, mail)
+        self.pool.close_provider('example.com')
+        mail.logout.assert_called_once()
+        connect = mock.Mock()
+        self.assertIs(self.pool.acquire(self.account, connect), connect.return_value)
+
+
+@override_settings(EMAIL_IDLE_MAX_CONNECTIONS=0, EMAIL_IDLE_RECONNECT_DELAY=30, EMAIL_IDLE_RECONNECT_DELAY_MAX=100)
+class IdleWatcherTests(TestCase):
+    def setUp(self):
+        self.account = EmailAccount.objects.create(email='user@example.com', password='x', provider='example.com')
+        self.watcher = IdleWatcher(self.account.id, threading.Event())
+
+    def test_reconnect_delay_grows(self):
+        self.assertEqual([self.watcher.reconnect_delay() for _ in range(4)], [30, 60, 100, 100])
+
+    def test_no_slot_logged_once(self):
+        with mock.patch('app.tasks.idle.logger') as logger, \
+                mock.patch('app.tasks.idle.EmailFetcher') as fetcher_class:
+            for _ in range(3):
+                self.watcher.watch()
+        logger.info.assert_called_once()
+        fetcher_class.assert_not_called()
+
+
+class FetchResponseTests(SimpleTestCase):
+    def test_build_uid_set(self):
+        self.assertEqual(build_uid_set([10, 9, 1, 2, 3, 7, 3]), '1:3,7,9:10')
+        self.assertEqual(build_uid_set(['5']), '5')
+        self.assertEqual(build_uid_set([]), '')
+
+    def test_chunked(self):
+        self.assertEqual(list(chunked([1, 2, 3, 4, 5], 2)), [[1, 2], [3, 4], [5]])
+
+    def test_literals_and_lists(self):
+        data = [
+            (b'1 (UID 5 FLAGS (\\Seen \\Flagged) RFC822 {4}', b'Body'), b')',
+            (b'2 (UID 6 BODY[HEADER.FIELDS (SUBJECT DATE)] {3}', b'abc'), b' FLAGS ())',
+            b'3 (UID 7 BODYSTRUCTURE ("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 4 1))',
+        ]
+        self.assertEqual(list(iter_fetch_response(data)), [
+            (1, {'UID': '5', 'FLAGS': ['\\Seen', '\\Flagged'], 'RFC822': b'Body'}),
+            (2, {'UID': '6', 'BODY[HEADER.FIELDS (SUBJECT DATE)]': b'abc', 'FLAGS': []}),
+            (3, {'UID': '7', 'BODYSTRUCTURE': ['text', 'plain', ['charset', 'utf-8'], None, None, '7bit', '4', '1']}),
+        ])
+
+    def test_quoted_string_escapes(self):
+        self.assertEqual(list(iter_fetch_response([b'1 (UID 8 X "a \\"q\\" b")'])), [(1, {'UID': '8', 'X': 'a "q" b'})])
+
+    def test_streams_messages(self):
+        def data():
+            yield (b'1 (UID 5 RFC822 {4}', b'Body')
+            yield b')'
+            raise AssertionError('ответ прочитан дальше первого письма')
+
+        self.assertEqual(next(iter_fetch_response(data())), (1, {'UID': '5', 'RFC822': b'Body'}))
+
+
+class ProgressReporterTests(SimpleTestCase):
+    def setUp(self):
+        self.channel_layer = mock.Mock(group_send=mock.AsyncMock())
+        self.reporter = ProgressReporter(self.channel_layer, 'progress.1', max_rate=2, min_delta=5)
+        self.now = 100.0
+        patcher = mock.patch('app.tasks.progress.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(cache.clear)
+
+    def test_rate_limited(self):
+        self.assertTrue(self.reporter.update('Получение', 10))
+        self.now += 0.1
+        self.assertFalse(self.reporter.update('Получение', 50))
+        self.now += 0.5
+        self.assertTrue(self.reporter.update('Получение', 50))
+        self.assertEqual(self.channel_layer.group_send.await_count, 2)
+
+    def test_small_change_skipped(self):
+        self.reporter.update('Получение', 10)
+        self.now += 1
+        self.assertFalse(self.reporter.update('Получение', 12))
+        self.assertTrue(self.reporter.update('Получение', 15))
+
+    def test_force_sent(self):
+        self.reporter.update('Получение', 10)
+        self.assertTrue(self.reporter.update('Все сообщения получены', 100, force=True))
+
+    def test_snapshot_keeps_last_progress(self):
+        self.reporter.update('Получение', 40)
+        self.reporter.update('Чтение сообщений', force=True)
+        self.assertEqual(cache.get(snapshot_key('progress.1')), {'status': 'Чтение сообщений', 'progress': 40})
+
+
+@override_settings(EMAIL_HTML_TO_TEXT='stream')
+class HTMLToTextTests(SimpleTestCase):
+    samples = [
+        '<html><head><style>p {color: red}</style><title>T</title></head><body><p>Привет,&nbsp;мир &amp; &#1041;</p>'
+        '\n\n  <script>var a = 1;</script><br>Строка<br/>дальше</body></html>',
+        '<div>a <b>b</b>\n   <i>c</i></div><!-- comment --><pre>  x\n  y  </pre>   <textarea>  </textarea>',
+        '<p>Unclosed <b>bold <i>italic</p> tail &copy &unknown; <![CDATA[raw]]> '
+        '<ruby>漢<rp>(</rp><rt>kan</rt><rp>)</rp></ruby>',
+        '<table><tr><td>1</td>\n<td>2</td></tr></table><img src=x></img>end',
+    ]
+
+    def test_matches_bs4(self):
+        for sample in self.samples:
+            with self.subTest(sample=sample):
+                self.assertEqual(html_to_text(sample), BeautifulSoup(sample, 'html.parser').get_text())
+
+    def test_chunks_match_whole_document(self):
+        for sample in self.samples:
+            with self.subTest(sample=sample):
+                chunks = [sample[i:i + 7] for i in range(0, len(sample), 7)]
+                self.assertEqual(html_to_text(chunks), html_to_text(sample))
+
+    def test_max_length(self):
+        self.assertEqual(html_to_text('<p>' + 'x' * 1000 + '</p><p>tail</p>', max_length=10), 'x' * 10)
+
+    def test_body_max_length(self):
+        message = email.message_from_bytes(build_raw_email(body=b'a' * 50))
+        self.assertEqual(get_email_body_content(message, max_length=20), 'a' * 20)
+
+
+def build_attachment_email(data, filename='report.bin', encoding='base64'):
+    """
+    Письмо с текстом и вложением data (bytes) в кодировке передачи encoding.
+    """
+    message = MIMEMultipart()
+    message['Subject'] = 'Attachment'
+    message.attach(MIMEText('Text', 'plain', 'utf-8'))
+    attachment = MIMEApplication(data, _encoder=encode_base64 if encoding == 'base64' else encode_quopri)
+    attachment.add_header('Content-Disposition', 'attachment', filename=filename)
+    message.attach(attachment)
+    return email.message_from_bytes(message.as_bytes())
+
+
+class AttachmentTests(SimpleTestCase):
+    data = bytes(range(256)) * 1000
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        override = override_settings(MEDIA_ROOT=media_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def get_part(self, encoding):
+        return build_attachment_email(self.data, encoding=encoding).get_payload()[1]
+
+    def test_iter_base64(self):
+        part = self.get_part('base64')
+        self.assertGreater(len(part.get_payload()), CHUNK_SIZE)
+        self.assertEqual(b''.join(iter_base64(part.get_payload())), self.data)
+
+    def test_iter_base64_without_padding(self):
+        self.assertEqual(b''.join(iter_base64('YWJjZA')), b'abcd')
+
+    def test_iter_quoted_printable(self):
+        part = self.get_part('quoted-printable')
+        self.assertEqual(b''.join(iter_quoted_printable(part.get_payload())), part.get_payload(decode=True))
+
+    def test_identical_attachments_stored_once(self):
+        first, = extract_attachments(build_attachment_email(self.data, 'first.bin'))
+        second, = extract_attachments(build_attachment_email(self.data, 'second.bin'))
+        self.assertEqual(first['sha256'], hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(first['file'], second['file'])
+        self.assertEqual((first['filename'], second['filename']), ('first.bin', 'second.bin'))
+        self.assertEqual(first['size'], len(self.data))
+        with open(os.path.join(settings.MEDIA_ROOT, first['file']), 'rb') as file:
+            self.assertEqual(file.read(), self.data)
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, 'attachments', 'tmp')), [])
+
+
+class VanishedTests(SimpleTestCase):
+    def test_parse_vanished(self):
+        self.assertEqual(parse_vanished([b'(EARLIER) 1:3,7', b'VANISHED 10:8', '12', None, b'garbage']),
+                         [(1, 3), (7, 7), (8, 10), (12, 12)])
+
+    def test_changed_since_modifier(self):
+        self.assertEqual(changed_since_modifier(500, qresync=True), '(CHANGEDSINCE 500 VANISHED)')
+        self.assertEqual(changed_since_modifier(500, qresync=False), '(CHANGEDSINCE 500)')
+
+    def test_format_flags(self):
+        self.assertEqual(format_flags(['\\Seen', '\\Flagged']), '\\Flagged \\Seen')
+        self.assertEqual(format_flags(None), '')
+
+    def test_diff_flags(self):
+        local = {1: '', 2: '\\Seen', 3: ''}
+        remote = {1: '\\Seen', 2: '\\Seen', 4: ''}
+        self.assertEqual(diff_flags(local, remote), ({1: '\\Seen'}, [3]))
+
+
+class ApplyChangesTests(TestCase):
+    def setUp(self):
+        account = EmailAccount.objects.create(email='user@example.com', password='x', provider='example.com')
+        self.folder = MailFolder.objects.create(account=account, name='INBOX')
+        content = MessageContent.objects.create(account=account, body='Text', body_loaded=True)
+        EmailMessage.objects.bulk_create([
+            EmailMessage(account=account, folder=self.folder, content=content, uid=uid, subject='Test',
+                         send_date=SEND_DATE, receive_date=SEND_DATE, message_id=f'<{uid}@example.com>')
+            for uid in range(1, 11)
+        ])
+
+    def test_flags_and_vanished(self):
+        updated, deleted = apply_changes(self.folder, {1: '\\Seen', 2: '\\Seen', 3: '\\Flagged'},
+                                         vanished_uids=[4], vanished_ranges=[(8, 10)])
+        self.assertEqual((updated, deleted), (3, 4))
+        self.assertEqual(dict(self.folder.messages.exclude(flags='').values_list('uid', 'flags')),
+                         {1: '\\Seen', 2: '\\Seen', 3: '\\Flagged'})
+        self.assertEqual(sorted(self.folder.messages.values_list('uid', flat=True)), [1, 2, 3, 5, 6, 7])
+
+    def test_fetch_changed_flags(self):
+        self.folder.highest_modseq = 500
+        fetcher = EmailFetcher(self.folder.account)
+        fetcher.folder = self.folder
+        fetcher.mail = mock.Mock(capabilities=('IMAP4REV1', 'QRESYNC'))
+        fetcher.mail.uid.return_value = 'OK', [b'1 (UID 3 FLAGS (\\Seen) MODSEQ (600))',
+                                               b'2 (UID 4 MODSEQ (601) FLAGS ())']
+        fetcher.mail.response.return_value = 'VANISHED', [b'(EARLIER) 5:6']
+        self.assertEqual(fetcher.fetch_changed_flags(10), ({3: '\\Seen', 4: ''}, [(5, 6)]))
+        fetcher.mail.uid.assert_called_once_with('fetch', '1:10', '(UID FLAGS)', '(CHANGEDSINCE 500 VANISHED)')
+
+
+class ListResponseTests(SimpleTestCase):
+    data = [
+        b'(\\HasNoChildren) "/" "Sent Items"',
+        b'(\\HasNoChildren \\Trash) "/" Trash',
+        (b'(\\HasNoChildren) "/" {15}', b'&BBgEQQRFBB4-"d'),
+        b'(\\Noselect \\HasChildren) "/" "[Gmail]"',
+        b'(\\HasNoChildren \\All) "/" "[Gmail]/All Mail"',
+        b'(\\HasNoChildren) NIL "Escaped \\"name\\""',
+        b'(\\HasNoChildren) "/" inbox',
+    ]
+
+    def test_parse_list_response(self):
+        self.assertEqual(parse_list_response(self.data), [
+            ('Sent Items', {'\\hasnochildren'}),
+            ('Trash', {'\\hasnochildren', '\\trash'}),
+            ('&BBgEQQRFBB4-"d', {'\\hasnochildren'}),
+            ('[Gmail]', {'\\noselect', '\\haschildren'}),
+            ('[Gmail]/All Mail', {'\\hasnochildren', '\\all'}),
+            ('Escaped "name"', {'\\hasnochildren'}),
+            ('INBOX', {'\\hasnochildren'}),
+        ])
+
+    def test_literal_as_separate_line(self):
+        # aioimaplib присылает литерал отдельной строкой
+        self.assertEqual(parse_list_response([b'() "/" {4}', b'Test']), [('Test', set())])
+
+    @override_settings(EMAIL_SYNC_FOLDERS=['*'], EMAIL_SKIP_FOLDER_FLAGS=['\\All', '\\Junk', '\\Trash'])
+    def test_select_folders(self):
+        self.assertEqual(select_folders(parse_list_response(self.data)),
+                         ['INBOX', 'Sent Items', '&BBgEQQRFBB4-"d', 'Escaped "name"'])
+
+    @override_settings(EMAIL_SYNC_FOLDERS=['INBOX', 'Sent*'], EMAIL_SKIP_FOLDER_FLAGS=[])
+    def test_folder_patterns(self):
+        self.assertEqual(select_folders(parse_list_response(self.data)), ['INBOX', 'Sent Items'])
+
+    def test_quote_folder(self):
+        self.assertEqual(quote_folder('Escaped "name"\\'), '"Escaped \\"name\\"\\\\"')
+
+
+class MessagePageTests(TestCase):
+    def setUp(self):
+        self.account = EmailAccount.objects.create(email='user@example.com', password='x', provider='example.com')
+        folder = MailFolder.objects.create(account=self.account, name='INBOX')
+        content = MessageContent.objects.create(account=self.account, body='Text', body_loaded=True)
+        # По три письма на каждую дату: граница страницы проходит внутри одной даты
+        EmailMessage.objects.bulk_create([
+            EmailMessage(account=self.account, folder=folder, content=content, uid=uid, subject=f'Message {uid}',
+                         send_date=SEND_DATE + timedelta(hours=uid // 3), receive_date=SEND_DATE,
+                         message_id=f'<{uid}@example.com>')
+            for uid in range(1, 12)
+        ])
+
+    def test_cursor_round_trip(self):
+        for send_date in (SEND_DATE + timedelta(microseconds=7), datetime(1960, 5, 1, tzinfo=timezone.utc)):
+            message = EmailMessage(id=42, send_date=send_date)
+            self.assertEqual(decode_cursor(encode_cursor(message)), (send_date, 42))
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            decode_cursor('abc')
+
+    def test_pages_cover_list_once(self):
+        queryset = get_message_queryset(self.account)
+        expected = list(queryset.values_list('id', flat=True))
+        seen = []
+        cursor = None
+        while True:
+            messages, cursor = get_page(get_message_queryset(self.account), cursor, page_size=4)
+            seen.extend(message.id for message in messages)
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(seen), 11)
+
+    def test_last_full_page_has_no_cursor(self):
+        messages, cursor = get_page(get_message_queryset(self.account), page_size=11)
+        self.assertEqual((len(messages), cursor), (11, None))
+
+
+class SyncQueueTests(SimpleTestCase):
+    def setUp(self):
+        self.addCleanup(cache.clear)
+        patcher = mock.patch('app.tasks.fetch_emails.fetch_emails.apply_async')
+        self.apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_queued_once(self):
+        task_id, queued = queue_sync(1)
+        self.assertTrue(queued)
+        self.assertEqual(queue_sync(1), (task_id, False))
+        self.apply_async.assert_called_once()
+        self.assertEqual(self.apply_async.call_args.kwargs['task_id'], task_id)
+        self.assertEqual(busy_accounts([1, 2]), {1})
+
+    def test_running_sync_returned(self):
+        SyncLease(1, 'running-task').acquire()
+        self.assertEqual(queue_sync(1), ('running-task', False))
+        self.apply_async.assert_not_called()
+
+
+class SyncLeaseTests(SimpleTestCase):
+    def setUp(self):
+        self.addCleanup(cache.clear)
+
+    def test_exclusive(self):
+        lease = SyncLease(1, 'first')
+        self.assertTrue(lease.acquire())
+        self.assertFalse(SyncLease(1, 'second').acquire())
+        lease.release()
+        second = SyncLease(1, 'second')
+        self.assertTrue(second.acquire())
+        second.release()
+
+    def test_foreign_lock_not_released(self):
+        SyncLease(1, 'owner').acquire()
+        release_sync_lock(1, 'other')
+        self.assertEqual(active_sync(1), 'owner')
+
+    @override_settings(EMAIL_SYNC_LOCK_LEASE=0.3)
+    def test_heartbeat_renews_lock_and_slots(self):
+        lease = SyncLease(1, 'owner')
+        # Без продления слот истёк бы вместе с арендой
+        with override_settings(EMAIL_SYNC_LOCK_TIMEOUT=0.3):
+            lease.slots = acquire_provider_slots('example.com', 'owner', 1)
+        self.assertTrue(lease.acquire())
+        time.sleep(0.6)
+        self.assertEqual(active_sync(1), 'owner')
+        self.assertTrue(cache.get(lease.slots[0]))
+        lease.release()
+        self.assertIsNone(active_sync(1))
+
+
+@override_settings(EMAIL_FALLBACK_CHARSETS=['utf-8', 'cp1251'])
+class CharsetTests(SimpleTestCase):
+    def test_resolve_charset(self):
+        self.assertEqual(resolve_charset(' "Windows-1251"'), 'cp1251')
+        self.assertEqual(resolve_charset('win-1251'), 'cp1251')
+        self.assertEqual(resolve_charset('UTF8'), 'utf-8')
+        self.assertEqual(resolve_charset('gb2312'), 'gb18030')
+        self.assertIsNone(resolve_charset('x-unknown'))
+        self.assertIsNone(resolve_charset(None))
+
+    def test_decode_bytes_fallback(self):
+        self.assertEqual(decode_bytes('Привет'.encode('cp1251'), None), 'Привет')
+        self.assertEqual(decode_bytes('Привет'.encode(), 'x-unknown'), 'Привет')
+        self.assertEqual(decode_bytes(b'\xff', 'utf-8'), '�')
+
+    def test_guess_charset_cut_character(self):
+        # Двухбайтовый символ разрезан границей выборки SNIFF_BYTES
+        self.assertEqual(guess_charset(b'a' * (SNIFF_BYTES - 1) + 'я'.encode()), 'utf-8')
+
+    def test_decode_header_text(self):
+        self.assertEqual(decode_header_text('Plain subject'), 'Plain subject')
+        self.assertEqual(decode_header_text('=?utf-8?B?0J/RgNC40LLQtdGC?=world'), 'Привет world')
+        self.assertEqual(decode_header_text('=?koi8-r?B?8NLJ18XU?= =?koi8-r?B?IM3J0g==?='), 'Привет мир')
+        self.assertEqual(decode_header_text('Re: =?x-unknown?Q?abc?='), 'Re: abc')
+
+
+class RawArchiveTests(TestCase):
+    def setUp(self):
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        override = override_settings(EMAIL_RAW_ARCHIVE_DIR=archive_dir.name, EMAIL_RAW_ARCHIVE_SEGMENT_SIZE=300,
+                                     EMAIL_PARSE_WORKERS=0)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.account = EmailAccount.objects.create(email='user@example.com', password='x', provider='example.com')
+        self.folder = MailFolder.objects.create(account=self.account, name='INBOX')
+        self.messages = {uid: build_raw_email(subject=f'Message {uid}'.encode(),
+                                              message_id=f'<{uid}@example.com>'.encode(),
+                                              body=f'Body {uid} '.encode() * 20) for uid in range(1, 6)}
+        # Импорт по требованию, как в EmailFetcher: zstandard нужен только архиву
+        from .tasks import archive
+        self.archive = archive
+
+    def write_archive(self, uids):
+        writer = self.archive.RawArchiveWriter(self.account)
+        for uid in uids:
+            writer.append(self.folder, uid, self.messages[uid])
+        writer.flush()
+        writer.close()
+
+    def test_round_trip(self):
+        self.write_archive([1, 2, 3])
+        self.write_archive([4, 5])
+        entries = list(self.folder.raw_messages.order_by('uid'))
+        self.assertGreater(len({entry.segment for entry in entries}), 1)
+        with self.archive.RawArchiveReader(self.account) as reader:
+            self.assertEqual({entry.uid: reader.read(entry) for entry in entries}, self.messages)
+
+    def test_reader_sees_appended_data(self):
+        with override_settings(EMAIL_RAW_ARCHIVE_SEGMENT_SIZE=10 ** 6):
+            self.write_archive([1])
+            with self.archive.RawArchiveReader(self.account) as reader:
+                first = self.folder.raw_messages.get(uid=1)
+                self.assertEqual(reader.read(first), self.messages[1])
+                self.write_archive([2])
+                self.assertEqual(reader.read(self.folder.raw_messages.get(uid=2)), self.messages[2])
+
+    def test_rewritten_message_replaces_index(self):
+        self.write_archive([1])
+        self.write_archive([1])
+        self.assertEqual(self.folder.raw_messages.count(), 1)
+
+    def test_reprocess_account(self):
+        self.write_archive([1, 2])
+        for uid in (1, 2):
+            fields = {'subject': f'Message {uid}', 'send_date': SEND_DATE, 'message_id': f'<{uid}@example.com>',
+                      'content_key': None, 'body': '', 'preview': '', 'body_loaded': False}
+            EmailMessageBuffer(self.account).write([build_email_message(fields, account=self.account,
+                                                                        folder=self.folder, uid=uid)])
+        self.assertEqual(self.archive.reprocess_account(self.account), 2)
+        message = self.folder.messages.select_related('content').get(uid=2)
+        self.assertTrue(message.body_loaded)
+        self.assertEqual(message.content.body, 'Body 2 ' * 20)
+
+
+class ImportSourceTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write_file(self, name, data):
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+    def test_iter_mbox(self):
+        path = self.write_file('Archive.mbox', (
+            b'From sender@example.com Mon Jan  1 10:00:00 2024\n'
+            b'Subject: First\n\n>From the start\n>>From quoted\nText\n\n'
+            b'From sender@example.com Mon Jan  1 11:00:00 2024\n'
+            b'Subject: Second\n\nLast\n'
+        ))
+        self.assertEqual([raw_email for raw_email, _ in iter_mbox(path)], [
+            b'Subject: First\n\nFrom the start\n>From quoted\nText\n',
+            b'Subject: Second\n\nLast\n',
+        ])
+
+    def test_iter_mbox_empty(self):
+        self.assertEqual(list(iter_mbox(self.write_file('empty.mbox', b''))), [])
+
+    def test_maildir_flags(self):
+        self.assertEqual(maildir_flags('1700000000.M1P2.host:2,FRS'), '\\Flagged \\Answered \\Seen')
+        self.assertEqual(maildir_flags('1700000000.M1P2.host'), '')
+
+    def test_maildir_sources(self):
+        self.write_file('Mail/cur/1.host:2,S', b'Subject: Read\n\nText')
+        self.write_file('Mail/new/2.host', b'Subject: New\n\nText')
+        self.write_file('Mail/.Archive.2020/cur/3.host:2,', b'Subject: Old\n\nText')
+        os.makedirs(os.path.join(self.directory, 'Mail/.Archive.2020/new'))
+        sources = import_sources(os.path.join(self.directory, 'Mail'))
+        self.assertEqual([name for name, _ in sources], ['Mail', 'Mail/Archive/2020'])
+        self.assertEqual(list(sources[0][1]), [(b'Subject: Read\n\nText', '\\Seen'), (b'Subject: New\n\nText', '')])
+
+    def test_eml_sources(self):
+        self.write_file('Export/b/2.eml', b'Subject: Second\n\nText')
+        self.write_file('Export/a/1.EML', b'Subject: First\n\nText')
+        self.write_file('Export/notes.txt', b'not a message')
+        (name, messages), = import_sources(os.path.join(self.directory, 'Export'), 'Imported')
+        self.assertEqual(name, 'Imported')
+        self.assertEqual([raw_email for raw_email, _ in messages],
+                         [b'Subject: First\n\nText', b'Subject: Second\n\nText'])
+
+
+@override_settings(EMAIL_PARSE_WORKERS=0)
+class EmailImporterTests(TestCase):
+    def test_reimport_skips_saved_messages(self):
+        account = EmailAccount.objects.create(email='user@example.com', password='x', provider='example.com')
+        messages = [(build_raw_email(message_id=b'<1@example.com>'), '\\Seen'),
+                    (build_raw_email(message_id=None, body=b'No Message-ID'), '')]
+        for _ in range(2):
+            result = EmailImporter(account).run([('Imported', iter(messages))])
+        self.assertEqual((result['messages'], result['saved']), (2, 2))
+        folder = MailFolder.objects.get(account=account, name='Imported')
+        self.assertEqual(folder.messages.count(), 2)
+        self.assertEqual(folder.messages.get(message_id='<1@example.com>').flags, '\\Seen')
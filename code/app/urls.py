@@ -1,9 +1,19 @@
 from django.urls import path
 
-from .views import EmailLoginView, MessageListView, RefreshMessagesView
+from .views import (
+    EmailLoginView,
+    MessageBodyView,
+    MessageListView,
+    MessagePageView,
+    MetricsView,
+    RefreshMessagesView,
+)
 
 urlpatterns = [
     path('', EmailLoginView.as_view(), name='email_login'),
     path('messages/', MessageListView.as_view(), name='message_list'),
+    path('messages/page/', MessagePageView.as_view(), name='message_page'),
+    path('messages/<int:pk>/body/', MessageBodyView.as_view(), name='message_body'),
     path('refresh_messages/', RefreshMessagesView.as_view(), name='refresh_messages'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
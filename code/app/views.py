@@ -1,11 +1,27 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render, redirect
 from django.views import View
 from django.views.generic import ListView
+from loguru import logger
 
 from .forms import EmailLoginForm
+from .message_list import get_message_queryset, get_page, mark_messages_seen, message_row
 from .models import EmailAccount, EmailMessage
-from .tasks import fetch_emails
+from .tasks import queue_sync
+from .tasks.email_processing import EmailBodyFetcher
+from .tasks.locks import acquire_provider_slot, release_provider_slot
+from .tasks.metrics import metrics_enabled, render_metrics
+
+
+def get_session_account(request):
+    """
+    Аккаунт, выбранный на странице входа, или None.
+    """
+    account_id = request.session.get('account_id')
+    if account_id is None:
+        return None
+    return EmailAccount.objects.filter(id=account_id).first()
 
 
 class EmailLoginView(View):
@@ -35,36 +51,111 @@ class EmailLoginView(View):
                 )
                 account_id = account.id
 
-            fetch_emails.delay(account_id)
+            request.session['account_id'] = account_id
+            queue_sync(account_id)
             return redirect('message_list')
         return render(request, self.template_name, {'form': form})
 
 
 class MessageListView(ListView):
-    model = EmailMessage
     template_name = 'app/message_list.html'
     context_object_name = 'messages'
-    ordering = ['-send_date']
+
+    def get(self, request, *args, **kwargs):
+        self.account = get_session_account(request)
+        if self.account is None:
+            return redirect('email_login')
+        return super().get(request, *args, **kwargs)
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        # Первая страница списка, следующие подгружаются через MessagePageView
         show_new = self.request.GET.get('show_new', 'false') == 'true'
-        if show_new:
-            queryset = queryset.filter(is_new=True)
-        return queryset
+        query = self.request.GET.get('q', '').strip()
+        messages, self.next_cursor = get_page(get_message_queryset(self.account, show_new, query),
+                                              page_size=settings.MESSAGES_PAGE_SIZE)
+        return messages
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['show_new'] = self.request.GET.get('show_new', 'false') == 'true'
+        context['next_cursor'] = self.next_cursor
+        context['query'] = self.request.GET.get('q', '').strip()
         return context
 
 
+class MessagePageView(View):
+    def get(self, request):
+        account = get_session_account(request)
+        if account is None:
+            return JsonResponse({'status': 'error'}, status=403)
+
+        show_new = request.GET.get('show_new', 'false') == 'true'
+        query = request.GET.get('q', '').strip()
+        try:
+            messages, next_cursor = get_page(get_message_queryset(account, show_new, query), request.GET.get('before'),
+                                             page_size=settings.MESSAGES_PAGE_SIZE)
+        except (ValueError, OverflowError):
+            return JsonResponse({'status': 'error'}, status=400)
+        return JsonResponse({'messages': [message_row(message) for message in messages], 'next': next_cursor})
+
+
 class RefreshMessagesView(View):
     def get(self, request):
-        account = EmailAccount.objects.first()  # Получаем первый аккаунт, измените при необходимости
-        if account:
-            # Сбрасываем флаг is_new для существующих сообщений
-            EmailMessage.objects.filter(account=account).update(is_new=False)
-            fetch_emails.delay(account.id)
-            return JsonResponse({'status': 'ok'})
-        return JsonResponse({'status': 'error'}, status=400)
+        account = get_session_account(request)
+        if account is None:
+            return JsonResponse({'status': 'error'}, status=400)
+
+        # Существующие письма перестают быть новыми: обновляется одна строка аккаунта
+        mark_messages_seen(account)
+        # Если синхронизация уже идёт, новая не ставится: возвращается id идущей задачи,
+        # её прогресс приходит в сокет аккаунта
+        task_id, queued = queue_sync(account.id)
+        return JsonResponse({'status': 'ok', 'task_id': task_id, 'queued': queued})
+
+
+class MessageBodyView(View):
+    def get(self, request, pk):
+        account = get_session_account(request)
+        if account is None:
+            return JsonResponse({'status': 'error'}, status=403)
+
+        # Письмо другого аккаунта не отличается от несуществующего
+        message = (EmailMessage.objects.select_related('account', 'folder', 'content')
+                   .filter(pk=pk, account=account).first())
+        if message is None:
+            return JsonResponse({'status': 'error'}, status=404)
+
+        if not message.body_loaded:
+            # UID письма потерян после смены UIDVALIDITY и будет восстановлен синхронизацией
+            if message.uid is None:
+                return JsonResponse({'status': 'error'}, status=409)
+
+            # Письмо синхронизировано без текста: загружаем его с сервера при открытии.
+            # Загрузка занимает слот провайдера наравне с синхронизацией
+            slot = acquire_provider_slot(account.provider, f'message-body-{message.id}')
+            if slot is None:
+                response = JsonResponse({'status': 'busy'}, status=503)
+                response['Retry-After'] = str(settings.EMAIL_PROVIDER_RETRY_DELAY)
+                return response
+            try:
+                EmailBodyFetcher(account).load_message_body(message)
+            except Exception as e:
+                logger.error(f"Не удалось загрузить текст письма {pk}: {e}")
+                return JsonResponse({'status': 'error'}, status=502)
+            finally:
+                release_provider_slot(slot)
+        return JsonResponse({'id': message.id, 'body': message.content.body, 'body_loaded': message.body_loaded})
+
+
+class MetricsView(View):
+    """
+    Метрики Prometheus процесса веб-сервера и глубина очередей Celery.
+    Метрики воркеров приходят через Pushgateway или PROMETHEUS_MULTIPROC_DIR.
+    """
+
+    def get(self, request):
+        if not metrics_enabled():
+            return HttpResponse('Метрики отключены или не установлен prometheus_client',
+                                status=503, content_type='text/plain; charset=utf-8')
+        body, content_type = render_metrics()
+        return HttpResponse(body, content_type=content_type)
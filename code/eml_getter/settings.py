@@ -67,6 +67,13 @@ CHANNEL_LAYERS = {
     },
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f"redis://{env('REDIS_HOST')}:{env('REDIS_PORT')}/2",
+    },
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -100,6 +107,9 @@ STATICFILES_DIRS = [
     BASE_DIR / 'app' / 'static' / 'app',
 ]
 
+MEDIA_URL = '/media/'
+MEDIA_ROOT = env.str('MEDIA_ROOT', str(BASE_DIR / 'media'))
+
 LANGUAGE_CODE = 'ru-ru'
 TIME_ZONE = 'Europe/Moscow'
 DATETIME_FORMAT = 'Y/m/d H:i:s'
@@ -119,6 +129,75 @@ CELERY_BROKER_URL = f"redis://{env('REDIS_HOST')}:{env('REDIS_PORT')}"
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_BACKEND = 'django-db'
+CELERY_BEAT_SCHEDULE = {
+    'fetch-emails-every-5-minutes': {
+        'task': 'app.tasks.fetch_all_emails',
+        'schedule': env.int('EMAIL_SYNC_INTERVAL', 300),
+    },
+    'cleanup-message-contents-daily': {
+        'task': 'app.tasks.cleanup_message_contents',
+        'schedule': env.int('EMAIL_CONTENT_CLEANUP_INTERVAL', 24 * 60 * 60),
+    },
+}
+
+# Синхронизация почты
+EMAIL_FETCHER_ENGINE = env.str('EMAIL_FETCHER_ENGINE', 'sync')  # 'sync' (imaplib) или 'async' (aioimaplib)
+EMAIL_IMAP_HOST = env.str('EMAIL_IMAP_HOST', '')  # один IMAP-сервер для всех аккаунтов (пусто — imap.<провайдер>)
+EMAIL_IMAP_PORT = env.int('EMAIL_IMAP_PORT', 993)
+EMAIL_IMAP_SSL = env.bool('EMAIL_IMAP_SSL', True)  # False — подключение без TLS (локальный тестовый сервер)
+EMAIL_ASYNC_ACCOUNTS_PER_TASK = env.int('EMAIL_ASYNC_ACCOUNTS_PER_TASK', 20)  # аккаунтов в одной задаче async-движка
+EMAIL_ASYNC_MAX_CONCURRENCY = env.int('EMAIL_ASYNC_MAX_CONCURRENCY', 20)  # одновременных синхронизаций в процессе
+EMAIL_SYNC_MODE = env.str('EMAIL_SYNC_MODE', 'full')  # 'full' (RFC822) или 'headers' (заголовки и превью)
+EMAIL_HEADERS_TEXT_BYTES = env.int('EMAIL_HEADERS_TEXT_BYTES', 4096)  # байт текстовой части для превью в режиме 'headers'
+EMAIL_BODY_BACKFILL = env.bool('EMAIL_BODY_BACKFILL', True)  # фоновая загрузка полных текстов после синхронизации заголовков
+EMAIL_SAVE_ATTACHMENTS = env.bool('EMAIL_SAVE_ATTACHMENTS', True)  # сохранять вложения в MEDIA_ROOT/attachments
+EMAIL_SYNC_FOLDERS = env.list('EMAIL_SYNC_FOLDERS', ['*'])  # шаблоны имён папок (fnmatch): INBOX,Sent*,...
+EMAIL_SKIP_FOLDER_FLAGS = env.list('EMAIL_SKIP_FOLDER_FLAGS', ['\\All', '\\Junk', '\\Trash'])  # атрибуты LIST пропускаемых папок
+EMAIL_ACCOUNT_MAX_CONNECTIONS = env.int('EMAIL_ACCOUNT_MAX_CONNECTIONS', 3)  # одновременных IMAP-сессий на аккаунт (по папкам)
+EMAIL_SYNC_FLAGS = env.bool('EMAIL_SYNC_FLAGS', True)  # синхронизация флагов и удалений (CONDSTORE/QRESYNC)
+EMAIL_FLAGS_CHUNK_SIZE = env.int('EMAIL_FLAGS_CHUNK_SIZE', 5000)  # UID в одном запросе флагов без CONDSTORE
+EMAIL_FETCH_CHUNK_SIZE = env.int('EMAIL_FETCH_CHUNK_SIZE', 500)  # писем в одном UID FETCH
+EMAIL_PERSIST_BATCH_SIZE = env.int('EMAIL_PERSIST_BATCH_SIZE', 200)  # писем в одном bulk_create
+EMAIL_PARSE_WORKERS = env.int('EMAIL_PARSE_WORKERS', 0)  # процессов для разбора писем (0 — в потоке загрузки, у async-движка — в отдельном потоке)
+EMAIL_FALLBACK_CHARSETS = env.list('EMAIL_FALLBACK_CHARSETS', ['utf-8', 'cp1251'])  # для текста без charset или с неизвестным
+EMAIL_HEADER_CACHE_SIZE = env.int('EMAIL_HEADER_CACHE_SIZE', 4096)  # декодированных заголовков в LRU-кэше процесса
+EMAIL_HTML_TO_TEXT = env.str('EMAIL_HTML_TO_TEXT', 'stream')  # 'stream' (HTMLTextExtractor) или 'bs4'
+EMAIL_BODY_MAX_LENGTH = env.int('EMAIL_BODY_MAX_LENGTH', 100_000)  # символов текста письма (0 — без ограничения)
+EMAIL_PREVIEW_LENGTH = env.int('EMAIL_PREVIEW_LENGTH', 100)  # символов в EmailMessage.preview (не больше 255)
+EMAIL_RAW_ARCHIVE = env.bool('EMAIL_RAW_ARCHIVE', False)  # хранить исходные письма в сжатых сегментах (нужен пакет zstandard)
+EMAIL_RAW_ARCHIVE_DIR = env.str('EMAIL_RAW_ARCHIVE_DIR', os.path.join(BASE_DIR, 'raw_archive'))  # каталог сегментов по аккаунтам
+EMAIL_RAW_ARCHIVE_SEGMENT_SIZE = env.int('EMAIL_RAW_ARCHIVE_SEGMENT_SIZE', 256 * 1024 * 1024)  # после этого размера начинается новый сегмент, байт
+EMAIL_RAW_ARCHIVE_LEVEL = env.int('EMAIL_RAW_ARCHIVE_LEVEL', 3)  # уровень сжатия zstd
+EMAIL_CONTENT_CLEANUP_GRACE = env.int('EMAIL_CONTENT_CLEANUP_GRACE', 60 * 60)  # не удалять тексты, привязанные к письмам позже этого, сек
+EMAIL_PROVIDER_MAX_CONNECTIONS = env.int('EMAIL_PROVIDER_MAX_CONNECTIONS', 10)  # одновременных IMAP-сессий на провайдера
+EMAIL_PROVIDER_CONNECTION_LIMITS = env.dict('EMAIL_PROVIDER_CONNECTION_LIMITS', {}, subcast_values=int)  # gmail.com=15,...
+EMAIL_PROVIDER_RETRY_DELAY = env.int('EMAIL_PROVIDER_RETRY_DELAY', 30)  # ожидание свободного слота, сек
+EMAIL_SYNC_MAX_RETRIES = env.int('EMAIL_SYNC_MAX_RETRIES', 5)  # повторов синхронизации после обрыва соединения
+EMAIL_SYNC_RETRY_BACKOFF = env.int('EMAIL_SYNC_RETRY_BACKOFF', 5)  # первая задержка повтора, удваивается с каждой попыткой, сек
+EMAIL_SYNC_RETRY_BACKOFF_MAX = env.int('EMAIL_SYNC_RETRY_BACKOFF_MAX', 10 * 60)  # наибольшая задержка повтора, сек
+EMAIL_SYNC_LOCK_TIMEOUT = env.int('EMAIL_SYNC_LOCK_TIMEOUT', 30 * 60)  # время жизни слотов провайдера и отметок очереди, сек
+EMAIL_SYNC_LOCK_LEASE = env.int('EMAIL_SYNC_LOCK_LEASE', 60)  # аренда блокировки аккаунта, продлевается во время синхронизации, сек
+EMAIL_IMAP_POOL_MAX_IDLE = env.int('EMAIL_IMAP_POOL_MAX_IDLE', 120)  # время жизни свободной сессии в пуле, сек (0 — без пула), слотов провайдера не занимает
+EMAIL_IDLE_MAX_CONNECTIONS = env.int('EMAIL_IDLE_MAX_CONNECTIONS', 5)  # IDLE-сессий на провайдера, сверх EMAIL_PROVIDER_MAX_CONNECTIONS
+EMAIL_IDLE_TIMEOUT = env.int('EMAIL_IDLE_TIMEOUT', 29 * 60)  # перезапуск IDLE по RFC 2177, сек
+EMAIL_IDLE_RECONNECT_DELAY = env.int('EMAIL_IDLE_RECONNECT_DELAY', 30)  # первая пауза перед переподключением, удваивается при неудачах подряд, сек
+EMAIL_IDLE_RECONNECT_DELAY_MAX = env.int('EMAIL_IDLE_RECONNECT_DELAY_MAX', 15 * 60)  # наибольшая пауза перед переподключением, сек
+EMAIL_IDLE_RESCAN_INTERVAL = env.int('EMAIL_IDLE_RESCAN_INTERVAL', 60)  # поиск новых аккаунтов, сек
+PROGRESS_MAX_UPDATES_PER_SECOND = env.float('PROGRESS_MAX_UPDATES_PER_SECOND', 4)
+PROGRESS_MIN_DELTA = env.int('PROGRESS_MIN_DELTA', 1)  # минимальное изменение прогресса, %
+PROGRESS_SNAPSHOT_TIMEOUT = env.int('PROGRESS_SNAPSHOT_TIMEOUT', 60 * 60)  # хранение последнего состояния для новых сокетов, сек
+
+# Метрики и профилирование синхронизации
+EMAIL_METRICS_ENABLED = env.bool('EMAIL_METRICS_ENABLED', True)  # метрики Prometheus (нужен пакет prometheus_client)
+EMAIL_METRICS_PER_ACCOUNT = env.bool('EMAIL_METRICS_PER_ACCOUNT', True)  # метка account (при тысячах аккаунтов — False)
+EMAIL_METRICS_PUSHGATEWAY = env.str('EMAIL_METRICS_PUSHGATEWAY', '')  # адрес Pushgateway для метрик воркеров (пусто — не отправлять)
+EMAIL_METRICS_QUEUES = env.list('EMAIL_METRICS_QUEUES', ['celery'])  # очереди Celery, глубина которых отдаётся в /metrics
+EMAIL_PROFILE_SAMPLE_RATE = env.float('EMAIL_PROFILE_SAMPLE_RATE', 0)  # доля синхронизаций под cProfile (0 — без профилирования)
+EMAIL_PROFILE_SLOW_SECONDS = env.float('EMAIL_PROFILE_SLOW_SECONDS', 60)  # профиль сохраняется, если синхронизация дольше, сек
+EMAIL_PROFILE_DIR = env.str('EMAIL_PROFILE_DIR', os.path.join(BASE_DIR, 'logs', 'profiles'))  # каталог файлов .prof
+
+# Список писем
+MESSAGES_PAGE_SIZE = env.int('MESSAGES_PAGE_SIZE', 50)  # писем на странице и в одной подгрузке при прокрутке
 
 LOG_DIR = os.path.join(BASE_DIR, 'logs')
 os.makedirs(LOG_DIR, exist_ok=True)
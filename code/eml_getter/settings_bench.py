@@ -0,0 +1,52 @@
+"""
+Настройки нагрузочных замеров (manage.py bench_sync): SQLite или локальный
+PostgreSQL, channel layer и кэш в памяти. Redis и Celery не нужны.
+
+    export DJANGO_SETTINGS_MODULE=eml_getter.settings_bench
+    python manage.py migrate
+    python manage.py bench_sync --messages 5000
+"""
+import os
+import tempfile
+
+# Базовые настройки читают адреса Redis и PostgreSQL без значений по умолчанию
+for name, value in {
+    'REDIS_HOST': 'localhost',
+    'REDIS_PORT': '6379',
+    'POSTGRES_DB': 'eml_getter_bench',
+    'POSTGRES_USER': 'postgres',
+    'POSTGRES_PASSWORD': 'postgres',
+    'POSTGRES_HOST': 'localhost',
+    'POSTGRES_PORT': '5432',
+}.items():
+    os.environ.setdefault(name, value)
+
+from .settings import *  # noqa: E402,F401,F403
+
+# Отладочный режим копит SQL всех запросов в памяти и искажает замеры
+DEBUG = False
+
+BENCH_DATABASE = env.str('BENCH_DATABASE', 'sqlite')  # 'sqlite' или 'postgres' (база из POSTGRES_*)
+if BENCH_DATABASE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': env.str('BENCH_SQLITE_PATH', os.path.join(tempfile.gettempdir(), 'eml_getter_bench.sqlite3')),
+        }
+    }
+
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+MEDIA_ROOT = env.str('BENCH_MEDIA_ROOT', os.path.join(tempfile.gettempdir(), 'eml_getter_bench_media'))
+
+CELERY_TASK_ALWAYS_EAGER = True